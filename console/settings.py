@@ -73,10 +73,80 @@ TEMPLATES = [
 WSGI_APPLICATION = 'console.wsgi.application'
 ASGI_APPLICATION = 'console.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+# Set REDIS_URL to share monitor groups across several daphne workers
+REDIS_URL = config('REDIS_URL', default='')
+
+# `manage.py serve --workers N` sets these for every worker it starts; each host's samplers run on
+# exactly one of them, so more than one worker needs REDIS_URL
+WORKERS = config('WORKERS', default=1, cast=int)
+WORKER_INDEX = config('WORKER_INDEX', default=0, cast=int)
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
+
+# The credential vault keeps its encrypted entries in the cache, so workers must share it too
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
     }
+
+# Logins are stored encrypted under a key derived from SECRET_KEY unless VAULT_KEY (a Fernet key) is set
+VAULT_KEY = config('VAULT_KEY', default='')
+VAULT_TTL = config('VAULT_TTL', default=8 * 3600, cast=int)
+
+# Pooled SSH connections shared by all websocket consumers in this process
+# Keep the pool at least as large as the biggest fleet so every round reuses a warm login
+SSH_POOL_MAX_CONNECTIONS = config('SSH_POOL_MAX_CONNECTIONS', default=512, cast=int)
+SSH_POOL_IDLE_TIMEOUT = config('SSH_POOL_IDLE_TIMEOUT', default=300, cast=int)
+# zlib on the SSH transport; worth it on slow links to the monitored hosts
+SSH_COMPRESSION = config('SSH_COMPRESSION', default=False, cast=bool)
+
+# Fleet mode samples many hosts from one process; this caps a single request. It never goes past the
+# pool size, since hosts beyond it would be evicted and log in again every round
+FLEET_MAX_HOSTS = config('FLEET_MAX_HOSTS', default=SSH_POOL_MAX_CONNECTIONS, cast=int)
+
+# Sampled host metrics are kept on disk here, rolled up and expired automatically; empty disables it
+HISTORY_DIR = config('HISTORY_DIR', default=str(BASE_DIR / 'history'))
+
+# JSON list of alert rules evaluated on every monitored host; the defaults live in dashboard/alerts.py
+ALERT_RULES_FILE = config('ALERT_RULES_FILE', default='')
+
+# Scraped by Prometheus at /metrics; when set, scrapers must send it as a bearer token
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# LOG_FORMAT=json writes one object per line for log shippers; plain is easier to read locally
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='plain')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+        'json': {'()': 'dashboard.logs.JSONFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': LOG_FORMAT},
+    },
+    'loggers': {
+        'dashboard': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
 }
 
 # Database
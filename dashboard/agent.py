@@ -0,0 +1,342 @@
+import base64
+import json
+import time
+
+#shared by the agents below: sleeps until the next sample is due, applying commands from the
+#server meanwhile ('i <seconds>' retunes the interval, 'n <rows>' the process agent's row count)
+AGENT_WAIT = r'''
+stdin_open = True
+pending = b''
+
+def wait():
+    global interval, top, stdin_open, pending
+    deadline = time.time() + interval
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        if not stdin_open:
+            time.sleep(remaining)
+            return
+        if not select.select([0], [], [], remaining)[0]:
+            return
+        data = os.read(0, 4096)
+        if not data:
+            stdin_open = False
+            continue
+        pending += data
+        while b'\n' in pending:
+            line, pending = pending.split(b'\n', 1)
+            parts = line.split()
+            if len(parts) != 2 or parts[0] not in (b'i', b'n'):
+                continue
+            try:
+                value = float(parts[1])
+            except ValueError:
+                continue
+            if parts[0] == b'n':
+                top = int(value)
+                continue
+            deadline += value - interval
+            interval = value
+'''
+
+#runs on the monitored host; one long-lived process reading /proc and statvfs,
+#one compact json record per line. kept python3.5 compatible for old hosts.
+#the server can retune the interval by writing 'i <seconds>' lines to stdin
+AGENT_SCRIPT = r'''
+import json, os, select, sys, time
+
+interval = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+count = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+top = 0
+PSEUDO = set('proc sysfs devtmpfs devpts tmpfs cgroup cgroup2 securityfs pstore debugfs tracefs mqueue '
+             'hugetlbfs configfs fusectl bpf autofs binfmt_misc rpc_pipefs squashfs nsfs efivarfs ramfs '
+             'selinuxfs fuse.lxcfs'.split())
+MEM_KEYS = ('MemTotal', 'MemFree', 'MemAvailable', 'Buffers', 'Cached', 'SwapTotal', 'SwapFree')
+
+try:
+    DISKS = set(d for d in os.listdir('/sys/block') if not d.startswith(('loop', 'ram', 'zram')))
+except OSError:
+    DISKS = set()
+
+def cpu():
+    rows = []
+    with open('/proc/stat') as f:
+        for line in f:
+            if not line.startswith('cpu'):
+                break
+            rows.append([int(v) for v in line.split()[1:9]])
+    return rows
+
+def mem():
+    info = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            if key in MEM_KEYS:
+                info[key] = int(value.split()[0])
+    return info
+
+def filesystems():
+    seen = set()
+    rows = []
+    with open('/proc/mounts') as f:
+        for line in f:
+            device, mount, fstype = line.split()[:3]
+            if fstype in PSEUDO or device in seen:
+                continue
+            mount = mount.replace('\\040', ' ')
+            try:
+                st = os.statvfs(mount)
+            except OSError:
+                continue
+            if not st.f_blocks:
+                continue
+            if device.startswith('/'):
+                seen.add(device)
+            rows.append([mount, st.f_blocks * st.f_frsize, (st.f_blocks - st.f_bfree) * st.f_frsize,
+                         st.f_bavail * st.f_frsize])
+    return rows
+
+def load():
+    with open('/proc/loadavg') as f:
+        return [float(v) for v in f.read().split()[:3]]
+
+def net():
+    rx = tx = 0
+    with open('/proc/net/dev') as f:
+        for line in f.readlines()[2:]:
+            name, data = line.split(':', 1)
+            if name.strip() == 'lo':
+                continue
+            fields = data.split()
+            rx += int(fields[0])
+            tx += int(fields[8])
+    return [rx, tx]
+
+def io():
+    read = written = 0
+    with open('/proc/diskstats') as f:
+        for line in f:
+            fields = line.split()
+            if fields[2] in DISKS:
+                read += int(fields[5])
+                written += int(fields[9])
+    return [read * 512, written * 512]
+
+''' + AGENT_WAIT + r'''
+emitted = 0
+while True:
+    record = {'t': time.time(), 'cpu': cpu(), 'mem': mem(), 'fs': filesystems(), 'load': load(), 'net': net(), 'io': io()}
+    sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+    sys.stdout.flush()
+    emitted += 1
+    if emitted == count:
+        break
+    wait()
+'''
+
+#shell fallback for hosts without python3: total cpu, memory and / only, and forks df once per sample.
+#it ignores interval changes and keeps the rate it was started with
+AGENT_FALLBACK = r'''
+emitted=0
+while :; do
+  read -r _ u n s i w q sq st _ < /proc/stat
+  t=0; a=0
+  while read -r k v _; do
+    case $k in MemTotal:) t=$v;; MemAvailable:) a=$v;; esac
+  done < /proc/meminfo
+  set -- $(df -Pk / | { while read -r fs size used avail rest; do d=$size; e=$used; f=$avail; done; echo $d $e $f; })
+  printf '{"cpu":[[%s,%s,%s,%s,%s,%s,%s,%s]],"mem":{"MemTotal":%s,"MemAvailable":%s},"fs":[["/",%s,%s,%s]]}\n' \
+    $u $n $s $i $w $q $sq $st $t $a $(($1 * 1024)) $(($2 * 1024)) $(($3 * 1024))
+  emitted=$((emitted + 1))
+  [ "$emitted" = COUNT ] && break
+  sleep INTERVAL
+done
+'''
+
+
+#process table agent: scans /proc/[pid]/stat (and io, where readable) every interval and sends only the
+#union of the top rows by cpu, memory and io, so the wire cost does not grow with the process count.
+#cpu% comes from utime+stime tick deltas against the previous scan; pids are matched with their
+#start time so a reused pid does not inherit another process's ticks. python3.5 compatible as well
+PROCESS_SCRIPT = r'''
+import heapq, json, os, select, sys, time
+
+interval = float(sys.argv[1])
+top = int(sys.argv[2])
+HZ = os.sysconf('SC_CLK_TCK')
+PAGE = os.sysconf('SC_PAGE_SIZE')
+#share of one core the scans may use; on very busy hosts the interval stretches instead
+BUDGET = 0.05
+
+def read(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 4096)
+    finally:
+        os.close(fd)
+
+def io_bytes(pid):
+    #only readable for our own processes unless we are root
+    try:
+        data = read('/proc/' + pid + '/io')
+    except OSError:
+        return None
+    total = 0
+    for line in data.split(b'\n'):
+        if line.startswith(b'read_bytes:') or line.startswith(b'write_bytes:'):
+            total += int(line.split()[1])
+    return total
+
+previous = {}
+last = None
+
+def scan():
+    global previous, last
+    now = time.time()
+    elapsed = now - last if last else 0
+    seen = {}
+    rows = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            data = read('/proc/' + pid + '/stat')
+        except OSError:
+            continue
+        #the name is in parentheses and may itself contain spaces or parentheses
+        close = data.rfind(b')')
+        name = data[data.find(b'(') + 1:close].decode('utf-8', 'replace')
+        fields = data[close + 2:].split()
+        ticks = int(fields[11]) + int(fields[12])
+        started = fields[19]
+        io = io_bytes(pid)
+        seen[pid] = (started, ticks, io)
+        cpu = rate = 0
+        old = previous.get(pid)
+        if old is not None and old[0] == started and elapsed:
+            cpu = round(100.0 * (ticks - old[1]) / HZ / elapsed, 1)
+            if io is not None and old[2] is not None:
+                rate = int((io - old[2]) / elapsed)
+        rows.append([int(pid), name, fields[0].decode(), int(fields[17]), cpu, int(fields[21]) * PAGE, rate])
+    previous = seen
+    last = now
+    picked = {}
+    for column in (4, 5, 6):
+        for row in heapq.nlargest(top, rows, key=lambda row: row[column]):
+            picked[row[0]] = row
+    return {'t': now, 'count': len(rows), 'scan': round(time.time() - now, 4), 'rows': list(picked.values())}
+
+''' + AGENT_WAIT + r'''
+#the first scan only primes the tick counters
+cost = scan()['scan']
+while True:
+    if cost / BUDGET > interval:
+        time.sleep(cost / BUDGET - interval)
+    wait()
+    record = scan()
+    cost = record['scan']
+    record['interval'] = max(interval, cost / BUDGET)
+    sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+    sys.stdout.flush()
+'''
+
+
+def agent_command(interval=1.0, count=0):
+    #count=0 streams forever, count=1 takes a single snapshot and exits
+    encoded = base64.b64encode(AGENT_SCRIPT.encode()).decode()
+    fallback = AGENT_FALLBACK.replace('INTERVAL', str(interval)).replace('COUNT', str(count))
+    return (
+        'if command -v python3 >/dev/null 2>&1; then '
+        f'exec python3 -u -c "import base64; exec(base64.b64decode(\'{encoded}\'))" {interval} {count}; '
+        f'else {fallback}fi'
+    )
+
+
+async def start_agent(conn, interval=1.0):
+    return await conn.create_process(agent_command(interval), encoding=None)
+
+
+async def start_process_agent(conn, interval, rows):
+    encoded = base64.b64encode(PROCESS_SCRIPT.encode()).decode()
+    command = (
+        'command -v python3 >/dev/null 2>&1 || { echo "the process view needs python3 on the host" >&2; exit 127; }; '
+        f'exec python3 -u -c "import base64; exec(base64.b64decode(\'{encoded}\'))" {interval} {rows}'
+    )
+    return await conn.create_process(command, encoding=None)
+
+def set_agent_interval(process, interval):
+    process.stdin.write(f'i {interval:g}\n'.encode())
+
+
+def set_agent_rows(process, rows):
+    process.stdin.write(f'n {rows}\n'.encode())
+
+
+def cpu_percent(cur, prev):
+    total = sum(cur) - sum(prev)
+    idle = (cur[3] + cur[4]) - (prev[3] + prev[4])
+    return 100.0 * (total - idle) / total if total > 0 else 0.0
+
+
+class MetricsParser:
+    def __init__(self):
+        self._buffer = b''
+        self._prev = None
+
+    def feed(self, data):
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b'\n')
+        samples = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            samples.append(self.sample(record))
+        return samples
+
+    def rate(self, record, key, elapsed):
+        prev = self._prev.get(key) if self._prev else None
+        if not prev or not elapsed:
+            return [0.0] * len(record[key])
+        return [max(0.0, (c - p) / elapsed) for c, p in zip(record[key], prev)]
+
+    def sample(self, record):
+        record.setdefault('t', time.time())
+        record.setdefault('load', [0.0, 0.0, 0.0])
+        record.setdefault('net', [0, 0])
+        record.setdefault('io', [0, 0])
+        prev = self._prev or {}
+        elapsed = record['t'] - prev['t'] if prev else 0
+        prev_cpu = prev.get('cpu') or [[0] * 8 for _ in record['cpu']]
+        if len(prev_cpu) != len(record['cpu']):
+            prev_cpu = [[0] * 8 for _ in record['cpu']]
+        cpu = [cpu_percent(cur, old) for cur, old in zip(record['cpu'], prev_cpu)]
+        net = self.rate(record, 'net', elapsed)
+        io = self.rate(record, 'io', elapsed)
+        self._prev = record
+
+        mem = {k: v * 1024 for k, v in record['mem'].items()}
+        total = mem.get('MemTotal', 0)
+        available = mem.get('MemAvailable', mem.get('MemFree', 0) + mem.get('Buffers', 0) + mem.get('Cached', 0))
+        return {
+            't': time.time(),
+            'cpu': {'total': cpu[0], 'cores': cpu[1:]},
+            'mem': {
+                'total': total,
+                'used': total - available,
+                'available': available,
+                'free': mem.get('MemFree', available),
+                'buffers': mem.get('Buffers', 0),
+                'cached': mem.get('Cached', 0),
+                'swap_total': mem.get('SwapTotal', 0),
+                'swap_used': mem.get('SwapTotal', 0) - mem.get('SwapFree', 0),
+            },
+            'fs': [{'mount': m, 'total': t, 'used': u, 'avail': a} for m, t, u, a in record['fs']],
+            'load': record['load'],
+            'net': {'rx': net[0], 'tx': net[1], 'rx_total': record['net'][0], 'tx_total': record['net'][1]},
+            'io': {'read': io[0], 'write': io[1], 'read_total': record['io'][0], 'write_total': record['io'][1]},
+        }
@@ -0,0 +1,160 @@
+import json
+import math
+import operator
+
+from django.conf import settings
+
+from .metrics import Counter
+from .timeseries import FIELDS
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+KINDS = ('threshold', 'rate')
+#a gap longer than this between samples (nobody was watching) restarts every pending window
+MAX_GAP = 90
+
+DEFAULT_RULES = [
+    {'name': 'disk-full', 'field': 'disk', 'op': '>', 'value': 90, 'for': 300, 'clear': 85},
+    {'name': 'cpu-sustained', 'field': 'cpu', 'op': '>', 'value': 95, 'for': 300, 'clear': 80},
+    {'name': 'mem-high', 'field': 'mem', 'op': '>', 'value': 95, 'for': 120, 'clear': 90},
+    #percentage points per minute, smoothed over the window
+    {'name': 'disk-filling', 'kind': 'rate', 'field': 'disk', 'op': '>', 'value': 1, 'window': 600, 'clear': 0.2},
+]
+
+alerts_fired = Counter('alerts_fired_total', 'Alerts that started firing', labels=('rule',))
+
+
+class Rule:
+    #a threshold rule compares the sampled value; a rate rule compares its smoothed change per minute
+    def __init__(self, name, field, value, op='>', kind='threshold', window=300, clear=None, severity='warning',
+                 **options):
+        if field not in FIELDS:
+            raise ValueError(f'Alert rule {name}: unknown field {field}')
+        if op not in OPERATORS or kind not in KINDS:
+            raise ValueError(f'Alert rule {name}: bad op or kind')
+        self.name = name
+        self.field = field
+        self.column = FIELDS.index(field)
+        self.op = op
+        self.compare = OPERATORS[op]
+        self.value = float(value)
+        #hysteresis: once firing, the rule only resolves when the other side of `clear` is reached
+        self.clear = float(value if clear is None else clear)
+        self.kind = kind
+        self.window = float(window)
+        self.duration = float(options.get('for', 0))
+        self.severity = severity
+
+    def breached(self, measure):
+        return self.compare(measure, self.value)
+
+    def cleared(self, measure):
+        #with op '>' and clear below value, anything between the two keeps a firing alert firing
+        return not self.compare(measure, self.clear)
+
+    def describe(self, measure, status):
+        unit = '%/min' if self.kind == 'rate' else '%'
+        what = f'{self.field} rate' if self.kind == 'rate' else self.field
+        if status == 'resolved':
+            return f'{what} {measure:.1f}{unit}, back past {self.clear:g}{unit}'
+        held = f' for {self.duration:g}s' if self.duration else ''
+        return f'{what} {measure:.1f}{unit} {self.op} {self.value:g}{unit}{held}'
+
+
+class State:
+    #constant size whatever the window: pending start, firing flag and the rate smoother
+    __slots__ = ('since', 'firing', 'last_t', 'last_v', 'rate', 'warm')
+
+    def __init__(self):
+        self.since = None
+        self.firing = None
+        self.last_t = None
+        self.last_v = None
+        self.rate = 0.0
+        self.warm = None
+
+
+class HostAlerts:
+    def __init__(self, rules):
+        self.rules = rules
+        self.states = [State() for _ in rules]
+        self.last_t = None
+        #rule name -> the event that started it, for viewers joining while it fires
+        self.firing = {}
+
+    def update(self, t, values):
+        #returns only transitions, so a sustained breach is announced once
+        events = []
+        gap = self.last_t is None or t - self.last_t > MAX_GAP
+        self.last_t = t
+        for rule, state in zip(self.rules, self.states):
+            value = values[rule.column]
+            if gap:
+                state.since = None
+            if rule.kind == 'rate':
+                measure = self.smooth(rule, state, t, value, gap)
+                if measure is None:
+                    continue
+            else:
+                measure = value
+            if state.firing is None:
+                if not rule.breached(measure):
+                    state.since = None
+                    continue
+                if state.since is None:
+                    state.since = t
+                if t - state.since >= rule.duration:
+                    state.firing = state.since
+                    alerts_fired.inc(rule=rule.name)
+                    event = self.firing[rule.name] = self.event(rule, state, 'firing', t, measure)
+                    events.append(event)
+            elif rule.cleared(measure):
+                events.append(self.event(rule, state, 'resolved', t, measure))
+                del self.firing[rule.name]
+                state.firing = None
+                state.since = None
+        return events
+
+    def smooth(self, rule, state, t, value, gap):
+        #exponentially weighted change per minute; copes with the sampler changing its interval
+        if gap or state.last_t is None or t <= state.last_t:
+            if gap or state.last_t is None:
+                state.rate = 0.0
+                state.warm = t
+            state.last_t, state.last_v = t, value
+            return None
+        dt = t - state.last_t
+        alpha = 1 - math.exp(-dt / rule.window)
+        state.rate += alpha * (60 * (value - state.last_v) / dt - state.rate)
+        state.last_t, state.last_v = t, value
+        #the smoother starts at zero; give it one window before trusting it
+        if t - state.warm < rule.window:
+            return None
+        return state.rate
+
+    def event(self, rule, state, status, t, measure):
+        return {
+            'rule': rule.name,
+            'status': status,
+            'severity': rule.severity,
+            'field': rule.field,
+            'value': round(measure, 2),
+            'since': state.firing,
+            't': t,
+            'message': rule.describe(measure, status),
+        }
+
+    def active(self):
+        return list(self.firing.values())
+
+
+def load_rules():
+    path = getattr(settings, 'ALERT_RULES_FILE', '')
+    if path:
+        with open(path) as f:
+            specs = json.load(f)
+    else:
+        specs = DEFAULT_RULES
+    return [Rule(**spec) for spec in specs]
+
+
+rules = load_rules()
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import posixpath
+import shlex
+import time
+
+from .dircache import dir_key
+from .remotefs import remote_command, remote_copy, remote_path
+from .transfer import clamp
+
+OPERATIONS = ('delete', 'move', 'copy', 'mkdir', 'chmod')
+MAX_OPERATIONS = 2000
+DEFAULT_PARALLEL = 8
+MAX_PARALLEL = 32
+#copies and recursive chmods each open an exec channel, and sshd caps sessions per connection
+#(MaxSessions, 10 by default) across sftp, the metrics agent and everything else; see MAX_WATCHES
+MAX_EXEC_PARALLEL = 3
+
+
+def operation_paths(op):
+    if op.get('op') in ('move', 'copy'):
+        return [op.get('src'), op.get('dst')]
+    return [op.get('path')]
+
+
+def parse_mode(mode):
+    #'755' and 0o755 both mean rwxr-xr-x
+    if isinstance(mode, str):
+        return int(mode, 8)
+    return int(mode)
+
+
+def ancestors(path):
+    #a relative path lives under the login directory, '.'
+    while path != '.':
+        parent = posixpath.dirname(path) or '.'
+        if parent == path:
+            return
+        yield parent
+        path = parent
+
+
+class Batch:
+    def __init__(self, operations, fs, conn, send, parallel=None, home='.'):
+        if not isinstance(operations, list) or not operations:
+            raise ValueError('A batch needs a list of operations')
+        if len(operations) > MAX_OPERATIONS:
+            raise ValueError(f'Too many operations: {len(operations)} (limit {MAX_OPERATIONS})')
+        for op in operations:
+            if op.get('op') not in OPERATIONS:
+                raise ValueError(f"Unknown batch operation: {op.get('op')}")
+            if not all(operation_paths(op)):
+                raise ValueError(f"Missing path for {op['op']}")
+        self.operations = operations
+        self.fs = fs
+        self.conn = conn
+        self.send = send
+        #the login directory, so '~/a' and '/home/u/a' are seen as the same path
+        self.home = home
+        self.slots = asyncio.Semaphore(clamp(parallel, DEFAULT_PARALLEL, MAX_PARALLEL))
+        self.exec_slots = asyncio.Semaphore(MAX_EXEC_PARALLEL)
+        self.succeeded = 0
+        self.failed = 0
+        #(path, recursive) pairs whose cached listings are now stale
+        self.touched = []
+
+    def dependencies(self):
+        #an operation waits for every earlier one touching the same path, an ancestor or a
+        #descendant of it, so 'mkdir a' then 'move x -> a/x' keep their order; the rest run in parallel
+        last_touch = {}
+        below = {}
+        done = [asyncio.Event() for _ in self.operations]
+        waits = []
+        for i, op in enumerate(self.operations):
+            paths = [dir_key(p, self.home) for p in operation_paths(op)]
+            deps = set()
+            for path in paths:
+                for key in (path, *ancestors(path)):
+                    if key in last_touch:
+                        deps.add(last_touch[key])
+                deps.update(below.get(path, ()))
+            for path in paths:
+                last_touch[path] = i
+                for parent in ancestors(path):
+                    below.setdefault(parent, []).append(i)
+            deps.discard(i)
+            waits.append([done[d] for d in deps])
+        return done, waits
+
+    async def run(self):
+        started = time.monotonic()
+        done, waits = self.dependencies()
+        await asyncio.gather(*(self.run_one(i, op, done[i], waits[i]) for i, op in enumerate(self.operations)))
+        status = 'success' if not self.failed else 'partial' if self.succeeded else 'error'
+        await self.send(text_data=json.dumps({
+            'action': 'batch_end',
+            'status': status,
+            'total': len(self.operations),
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'elapsed': round(time.monotonic() - started, 3),
+        }), error=status == 'error')
+
+    async def run_one(self, index, op, done, waits):
+        try:
+            for event in waits:
+                await event.wait()
+            async with self.slots:
+                try:
+                    await self.apply(op)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    await self.report(index, op, 'error', str(e))
+                    return
+            self.succeeded += 1
+            await self.report(index, op, 'success')
+        finally:
+            done.set()
+
+    async def apply(self, op):
+        kind = op['op']
+        if kind == 'delete':
+            await self.fs.remove(op['path'])
+            self.touched.append((op['path'], True))
+        elif kind == 'move':
+            await self.fs.rename(op['src'], op['dst'])
+            self.touched += [(op['src'], True), (op['dst'], True)]
+        elif kind == 'copy':
+            async with self.exec_slots:
+                await remote_copy(self.conn, op['src'], op['dst'])
+            self.touched.append((op['dst'], True))
+        elif kind == 'mkdir':
+            await self.fs.mkdir(op['path'])
+            self.touched.append((op['path'], False))
+        elif kind == 'chmod':
+            mode = parse_mode(op.get('mode'))
+            if op.get('recursive'):
+                async with self.exec_slots:
+                    await remote_command(self.conn, f"chmod -R {mode:o} -- {shlex.quote(remote_path(op['path']))}")
+            else:
+                await self.fs.chmod(op['path'], mode)
+            self.touched.append((op['path'], bool(op.get('recursive'))))
+
+    async def report(self, index, op, status, message=None):
+        await self.send(text_data=json.dumps({
+            'action': 'batch_item',
+            'status': status,
+            'index': index,
+            'op': op['op'],
+            'paths': operation_paths(op),
+            'message': message,
+        }), error=status == 'error')
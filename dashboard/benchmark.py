@@ -0,0 +1,374 @@
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import signal
+import statistics
+import tempfile
+import time
+
+import asyncssh
+
+AGENT_ARGS = re.compile(r"b64decode\('[^']*'\)\)\" (\S+) (\d+);")
+USER_PREFIX = 'bench'
+PASSWORD = 'bench'
+#weights of the file actions each simulated dashboard performs between samples
+ACTIONS = (('list_directory', 6), ('read_file', 3), ('list_page', 1), ('search', 1), ('tail', 1))
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        #peak rather than current outside linux, still fine for per-client deltas
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def build_tree(root, dirs, files, seed):
+    #the same seed always produces the same tree, so runs stay comparable
+    rng = random.Random(seed)
+    paths = {'dirs': [], 'files': []}
+    for d in range(dirs):
+        name = f'dir{d:03d}'
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+        paths['dirs'].append(name)
+        for f in range(files):
+            rel = f'{name}/file{f:04d}.log'
+            with open(os.path.join(root, rel), 'w') as out:
+                out.write(''.join(f'{rng.random():.6f} line {i}\n' for i in range(rng.randint(1, 200))))
+            paths['files'].append(rel)
+    return paths
+
+
+class FakeAgent:
+    #answers the metrics agent command with synthetic /proc readings instead of running it
+    def __init__(self, process, interval, count, cores=4):
+        self.process = process
+        self.interval = interval
+        self.count = count
+        self.cores = cores
+        self.ticks = 0
+
+    def record(self):
+        self.ticks += 1
+        busy = 50 * self.ticks
+        cpu = [[busy * (self.cores + 1), 0, busy, 400 * self.ticks, 0, 0, 0, 0]]
+        cpu += [[busy, 0, busy // 4, 100 * self.ticks, 0, 0, 0, 0] for _ in range(self.cores)]
+        return {
+            't': time.time(),
+            'cpu': cpu,
+            'mem': {'MemTotal': 8 << 20, 'MemFree': 2 << 20, 'MemAvailable': 4 << 20, 'Buffers': 1 << 18,
+                    'Cached': 1 << 20, 'SwapTotal': 0, 'SwapFree': 0},
+            'fs': [['/', 100 << 30, 40 << 30, 60 << 30]],
+            'load': [0.5, 0.4, 0.3],
+            'net': [self.ticks * 125000, self.ticks * 25000],
+            'io': [self.ticks * 4096, self.ticks * 8192],
+        }
+
+    async def run(self):
+        stdin = asyncio.ensure_future(self.process.stdin.readline())
+        emitted = 0
+        try:
+            while True:
+                line = json.dumps(self.record(), separators=(',', ':')) + '\n'
+                self.process.stdout.write(line.encode())
+                emitted += 1
+                if emitted == self.count:
+                    break
+                deadline = time.monotonic() + self.interval
+                while (remaining := deadline - time.monotonic()) > 0:
+                    done, _ = await asyncio.wait({stdin}, timeout=remaining)
+                    if not done:
+                        break
+                    command = stdin.result()
+                    if not command:
+                        #stdin closed: the server went away
+                        return
+                    parts = command.split()
+                    if len(parts) == 2 and parts[0] == b'i':
+                        deadline += float(parts[1]) - self.interval
+                        self.interval = float(parts[1])
+                    stdin = asyncio.ensure_future(self.process.stdin.readline())
+        finally:
+            stdin.cancel()
+            self.process.exit(0)
+
+
+class StandInServer(asyncssh.SSHServer):
+    connections = 0
+    active = 0
+
+    def connection_made(self, conn):
+        StandInServer.connections += 1
+        StandInServer.active += 1
+
+    def connection_lost(self, exc):
+        StandInServer.active -= 1
+
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return username.startswith(USER_PREFIX) and password == PASSWORD
+
+
+class StandIn:
+    #a local sshd with a fake metrics agent and an sftp view of a synthetic tree
+    def __init__(self, root):
+        self.root = root
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        key = asyncssh.generate_private_key('ssh-ed25519')
+        self.server = await asyncssh.create_server(
+            StandInServer, '127.0.0.1', 0, server_host_keys=[key], encoding=None,
+            process_factory=self.handle,
+            sftp_factory=lambda chan: asyncssh.SFTPServer(chan, chroot=self.root.encode()),
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, process):
+        #an exception escaping here drops the whole connection, so a client closing the channel
+        #early (a stopped tail, a search at its result limit) just ends the command
+        try:
+            await self.run_command(process)
+        except (BrokenPipeError, asyncssh.Error):
+            pass
+
+    async def run_command(self, process):
+        command = process.command or ''
+        match = AGENT_ARGS.search(command)
+        if match:
+            await FakeAgent(process, float(match.group(1)), int(match.group(2))).run()
+            return
+        #anything else (copies, searches, tails) runs for real inside the synthetic tree, in its own
+        #session like on a real host: cancellable() ends with `kill 0`, which must not reach this process
+        proc = await asyncio.create_subprocess_shell(
+            command, cwd=self.root, start_new_session=True, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        feeding = asyncio.create_task(self.feed(process.stdin, proc.stdin))
+        try:
+            await asyncio.gather(self.pump(proc.stdout, process.stdout), self.pump(proc.stderr, process.stderr))
+            status = await proc.wait()
+        finally:
+            feeding.cancel()
+            if proc.returncode is None:
+                os.killpg(proc.pid, signal.SIGTERM)
+        process.exit(status if status >= 0 else 128 - status)
+
+    async def feed(self, channel, stdin):
+        #closing the channel reaches the command as EOF on its stdin, which is how searches and tails stop
+        try:
+            while True:
+                data = await channel.read(65536)
+                if not data:
+                    break
+                stdin.write(data)
+                await stdin.drain()
+        except (asyncssh.Error, OSError):
+            pass
+        finally:
+            stdin.close()
+
+    async def pump(self, reader, channel):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            channel.write(data)
+
+
+class Client:
+    def __init__(self, index, application, ssh_data, paths, stats, seed):
+        self.index = index
+        self.application = application
+        self.ssh_data = ssh_data
+        self.paths = paths
+        self.stats = stats
+        self.rng = random.Random(seed * 100003 + index)
+        self.communicator = None
+        self.waiting = {}
+        self.next_id = 0
+        self.listing = None
+        self.reader = None
+
+    async def connect(self):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(self.application, '/ws/cpu/')
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError('WebSocket connection refused')
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        #the app's output queue is drained directly; receive_output() would cancel the app on timeout
+        while True:
+            message = await self.communicator.output_queue.get()
+            if message.get('type') == 'websocket.close':
+                return
+            if message.get('text') is None:
+                continue
+            data = json.loads(message['text'])
+            if data.get('action') == 'monitor_sample':
+                self.stats.samples += 1
+                first = self.waiting.pop('first_sample', None)
+                if first is not None and not first.done():
+                    first.set_result(data)
+                continue
+            waiting = self.waiting.get(data.get('request_id'))
+            if waiting is None:
+                continue
+            future, until = waiting
+            #streamed actions are timed to the reply named by `until`, or the first error
+            if until is not None and data.get('action') != until and data.get('status') != 'error':
+                continue
+            del self.waiting[data['request_id']]
+            if not future.done():
+                future.set_result(data)
+
+    async def request(self, action, until=None, **fields):
+        self.next_id += 1
+        request_id = f'{self.index}-{self.next_id}'
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request_id] = (future, until)
+        started = time.perf_counter()
+        await self.communicator.send_json_to({'action': action, 'request_id': request_id,
+                                              'ssh_data': self.ssh_data, **fields})
+        reply = await future
+        self.stats.record(action, time.perf_counter() - started, reply.get('status') == 'success')
+        return reply
+
+    async def start_monitor(self, interval):
+        future = self.waiting['first_sample'] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        await self.communicator.send_json_to({'action': 'start', 'ssh_data': self.ssh_data, 'interval': interval})
+        await future
+        self.stats.record('start', time.perf_counter() - started, True)
+
+    async def work(self, deadline, think):
+        names = [name for name, _ in ACTIONS]
+        weights = [weight for _, weight in ACTIONS]
+        while time.monotonic() < deadline:
+            action = self.rng.choices(names, weights)[0]
+            if action == 'list_directory':
+                reply = await self.request('list_directory', path='~/' + self.rng.choice(self.paths['dirs']),
+                                           page_size=50)
+                self.listing = reply.get('listing')
+            elif action == 'read_file':
+                await self.request('read_file', filepath='~/' + self.rng.choice(self.paths['files']))
+            elif action == 'search':
+                #a content search over one directory, timed until the walk is done
+                await self.request('search', until='search_end', search_id=self.next_id + 1,
+                                   path='~/' + self.rng.choice(self.paths['dirs']), pattern='line 1[0-9]$')
+            elif action == 'tail':
+                #timed to the first lines, then stopped the way the browser stops it
+                tail_id = self.next_id + 1
+                await self.request('tail', until='tail_lines', tail_id=tail_id, lines=20,
+                                   filepath='~/' + self.rng.choice(self.paths['files']))
+                await self.communicator.send_json_to({'action': 'tail_stop', 'tail_id': tail_id})
+            elif self.listing is not None:
+                await self.request('list_page', listing=self.listing, offset=50, page_size=50)
+            await asyncio.sleep(self.rng.uniform(0, think * 2))
+
+    async def close(self):
+        await self.communicator.disconnect()
+        if self.reader is not None:
+            self.reader.cancel()
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.samples = 0
+
+    def record(self, action, elapsed, ok):
+        self.latencies.setdefault(action, []).append(elapsed)
+        if not ok:
+            self.errors[action] = self.errors.get(action, 0) + 1
+
+    def summary(self, elapsed):
+        actions = {}
+        for action, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            cuts = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+            actions[action] = {
+                'count': len(values),
+                'errors': self.errors.get(action, 0),
+                'p50_ms': round(cuts[49] * 1000, 2),
+                'p99_ms': round(cuts[98] * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+                'per_second': round(len(values) / elapsed, 1),
+            }
+        return actions
+
+
+async def run(clients=20, hosts=5, duration=10.0, interval=1.0, think=0.05, dirs=10, files=200, seed=1, log=print):
+    from console.asgi import application
+    from dashboard.history import history
+    from dashboard.pool import pool
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as root:
+        #samples are still written, just not into the real history of 127.0.0.1
+        history_root, history.root = history.root, history.root and os.path.join(root, '.history')
+        paths = build_tree(root, dirs, files, seed)
+        server = StandIn(root)
+        await server.start()
+        StandInServer.connections = 0
+        log(f'Stand-in sshd on port {server.port}, {dirs} dirs x {files} files')
+
+        stats = Stats()
+        baseline = rss_bytes()
+        swarm = []
+        for i in range(clients):
+            #clients are spread over several simulated hosts so pooling and shared monitors are exercised
+            ssh_data = {'host': '127.0.0.1', 'port': server.port, 'user': f'{USER_PREFIX}{i % hosts}',
+                        'password': PASSWORD}
+            client = Client(i, application, ssh_data, paths, stats, seed)
+            await client.connect()
+            swarm.append(client)
+        await asyncio.gather(*(client.start_monitor(interval) for client in swarm))
+        connected_rss = rss_bytes()
+        log(f'{clients} clients connected and sampling')
+
+        started = time.monotonic()
+        await asyncio.gather(*(client.work(started + duration, think) for client in swarm))
+        elapsed = time.monotonic() - started
+        peak_rss = rss_bytes()
+
+        for client in swarm:
+            await client.close()
+        opened = StandInServer.connections
+        pooled = len(pool)
+        await pool.close()
+        await history.close()
+        history.root = history_root
+        await server.stop()
+
+    operations = sum(len(v) for k, v in stats.latencies.items() if k != 'start')
+    return {
+        'config': {'clients': clients, 'hosts': hosts, 'duration': duration, 'interval': interval,
+                   'think': think, 'dirs': dirs, 'files': files, 'seed': seed},
+        'actions': stats.summary(elapsed),
+        'throughput': {
+            'operations_per_second': round(operations / elapsed, 1),
+            'samples_per_second': round(stats.samples / elapsed, 1),
+        },
+        'memory': {
+            'rss_start_mb': round(baseline / 2 ** 20, 1),
+            'rss_peak_mb': round(peak_rss / 2 ** 20, 1),
+            'per_client_kb': round((connected_rss - baseline) / clients / 1024, 1),
+        },
+        'ssh': {'connections_opened': opened, 'pooled_at_end': pooled},
+    }
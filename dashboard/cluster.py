@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .vault import vault
+
+logger = logging.getLogger(__name__)
+
+WORKERS = max(1, getattr(settings, 'WORKERS', 1))
+INDEX = getattr(settings, 'WORKER_INDEX', 0)
+CHANNEL = 'dashboard.worker.{}'
+#viewers on other workers renew their subscriptions this often; the owner drops any not renewed
+#for three periods, so a worker that died does not keep samplers running for nobody
+HEARTBEAT = 15
+EXPIRY = 3 * HEARTBEAT
+
+
+def owner(key):
+    #stable across processes and restarts, unlike hash()
+    digest = hashlib.sha1(repr(tuple(key)).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % WORKERS
+
+
+def is_local(key):
+    return WORKERS == 1 or owner(key) == INDEX
+
+
+def seal(ssh_data):
+    #credentials cross the channel layer (redis) encrypted, like they sit in the vault
+    return vault.fernet.encrypt(json.dumps(ssh_data).encode()).decode()
+
+
+def unseal(token):
+    return json.loads(vault.fernet.decrypt(token.encode(), ttl=EXPIRY))
+
+
+class Cluster:
+    #every worker listens on its own channel for requests about the hosts it owns; samplers for a
+    #host run only on its owner and reach viewers on every worker through the monitor groups
+    def __init__(self):
+        self.handlers = {}
+        self.sweepers = []
+        #(kind, key, channel name) -> (ssh_data, fields), renewed with the owner every heartbeat
+        self.renewals = {}
+        self.task = None
+
+    def on(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def sweeper(self, sweep):
+        self.sweepers.append(sweep)
+
+    def start(self):
+        if WORKERS == 1:
+            return
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        layer = get_channel_layer()
+        heartbeat = asyncio.create_task(self.heartbeat())
+        logger.info('Worker %s of %s listening on %s', INDEX, WORKERS, CHANNEL.format(INDEX))
+        try:
+            while True:
+                message = await layer.receive(CHANNEL.format(INDEX))
+                handler = self.handlers.get(message.get('kind'))
+                if handler is None:
+                    continue
+                try:
+                    await handler(message)
+                except Exception:
+                    logger.exception('Cluster message %s failed', message.get('kind'))
+        finally:
+            heartbeat.cancel()
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT)
+            for (kind, key, channel_name), (ssh_data, fields) in list(self.renewals.items()):
+                try:
+                    await self.send(kind + '.subscribe', key, channel_name, ssh_data, renewal=True, **fields)
+                except Exception as e:
+                    logger.warning('Renewing %s for %s failed: %s', kind, key, e)
+            cutoff = time.monotonic() - EXPIRY
+            for sweep in self.sweepers:
+                await sweep(cutoff)
+
+    async def send(self, kind, key, channel_name, ssh_data=None, **fields):
+        message = {'type': 'cluster.message', 'kind': kind, 'key': list(key), 'channel': channel_name, **fields}
+        if ssh_data is not None:
+            message['ssh'] = seal(ssh_data)
+        await get_channel_layer().send(CHANNEL.format(owner(key)), message)
+
+    async def subscribe(self, kind, key, channel_name, ssh_data, **fields):
+        self.start()
+        self.renewals[(kind, key, channel_name)] = (ssh_data, fields)
+        await self.send(kind + '.subscribe', key, channel_name, ssh_data, **fields)
+
+    async def join(self, kind, key, group, channel_name, ssh_data, **fields):
+        #a start superseded while group_add or the request to the owner is still in flight must not
+        #leave the channel in the group, or the owner sampling for it
+        layer = get_channel_layer()
+        joined = False
+        try:
+            await layer.group_add(group, channel_name)
+            await self.subscribe(kind, key, channel_name, ssh_data, **fields)
+            joined = True
+        finally:
+            if not joined:
+                await layer.group_discard(group, channel_name)
+                await self.unsubscribe(kind, key, channel_name)
+
+    async def update(self, kind, key, channel_name, **fields):
+        entry = self.renewals.get((kind, key, channel_name))
+        if entry is None:
+            return False
+        entry[1].update(fields)
+        await self.send(kind + '.subscribe', key, channel_name, entry[0], renewal=True, **entry[1])
+        return True
+
+    async def unsubscribe(self, kind, key, channel_name):
+        if self.renewals.pop((kind, key, channel_name), None) is not None:
+            await self.send(kind + '.unsubscribe', key, channel_name)
+
+    def forget(self, kind, key, channel_name):
+        #the owner already gave up on this one (sampler error); stop renewing it
+        self.renewals.pop((kind, key, channel_name), None)
+
+
+cluster = Cluster()
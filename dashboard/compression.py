@@ -0,0 +1,91 @@
+import time
+import zlib
+
+from .metrics import Counter
+from .transfer import KIND_DEFLATE, KIND_ZSTD
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#frames smaller than this go out as plain text; per-second samples would only grow
+DEFAULT_THRESHOLD = 1024
+MIN_THRESHOLD = 64
+DEFLATE_LEVEL = 6
+ZSTD_LEVEL = 3
+
+#totals across every socket in this process, for comparing bytes saved against cpu spent
+totals = {'frames': 0, 'compressed': 0, 'raw_bytes': 0, 'sent_bytes': 0, 'cpu_seconds': 0.0}
+Counter('ws_compression_raw_bytes_total', 'Text bytes offered to compression', function=lambda: totals['raw_bytes'])
+Counter('ws_compression_sent_bytes_total', 'Bytes actually sent for those frames', function=lambda: totals['sent_bytes'])
+Counter('ws_compression_cpu_seconds_total', 'CPU time spent compressing', function=lambda: totals['cpu_seconds'])
+
+
+def available():
+    algorithms = ['deflate']
+    if zstandard is not None:
+        algorithms.insert(0, 'zstd')
+    return algorithms
+
+
+def negotiate(offered):
+    #the client lists what it can decode in order of preference; the first one we also have wins
+    for algorithm in offered or ():
+        if algorithm in available():
+            return algorithm
+    return None
+
+
+class Compressor:
+    def __init__(self, algorithm, threshold=None):
+        if algorithm not in available():
+            raise ValueError(f'Compression not available on this server: {algorithm}')
+        self.algorithm = algorithm
+        try:
+            self.threshold = max(MIN_THRESHOLD, int(threshold))
+        except (TypeError, ValueError):
+            self.threshold = DEFAULT_THRESHOLD
+        if algorithm == 'zstd':
+            self.kind = KIND_ZSTD
+            self._compress = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+        else:
+            self.kind = KIND_DEFLATE
+            self._compress = lambda data: zlib.compress(data, DEFLATE_LEVEL)
+        self.stats = {'frames': 0, 'compressed': 0, 'raw_bytes': 0, 'sent_bytes': 0, 'cpu_seconds': 0.0}
+
+    def pack(self, text_data):
+        #returns the binary frame to send instead, or None to send the text as it is
+        raw = text_data.encode()
+        packed = None
+        cpu = 0.0
+        if len(raw) >= self.threshold:
+            started = time.process_time()
+            body = self._compress(raw)
+            cpu = time.process_time() - started
+            if len(body) + 1 < len(raw):
+                packed = bytes([self.kind]) + body
+        self.record(len(raw), len(packed) if packed is not None else len(raw), packed is not None, cpu)
+        return packed
+
+    def record(self, raw, sent, compressed, cpu):
+        for stats in (self.stats, totals):
+            stats['frames'] += 1
+            stats['compressed'] += compressed
+            stats['raw_bytes'] += raw
+            stats['sent_bytes'] += sent
+            stats['cpu_seconds'] += cpu
+
+    def summary(self):
+        stats = self.stats
+        saved = stats['raw_bytes'] - stats['sent_bytes']
+        return {
+            **stats,
+            'cpu_seconds': round(stats['cpu_seconds'], 4),
+            'algorithm': self.algorithm,
+            'threshold': self.threshold,
+            'saved_bytes': saved,
+            'ratio': round(stats['sent_bytes'] / stats['raw_bytes'], 3) if stats['raw_bytes'] else 1.0,
+            #bytes saved per millisecond of compression cpu
+            'saved_per_ms': round(saved / (stats['cpu_seconds'] * 1000), 1) if stats['cpu_seconds'] else None,
+        }
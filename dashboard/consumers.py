@@ -1,38 +1,286 @@
 import json
 import asyncio
-import re
-import asyncssh
+import base64
+import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 import os
+from django.conf import settings
+from .pool import pool, pool_key
+from .remotefs import RemoteFS, VersionConflict
+from .batch import Batch
+from .dircache import DirCache
+from .watcher import DirWatcher
+from .search import Search
+from .tail import Tail
+from .terminal import Terminal
+from .listing import Listings, filter_items, sort_items, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .encoding import SampleEncoder
+from .compression import Compressor, negotiate
+from .dispatch import Dispatcher, Request, current_request, tag
+from .fleet import FleetSampler, DEFAULT_INTERVAL, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+from .monitors import registry, requested_interval
+from .history import history, parse_range
+from .processes import clamp_interval as process_interval, clamp_rows
+from .processes import DEFAULT_INTERVAL as PROCESS_INTERVAL, DEFAULT_ROWS as PROCESS_ROWS, registry as process_registry
+from .vault import vault
+from .metrics import ws_action_seconds, ws_bytes, ws_consumers, ws_errors, ws_send_queue_depth
+from .transfer import Download, Upload, KIND_CHUNK, clamp, unpack_frame
+
+#each watch, search and tail holds an exec channel on the host's one pooled connection, which sshd
+#caps at MaxSessions (10 by default); with sftp, the monitor and process agents, a terminal and
+#MAX_EXEC_PARALLEL batch commands that leaves one of each, which is all the UI keeps open anyway.
+#starting another of a kind replaces the oldest
+MAX_WATCHES = 1
+MAX_SEARCHES = 1
+MAX_TAILS = 1
+#cheap or order-sensitive actions handled as they arrive instead of as tasks; upload chunks
+#(binary frames) are always inline, so the open and finish around them are too
+INLINE_ACTIONS = {'cancel', 'compression', 'compression_stats', 'monitor_config', 'processes_stop', 'search_cancel',
+                  'tail_stop', 'unwatch_directory', 'transfer_write', 'transfer_ack', 'transfer_finish', 'transfer_cancel'}
+#actions that change the remote tree run one at a time in arrival order
+SERIAL_ACTIONS = {'write_file', 'patch_file', 'create_file', 'create_folder', 'delete_file', 'rename', 'batch', 'watch_directory'}
+#a newer request of the same kind makes an older one stale: its task is cancelled and its replies dropped
+SUPERSEDES = {'list_directory': 'navigate', 'history': 'history'}
+
+
+logger = logging.getLogger(__name__)
+
+
+def session_owner(scope):
+    #vault handles are bound to the browser session that logged in
+    session = scope.get('session')
+    return session.session_key if session is not None else None
+
+
+class InstrumentedMixin:
+    #sits right above AsyncWebsocketConsumer, so it sees frames exactly as they go over the wire
+    route = None
+    sending = 0
+
+    async def websocket_connect(self, message):
+        ws_consumers.inc(route=self.route)
+        await super().websocket_connect(message)
+
+    async def websocket_disconnect(self, message):
+        ws_consumers.dec(route=self.route)
+        await super().websocket_disconnect(message)
+
+    async def websocket_receive(self, message):
+        payload = message.get('text') or message.get('bytes') or ''
+        ws_bytes.inc(len(payload), route=self.route, direction='in')
+        await super().websocket_receive(message)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        payload = text_data if text_data is not None else bytes_data
+        if payload is not None:
+            ws_bytes.inc(len(payload), route=self.route, direction='out')
+        #how many sends on this socket are still waiting on the channel layer or the client
+        ws_send_queue_depth.observe(self.sending, route=self.route)
+        self.sending += 1
+        try:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        finally:
+            self.sending -= 1
+
+
+class CompressionMixin:
+    #opt-in per socket: the browser offers the algorithms it can decode and a size threshold
+    compressor = None
+
+    async def configure_compression(self, data):
+        algorithm = negotiate(data.get('algorithms'))
+        compressor = Compressor(algorithm, data.get('threshold')) if algorithm else None
+        self.compressor = None
+        await self.send(text_data=json.dumps({
+            'action': 'compression',
+            'status': 'success',
+            'algorithm': algorithm,
+            'threshold': compressor.threshold if compressor else None,
+        }))
+        #enabled only after the reply, which the client still expects as text
+        self.compressor = compressor
+
+    async def send_compression_stats(self):
+        await self.send(text_data=json.dumps({
+            'action': 'compression_stats',
+            'status': 'success',
+            'stats': self.compressor.summary() if self.compressor else None,
+        }))
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if text_data is not None and self.compressor is not None:
+            packed = self.compressor.pack(text_data)
+            if packed is not None:
+                text_data, bytes_data = None, packed
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    def log_compression(self):
+        if self.compressor is not None:
+            logger.info('Compression stats', extra={'compression': self.compressor.summary()})
+
+
+class Consumer(CompressionMixin, InstrumentedMixin, AsyncWebsocketConsumer):
+    route = 'cpu'
 
-class Consumer(AsyncWebsocketConsumer):
     async def connect(self):
+        self.conns = {}
+        self.conn_lock = asyncio.Lock()
+        self.monitors = {}
+        self.encoders = {}
+        #group -> [requested interval, last send time]; the shared sampler may run faster for another viewer
+        self.rates = {}
+        self.transfers = {}
+        self.dir_cache = DirCache()
+        self.listings = Listings()
+        self.searches = {}
+        self.tails = {}
+        #host key -> group of the shared process table this socket watches
+        self.process_views = {}
+        #(host key, directory) -> DirWatcher, oldest first
+        self.watchers = {}
+        self.dispatcher = Dispatcher(self.send)
+        #vault handle -> decrypted credentials, fetched once per socket
+        self.logins = {}
         await self.accept()
-        print("WebSocket connected")
+        logger.info('WebSocket connected')
 
     async def disconnect(self, close_code):
-        print("WebSocket disconnected")
+        #in-flight actions first, so none of them starts something after the cleanup below
+        await self.dispatcher.close()
+        for key in list(self.monitors):
+            await registry.unsubscribe(key, self.channel_name)
+        self.monitors = {}
+        for key in list(self.process_views):
+            await process_registry.unsubscribe(key, self.channel_name)
+        self.process_views = {}
+        for transfer_id in list(self.transfers):
+            await self.cancel_transfer(transfer_id)
+        for search_id in list(self.searches):
+            await self.cancel_search(search_id)
+        for tail_id in list(self.tails):
+            await self.stop_tail(tail_id)
+        for watcher in list(self.watchers.values()):
+            await watcher.stop()
+        self.watchers = {}
+        async with self.conn_lock:
+            for conn in self.conns.values():
+                await pool.release(conn)
+            self.conns = {}
+        self.log_compression()
+        logger.info('WebSocket disconnected')
+
+    async def get_conn(self, ssh_data):
+        #leases one pooled connection per host for the life of the socket
+        key = pool_key(ssh_data)
+        async with self.conn_lock:
+            conn = self.conns.get(key)
+            if conn is not None and conn.is_closed():
+                await pool.release(conn)
+                conn = None
+            if conn is None:
+                conn = await pool.acquire(ssh_data)
+                self.conns[key] = conn
+            return conn
 
-    async def receive(self, text_data):
-        print(f"Received: {text_data}")
+    async def get_fs(self, ssh_data):
+        conn = await self.get_conn(ssh_data)
+        fs = RemoteFS(await pool.sftp(conn))
+        host = pool_key(ssh_data)
+        if host not in self.dir_cache.homes:
+            #cache keys are absolute once the login directory is known, so 'a' and '/home/u/a' match
+            self.dir_cache.set_home(host, await fs.home())
+        return fs
+
+    async def send(self, text_data=None, bytes_data=None, close=False, error=False):
+        request = current_request.get()
+        if request is not None and text_data is not None:
+            if request.stale:
+                return
+            if not request.replied:
+                request.replied = True
+                ws_action_seconds.observe(time.perf_counter() - request.started, action=request.action)
+            if error:
+                ws_errors.inc(action=request.action)
+            text_data = tag(text_data, request)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            await self.transfer_chunk(bytes_data)
+            return
         try:
             data = json.loads(text_data)
             action = data.get('action')
-            ssh_data = data.get('ssh_data', {})
-            
-            if action == 'start':
-                print(f"Starting monitor with SSH data: {ssh_data}")
-                asyncio.create_task(self.monitor(ssh_data))
+            #never the payload itself: it can carry credentials and file contents
+            logger.debug('Received %s', action, extra={'request_id': data.get('request_id')})
+            if action in INLINE_ACTIONS:
+                await self.handle(action, data)
+            else:
+                request = Request(data.get('request_id'), action, SUPERSEDES.get(action))
+                self.dispatcher.submit(request, lambda: self.handle(action, data), serial=action in SERIAL_ACTIONS)
+        except Exception as e:
+            logger.warning('Receive error: %s', e)
+            ws_errors.inc(action='receive')
+            await self.send(text_data=json.dumps({'status': 'error', 'message': str(e)}))
+
+    async def credentials(self, ssh_data):
+        handle = (ssh_data or {}).get('handle')
+        if handle is None:
+            return ssh_data or {}
+        if handle not in self.logins:
+            self.logins[handle] = await vault.resolve(ssh_data, session_owner(self.scope))
+        return self.logins[handle]
+
+    async def handle(self, action, data):
+        try:
+            ssh_data = await self.credentials(data.get('ssh_data'))
+            if action == 'cancel':
+                self.dispatcher.cancel(data.get('request_id'))
+            elif action == 'compression':
+                await self.configure_compression(data)
+            elif action == 'compression_stats':
+                await self.send_compression_stats()
+            elif action == 'start':
+                logger.info('Starting monitor for %s', pool_key(ssh_data))
+                await self.start_monitor(ssh_data, data)
+            elif action == 'monitor_config':
+                await self.configure_monitor(ssh_data, data)
+            elif action == 'history':
+                await self.send_history(ssh_data, data)
+            elif action == 'processes':
+                await self.start_processes(ssh_data, data)
+            elif action == 'processes_stop':
+                await self.stop_processes(ssh_data)
             elif action == 'list_directory':
                 path = data.get('path', '~')
-                await self.list_directory(ssh_data, path)
+                if data.get('page_size'):
+                    await self.list_directory_paged(ssh_data, path, data)
+                else:
+                    await self.list_directory(ssh_data, path, data.get('refresh', False))
+            elif action == 'list_page':
+                await self.list_page(ssh_data, data)
+            elif action == 'search':
+                await self.start_search(ssh_data, data)
+            elif action == 'search_cancel':
+                await self.cancel_search(data.get('search_id'))
+            elif action == 'tail':
+                await self.start_tail(ssh_data, data)
+            elif action == 'tail_stop':
+                await self.stop_tail(data.get('tail_id'))
+            elif action == 'watch_directory':
+                await self.watch_directory(ssh_data, data.get('path', '~'))
+            elif action == 'unwatch_directory':
+                await self.unwatch_directory(ssh_data, data.get('path', '~'))
             elif action == 'read_file':
                 filepath = data.get('filepath')
                 await self.read_file(ssh_data, filepath)
             elif action == 'write_file':
                 filepath = data.get('filepath')
                 content = data.get('content', '')
-                await self.write_file(ssh_data, filepath, content)
+                await self.write_file(ssh_data, filepath, content, data.get('encoding', 'utf-8'), data.get('base'))
+            elif action == 'patch_file':
+                await self.patch_file(ssh_data, data)
             elif action == 'create_file':
                 filepath = data.get('filepath')
                 await self.create_file(ssh_data, filepath)
@@ -46,292 +294,761 @@ class Consumer(AsyncWebsocketConsumer):
                 old_path = data.get('old_path')
                 new_path = data.get('new_path')
                 await self.rename_file(ssh_data, old_path, new_path)
+            elif action == 'batch':
+                await self.run_batch(ssh_data, data)
+            elif action == 'transfer_read':
+                await self.transfer_read(ssh_data, data)
+            elif action == 'transfer_write':
+                await self.transfer_write(ssh_data, data)
+            elif action == 'transfer_ack':
+                transfer = self.transfers.get(data.get('transfer_id'))
+                if isinstance(transfer, Download):
+                    transfer.ack(int(data.get('offset', 0)))
+            elif action == 'transfer_finish':
+                await self.transfer_finish(data.get('transfer_id'))
+            elif action == 'transfer_cancel':
+                await self.cancel_transfer(data.get('transfer_id'))
         except Exception as e:
-            print(f"Receive error: {e}")
-            await self.send(text_data=json.dumps({'status': 'error', 'message': str(e)}))
+            logger.warning('Action %s failed: %s', action, e)
+            if current_request.get() is None:
+                #dispatched actions are counted when their error reply goes out
+                ws_errors.inc(action=action)
+            await self.send(text_data=json.dumps({'status': 'error', 'message': str(e)}), error=True)
 
-    async def list_directory(self, ssh_data, path):
-        try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                if path == '~':
-                    expand_cmd = f'ls -l ~'
-                    real_path = '~'
-                else:
-                    expand_cmd = f'ls -l {path}'
-                    real_path = path
-                
-                result = await conn.run(expand_cmd, timeout=5)
-                output = result.stdout.strip()
+    async def directory_items(self, ssh_data, path, refresh=False, resolve_links=True):
+        host = pool_key(ssh_data)
+        items = None if refresh else self.dir_cache.get(host, path)
+        cached = items is not None
+        if not cached:
+            fs = await self.get_fs(ssh_data)
+            items = await fs.listdir(path, resolve_links)
+            items.sort(key=lambda item: item['name'])
+            self.dir_cache.put(host, path, items)
+        elif resolve_links:
+            #the cached listing may come from a paged load that left links unresolved
+            if any(item['symlink'] and item['target'] is None for item in items):
+                await (await self.get_fs(ssh_data)).resolve_links(path, items)
+        return items, cached
+
+    async def list_directory(self, ssh_data, path, refresh=False):
+        try:
+            items, cached = await self.directory_items(ssh_data, path, refresh)
                 
+            await self.send(text_data=json.dumps({
+                'action': 'directory_list',
+                'status': 'success',
+                'path': path,
+                'cached': cached,
+                'items': items
+            }))
+        except Exception as e:
+            logger.warning('List directory error: %s', e)
+            await self.send(text_data=json.dumps({
+                'action': 'directory_list',
+                'status': 'error',
+                'message': str(e)
+            }), error=True)
+
+    async def list_directory_paged(self, ssh_data, path, data):
+        try:
+            host = pool_key(ssh_data)
+            items = None if data.get('refresh') else self.dir_cache.get(host, path)
+            cached = items is not None
+            if not cached:
+                fs = await self.get_fs(ssh_data)
+                page_size = clamp(data.get('page_size'), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
                 items = []
-                for line in output.split('\n')[1:]: 
-                    if not line.strip():
-                        continue
-                    
-                    parts = line.split()
-                    if len(parts) >= 9:
-                        permissions = parts[0]
-                        size = parts[4]
-                        name = ' '.join(parts[8:])
-                        item_type = 'directory' if permissions[0] == 'd' else 'file'
-                        
-                        items.append({
-                            'name': name,
-                            'type': item_type,
-                            'size': size,
-                            'permissions': permissions
-                        })
-                
-                await self.send(text_data=json.dumps({
-                    'action': 'directory_list',
-                    'status': 'success',
-                    'path': real_path,
-                    'items': items
-                }))
+                async for item in fs.scandir(path):
+                    items.append(item)
+                    if len(items) == page_size:
+                        #huge directory: show what has arrived while the rest streams in
+                        await self.send_listing(ssh_data, path, items, data, cached=False, partial=True)
+                items.sort(key=lambda item: item['name'])
+                self.dir_cache.put(host, path, items)
+            await self.send_listing(ssh_data, path, items, data, cached=cached, partial=False)
         except Exception as e:
-            print(f"List directory error: {e}")
+            logger.warning('List directory error: %s', e)
             await self.send(text_data=json.dumps({
                 'action': 'directory_list',
                 'status': 'error',
                 'message': str(e)
-            }))
+            }), error=True)
+
+    async def send_listing(self, ssh_data, path, items, data, **extra):
+        #sort and filter the whole directory first so pages are stable slices of one view
+        sort = data.get('sort', 'name')
+        order = 'desc' if data.get('order') == 'desc' else 'asc'
+        view = sort_items(filter_items(items, data.get('filter')), sort, order)
+        listing = self.listings.add(pool_key(ssh_data), path, view)
+        await self.send_page(ssh_data, 'directory_list', listing, 0, data.get('page_size'),
+                             sort=sort, order=order, filter=data.get('filter') or '', **extra)
+
+    async def list_page(self, ssh_data, data):
+        try:
+            listing = self.listings.get(data.get('listing'))
+            await self.send_page(ssh_data, 'directory_page', listing, data.get('offset', 0), data.get('page_size'))
+        except Exception as e:
+            logger.warning('List page error: %s', e)
+            await self.send(text_data=json.dumps({
+                'action': 'directory_page',
+                'status': 'error',
+                'listing': data.get('listing'),
+                'message': str(e)
+            }), error=True)
+
+    async def send_page(self, ssh_data, action, listing, offset, page_size, **extra):
+        page_size = clamp(page_size, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        offset = max(0, int(offset or 0))
+        items, next_offset = listing.page(offset, page_size)
+        if any(item['symlink'] and item['target'] is None for item in items):
+            await (await self.get_fs(ssh_data)).resolve_links(listing.path, items)
+        await self.send(text_data=json.dumps({
+            'action': action,
+            'status': 'success',
+            'path': listing.path,
+            'listing': listing.id,
+            'offset': offset,
+            'total': len(listing.items),
+            'next': next_offset,
+            'items': items,
+            **extra,
+        }))
 
     async def read_file(self, ssh_data, filepath):
         try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                result = await conn.run(f'cat {filepath}', timeout=5)
-                content = result.stdout
+            fs = await self.get_fs(ssh_data)
+            raw, version = await fs.read_versioned(filepath)
+            try:
+                content = raw.decode('utf-8')
+                encoding = 'utf-8'
+            except UnicodeDecodeError:
+                content = base64.b64encode(raw).decode('ascii')
+                encoding = 'base64'
                 
-                await self.send(text_data=json.dumps({
-                    'action': 'file_content',
-                    'status': 'success',
-                    'filepath': filepath,
-                    'content': content
-                }))
+            await self.send(text_data=json.dumps({
+                'action': 'file_content',
+                'status': 'success',
+                'filepath': filepath,
+                'encoding': encoding,
+                'content': content,
+                **version,
+            }))
         except Exception as e:
-            print(f"Read file error: {e}")
+            logger.warning('Read file error: %s', e)
             await self.send(text_data=json.dumps({
                 'action': 'file_content',
                 'status': 'error',
                 'message': str(e)
-            }))
+            }), error=True)
 
-    async def write_file(self, ssh_data, filepath, content):
-        try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                result = await conn.run(f'cat > {filepath}', input=content.encode(), timeout=5)
+    async def write_file(self, ssh_data, filepath, content, encoding='utf-8', base=None):
+        try:
+            fs = await self.get_fs(ssh_data)
+            raw = base64.b64decode(content) if encoding == 'base64' else content.encode('utf-8')
+            version = {}
+            if base:
+                #with the version the editor read, the write is checked like a patch
+                version = await fs.replace(filepath, base, raw)
+            else:
+                await fs.write(filepath, raw)
+            self.dir_cache.invalidate_parent(pool_key(ssh_data), filepath)
                 
-                await self.send(text_data=json.dumps({
-                    'action': 'file_written',
-                    'status': 'success',
-                    'filepath': filepath
-                }))
+            await self.send(text_data=json.dumps({
+                'action': 'file_written',
+                'status': 'success',
+                'filepath': filepath,
+                **version,
+            }))
+        except VersionConflict as e:
+            await self.send_conflict(filepath, e)
         except Exception as e:
-            print(f"Write file error: {e}")
+            logger.warning('Write file error: %s', e)
             await self.send(text_data=json.dumps({
                 'action': 'file_written',
                 'status': 'error',
                 'message': str(e)
-            }))
+            }), error=True)
+
+    async def patch_file(self, ssh_data, data):
+        filepath = data.get('filepath')
+        try:
+            fs = await self.get_fs(ssh_data)
+            version = await fs.patch(filepath, data.get('base') or {}, data.get('hunks') or [])
+            self.dir_cache.invalidate_parent(pool_key(ssh_data), filepath)
+        except VersionConflict as e:
+            await self.send_conflict(filepath, e)
+            return
+        except Exception as e:
+            logger.warning('Patch file error: %s', e)
+            await self.send(text_data=json.dumps({
+                'action': 'file_written',
+                'status': 'error',
+                'message': str(e)
+            }), error=True)
+            return
+        await self.send(text_data=json.dumps({
+            'action': 'file_written',
+            'status': 'success',
+            'filepath': filepath,
+            **version,
+        }))
+
+    async def send_conflict(self, filepath, e):
+        #the file changed since it was read; the editor offers to reload or overwrite
+        await self.send(text_data=json.dumps({
+            'action': 'file_written',
+            'status': 'error',
+            'conflict': True,
+            'filepath': filepath,
+            'message': str(e),
+            **e.current,
+        }), error=True)
 
     async def create_file(self, ssh_data, filepath):
         try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                await conn.run(f'touch {filepath}', timeout=5)
+            fs = await self.get_fs(ssh_data)
+            await fs.touch(filepath)
+            self.dir_cache.invalidate_parent(pool_key(ssh_data), filepath)
                 
-                await self.send(text_data=json.dumps({
-                    'action': 'file_created',
-                    'status': 'success',
-                    'filepath': filepath
-                }))
+            await self.send(text_data=json.dumps({
+                'action': 'file_created',
+                'status': 'success',
+                'filepath': filepath
+            }))
         except Exception as e:
-            print(f"Create file error: {e}")
+            logger.warning('Create file error: %s', e)
             await self.send(text_data=json.dumps({
                 'action': 'file_created',
                 'status': 'error',
                 'message': str(e)
-            }))
+            }), error=True)
 
     async def create_folder(self, ssh_data, folderpath):
         try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                await conn.run(f'mkdir -p {folderpath}', timeout=5)
-                await self.send(text_data=json.dumps({
-                    'action': 'folder_created',
-                    'status': 'success',
-                    'folderpath': folderpath
-                }))
+            fs = await self.get_fs(ssh_data)
+            await fs.mkdir(folderpath)
+            self.dir_cache.invalidate_parent(pool_key(ssh_data), folderpath)
+            await self.send(text_data=json.dumps({
+                'action': 'folder_created',
+                'status': 'success',
+                'folderpath': folderpath
+            }))
         except Exception as e:
-            print(f"Create folder error: {e}")
+            logger.warning('Create folder error: %s', e)
             await self.send(text_data=json.dumps({
                 'action': 'folder_created',
                 'status': 'error',
                 'message': str(e)
-            }))
+            }), error=True)
 
     async def delete_file(self, ssh_data, filepath):
         try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                await conn.run(f'rm -rf {filepath}', timeout=5)
+            fs = await self.get_fs(ssh_data)
+            await fs.remove(filepath)
+            self.dir_cache.invalidate_parent(pool_key(ssh_data), filepath)
+            self.dir_cache.invalidate(pool_key(ssh_data), filepath, recursive=True)
                 
-                await self.send(text_data=json.dumps({
-                    'action': 'file_deleted',
-                    'status': 'success',
-                    'filepath': filepath
-                }))
+            await self.send(text_data=json.dumps({
+                'action': 'file_deleted',
+                'status': 'success',
+                'filepath': filepath
+            }))
         except Exception as e:
-            print(f"Delete file error: {e}")
+            logger.warning('Delete file error: %s', e)
             await self.send(text_data=json.dumps({
                 'action': 'file_deleted',
                 'status': 'error',
                 'message': str(e)
-            }))
+            }), error=True)
 
     async def rename_file(self, ssh_data, old_path, new_path):
         try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                await conn.run(f'mv {old_path} {new_path}', timeout=5)
+            fs = await self.get_fs(ssh_data)
+            await fs.rename(old_path, new_path)
+            host = pool_key(ssh_data)
+            self.dir_cache.invalidate_parent(host, old_path)
+            self.dir_cache.invalidate_parent(host, new_path)
+            self.dir_cache.invalidate(host, old_path, recursive=True)
                 
-                await self.send(text_data=json.dumps({
-                    'action': 'item_renamed',
-                    'status': 'success',
-                    'old_path': old_path,
-                    'new_path': new_path
-                }))
+            await self.send(text_data=json.dumps({
+                'action': 'item_renamed',
+                'status': 'success',
+                'old_path': old_path,
+                'new_path': new_path
+            }))
         except Exception as e:
-            print(f"Rename file error: {e}")
+            logger.warning('Rename file error: %s', e)
             await self.send(text_data=json.dumps({
                 'action': 'item_renamed',
                 'status': 'error',
                 'message': str(e)
-            }))
+            }), error=True)
+
+    async def run_batch(self, ssh_data, data):
+        try:
+            fs = await self.get_fs(ssh_data)
+            batch = Batch(data.get('operations'), fs, await self.get_conn(ssh_data), self.send, data.get('parallel'),
+                          self.dir_cache.homes[pool_key(ssh_data)])
+        except Exception as e:
+            logger.warning('Batch error: %s', e)
+            await self.send(text_data=json.dumps({
+                'action': 'batch_end',
+                'status': 'error',
+                'message': str(e)
+            }), error=True)
+            return
+        host = pool_key(ssh_data)
+        try:
+            await batch.run()
+        finally:
+            #also runs on cancel, for whatever had already been applied
+            for path, recursive in batch.touched:
+                self.dir_cache.invalidate_parent(host, path)
+                if recursive:
+                    self.dir_cache.invalidate(host, path, recursive=True)
+
+    async def transfer_read(self, ssh_data, data):
+        transfer = Download(data.get('transfer_id'), data.get('filepath'), self.send,
+                            data.get('chunk_size'), data.get('window'))
+        if not await self.register_transfer(transfer):
+            return
+        try:
+            fs = await self.get_fs(ssh_data)
+            await transfer.open(fs, data.get('offset', 0), data.get('length'), data.get('tail'), data.get('whole'))
+        except Exception as e:
+            await self.fail_transfer(transfer, e)
+            return
+        transfer.task = asyncio.create_task(self.run_download(transfer))
+
+    async def run_download(self, transfer):
+        try:
+            await transfer.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.fail_transfer(transfer, e)
+        finally:
+            if self.transfers.get(transfer.transfer_id) is transfer:
+                del self.transfers[transfer.transfer_id]
+
+    async def transfer_write(self, ssh_data, data):
+        transfer = Upload(data.get('transfer_id'), data.get('filepath'), self.send,
+                          data.get('chunk_size'), data.get('window'))
+        if not await self.register_transfer(transfer):
+            return
+        try:
+            fs = await self.get_fs(ssh_data)
+            await transfer.open(fs, data.get('offset', 0), data.get('size'), data.get('resume', False),
+                                data.get('base'))
+            transfer.host = pool_key(ssh_data)
+            self.dir_cache.invalidate_parent(transfer.host, transfer.filepath)
+        except Exception as e:
+            await self.fail_transfer(transfer, e)
+
+    async def transfer_chunk(self, frame):
+        try:
+            kind, transfer_id, offset, payload = unpack_frame(frame)
+        except Exception as e:
+            logger.warning('Bad binary frame: %s', e)
+            return
+        transfer = self.transfers.get(transfer_id)
+        if kind != KIND_CHUNK or not isinstance(transfer, Upload):
+            return
+        try:
+            await transfer.write(offset, payload)
+        except Exception as e:
+            await self.fail_transfer(transfer, e)
+
+    async def transfer_finish(self, transfer_id):
+        transfer = self.transfers.get(transfer_id)
+        if not isinstance(transfer, Upload):
+            return
+        try:
+            await transfer.finish()
+            del self.transfers[transfer_id]
+            self.dir_cache.invalidate_parent(transfer.host, transfer.filepath)
+        except Exception as e:
+            await self.fail_transfer(transfer, e)
+
+    async def register_transfer(self, transfer):
+        if not isinstance(transfer.transfer_id, int) or transfer.transfer_id in self.transfers:
+            await transfer.send_event('transfer_end', status='error', message='Invalid or duplicate transfer_id')
+            return False
+        self.transfers[transfer.transfer_id] = transfer
+        return True
+
+    async def fail_transfer(self, transfer, error):
+        logger.warning('Transfer error: %s', error)
+        if self.transfers.get(transfer.transfer_id) is transfer:
+            del self.transfers[transfer.transfer_id]
+        try:
+            await transfer.close()
+        except Exception:
+            pass
+        conflict = {'conflict': True, **error.current} if isinstance(error, VersionConflict) else {}
+        await transfer.send_event('transfer_end', status='error', offset=transfer.offset, message=str(error),
+                                  **conflict)
+
+    async def cancel_transfer(self, transfer_id):
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer is None:
+            return
+        if transfer.task is not None:
+            transfer.task.cancel()
+        try:
+            await transfer.close()
+        except Exception:
+            pass
+
+    async def watch_directory(self, ssh_data, path):
+        host = pool_key(ssh_data)
+        try:
+            fs = await self.get_fs(ssh_data)
+            key = self.dir_cache.key(host, path)
+            if key not in self.watchers:
+                conn = await self.get_conn(ssh_data)
+                items = self.dir_cache.get(host, path)
+                if items is None:
+                    items = await fs.listdir(path)
+                watcher = DirWatcher(conn, fs, host, path, self.directory_changed)
+                self.watchers[key] = watcher
+                while len(self.watchers) > MAX_WATCHES:
+                    await self.watchers.pop(next(iter(self.watchers))).stop()
+                watcher.start(items)
+            await self.send(text_data=json.dumps({'action': 'watch_started', 'status': 'success', 'path': path}))
+        except Exception as e:
+            logger.warning('Watch directory error: %s', e)
+            await self.send(text_data=json.dumps({'action': 'watch_started', 'status': 'error', 'path': path, 'message': str(e)}), error=True)
+
+    async def unwatch_directory(self, ssh_data, path):
+        watcher = self.watchers.pop(self.dir_cache.key(pool_key(ssh_data), path), None)
+        if watcher is not None:
+            await watcher.stop()
+
+    async def directory_changed(self, watcher, events, gone=False):
+        #a watched directory keeps its cache entry current instead of letting it expire
+        if gone:
+            self.watchers.pop(self.dir_cache.key(watcher.host, watcher.path), None)
+            self.dir_cache.invalidate(watcher.host, watcher.path, recursive=True)
+        else:
+            items = sorted(watcher.items.values(), key=lambda item: item['name'])
+            self.dir_cache.put(watcher.host, watcher.path, items)
+        await self.send(text_data=json.dumps({
+            'action': 'dir_event',
+            'status': 'success',
+            'path': watcher.path,
+            'mode': watcher.mode,
+            'gone': gone,
+            'events': events,
+        }))
+
+    async def start_search(self, ssh_data, data):
+        search = Search(data.get('search_id'), data, self.send)
+        if search.search_id is None or search.search_id in self.searches:
+            await search.finish('error', 'Invalid or duplicate search_id', time.monotonic())
+            return
+        while len(self.searches) >= MAX_SEARCHES:
+            await self.cancel_search(next(iter(self.searches)))
+        try:
+            conn = await self.get_conn(ssh_data)
+        except Exception as e:
+            await search.finish('error', f"SSH error: {str(e)}", time.monotonic())
+            return
+        self.searches[search.search_id] = search
+        search.task = asyncio.create_task(self.run_search(search, conn))
+
+    async def run_search(self, search, conn):
+        try:
+            await search.run(conn)
+        finally:
+            if self.searches.get(search.search_id) is search:
+                del self.searches[search.search_id]
+
+    async def cancel_search(self, search_id):
+        search = self.searches.pop(search_id, None)
+        if search is not None and search.task is not None:
+            search.task.cancel()
+            await asyncio.gather(search.task, return_exceptions=True)
+
+    async def start_tail(self, ssh_data, data):
+        tail_id = data.get('tail_id')
+        try:
+            if tail_id is None or tail_id in self.tails:
+                raise ValueError('Invalid or duplicate tail_id')
+            tail = Tail(tail_id, data, self.send)
+            conn = await self.get_conn(ssh_data)
+            #tail -F would wait quietly for a missing file to appear; fail fast instead
+            await RemoteFS(await pool.sftp(conn)).stat(tail.path)
+        except Exception as e:
+            await self.send(text_data=json.dumps({
+                'action': 'tail_end',
+                'status': 'error',
+                'tail_id': tail_id,
+                'message': str(e)
+            }), error=True)
+            return
+        while len(self.tails) >= MAX_TAILS:
+            await self.stop_tail(next(iter(self.tails)))
+        self.tails[tail_id] = tail
+        tail.task = asyncio.create_task(self.run_tail(tail, conn))
+
+    async def run_tail(self, tail, conn):
+        try:
+            await tail.run(conn)
+        finally:
+            if self.tails.get(tail.tail_id) is tail:
+                del self.tails[tail.tail_id]
+
+    async def stop_tail(self, tail_id):
+        tail = self.tails.pop(tail_id, None)
+        if tail is not None and tail.task is not None:
+            tail.task.cancel()
+            await asyncio.gather(tail.task, return_exceptions=True)
+
+    async def start_monitor(self, ssh_data, data):
+        try:
+            encoder = SampleEncoder(data.get('encoding', 'json'), bool(data.get('delta', False)))
+            #authenticates (or reuses a verified pooled login) before joining a shared sampler
+            await self.get_conn(ssh_data)
+            interval = requested_interval(data)
+            backfill = {
+                'window': min(max(60, float(data.get('window', 3600))), 7 * 86400),
+                'points': min(int(data.get('points', 300)), 2000),
+            }
+            monitor = await registry.subscribe(ssh_data, self.channel_name, interval, backfill)
+            self.monitors[monitor.key] = monitor.group
+            self.encoders[monitor.group] = encoder
+            self.rates[monitor.group] = [interval, 0.0]
+            #a sampler on another worker sends the same event through the channel layer
+            if monitor.local:
+                await self.monitor_joined(await registry.joined(monitor, **backfill))
+        except Exception as e:
+            logger.warning('SSH error: %s', e)
+            await self.send(text_data=json.dumps({'status': 'error', 'message': f"SSH error: {str(e)}"}), error=True)
+
+    async def send_history(self, ssh_data, data):
+        try:
+            #only for hosts this socket can log into, like every other action
+            await self.get_conn(ssh_data)
+            query = parse_range(data, time.time())
+            result = await history.query(pool_key(ssh_data), **query)
+        except Exception as e:
+            await self.send(text_data=json.dumps({'action': 'history', 'status': 'error', 'message': str(e)}), error=True)
+            return
+        await self.send(text_data=json.dumps({'action': 'history', 'status': 'success', **result}))
+
+    async def configure_monitor(self, ssh_data, data):
+        interval = requested_interval(data)
+        monitor = await registry.configure(pool_key(ssh_data), self.channel_name, interval)
+        if monitor is None:
+            await self.send(text_data=json.dumps({
+                'action': 'monitor_config',
+                'status': 'error',
+                'message': 'No monitor running for this host',
+            }), error=True)
+            return
+        self.rates[monitor.group][0] = interval
+        await self.send(text_data=json.dumps({
+            'action': 'monitor_config',
+            'status': 'success',
+            'interval': interval,
+            'effective': monitor.interval,
+        }))
+
+    async def monitor_sample(self, event):
+        encoder = self.encoders.get(event['group'])
+        if encoder is None:
+            return
+        rate = self.rates[event['group']]
+        now = time.monotonic()
+        if now - rate[1] < rate[0] * 0.9:
+            return
+        rate[1] = now
+        frame = encoder.encode(event['sample'])
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
 
-    async def files(self, ssh_data):
-        try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                print("SSH connected")
-                while True:
-                    try:
-                        result = await conn.run('ls -l', timeout=5)
-                        output = result.stdout.strip()
-                        files = re.findall(r'^-.*\s+(\S+)$', output, re.MULTILINE)
-                        print(f"Files: {files}")
-                        await self.send(text_data=json.dumps({'status': 'success', 'files': files}))
-                    except Exception as e:
-                        print(f"Command error: {e}")
-                        await self.send(text_data=json.dumps({'status': 'error', 'message': str(e)}))
-                        break
-                    
-                    await asyncio.sleep(1)
+    async def start_processes(self, ssh_data, data):
+        try:
+            await self.get_conn(ssh_data)
+            interval = process_interval(data.get('interval', PROCESS_INTERVAL))
+            rows = clamp_rows(data.get('rows', PROCESS_ROWS))
+            monitor = await process_registry.subscribe(ssh_data, self.channel_name, interval, rows)
         except Exception as e:
-            print(f"Error: {e}")
-            await self.send(text_data=json.dumps({'status': 'error', 'message': f"SSH error: {str(e)}"}))
-    async def monitor(self, ssh_data):
-        try:
-            async with asyncssh.connect(
-                ssh_data.get('host'),
-                port=int(ssh_data.get('port', 22)),
-                username=ssh_data.get('user'),
-                password=ssh_data.get('password'),
-                known_hosts=None,
-                connect_timeout=10
-            ) as conn:
-                while True:  
-                    try:
-                        result = await conn.run(
-                            r"""
-                            echo "CPU: $(top -bn1 | grep 'Cpu(s)' | sed 's/.*, *\([0-9.]*\)%* id.*/\1/' | awk '{print 100 - $1"%"}')" \
-                            && echo "RAM: $(free -m | awk '/Mem:/ {print $3"MB / "$2"MB"}')" \
-                            && echo "DISK:" \
-                            && df -h --output=target,used,size
-                            """, #cpu ram and disk cmd
-                            timeout=5
-                        )
-                        output_raw = result.stdout
-                        output = output_raw.decode('utf-8') if isinstance(output_raw, bytes) else str(output_raw)
-                        data = {}
-                        lines = output.strip().split('\n')
-
-                        for i, line in enumerate(lines):
-                            if line.startswith('CPU:'):
-                                data['cpu'] = line.split('CPU: ')[1].strip()
-                            elif line.startswith('RAM:'):
-                                data['ram'] = line.split('RAM: ')[1].strip()
-                            elif line.startswith('DISK:'):
-                                for disk_line in lines[i+1:]:  
-                                    if disk_line.strip()[:2] == '/ ':
-                                        data['disk'] = disk_line.strip()
-                                        break
-                                break
-                        
-                        await self.send(text_data=json.dumps({
-                            'status': 'success', #data.status in js 
-                            'cpu': data.get('cpu', 'N/A'),
-                            'ram': data.get('ram', 'N/A'),
-                            'disk': data.get('disk', 'N/A'),
-                        }))
-                    except Exception as e:
-                        print(f"Command error: {e}")
-                        await self.send(text_data=json.dumps({'status': 'error', 'message': str(e)}))
-                        break
-                    
-                    await asyncio.sleep(1)
+            await self.send(text_data=json.dumps({'action': 'processes', 'status': 'error', 'message': str(e)}), error=True)
+            return
+        self.process_views[monitor.key] = monitor.group
+        #a table on another worker sends the same full update through the channel layer
+        if monitor.local:
+            await self.processes_update(monitor.joined())
+
+    async def stop_processes(self, ssh_data):
+        key = pool_key(ssh_data)
+        if self.process_views.pop(key, None) is not None:
+            await process_registry.unsubscribe(key, self.channel_name)
+
+    async def processes_update(self, event):
+        if event['group'] not in self.process_views.values():
+            return
+        await self.send(text_data=json.dumps({'action': 'processes', 'status': 'success', **event['update']}))
+
+    async def processes_error(self, event):
+        for key, group in list(self.process_views.items()):
+            if group == event['group']:
+                del self.process_views[key]
+                process_registry.forget(key, self.channel_name)
+                await self.channel_layer.group_discard(group, self.channel_name)
+        await self.send(text_data=json.dumps({'action': 'processes', 'status': 'error', 'message': event['message']}), error=True)
+
+    async def monitor_alert(self, event):
+        if event['group'] not in self.encoders:
+            return
+        await self.send(text_data=json.dumps({'action': 'alert', **event['alert']}))
+
+    async def monitor_joined(self, event):
+        if event['group'] not in self.encoders:
+            return
+        await self.send(text_data=json.dumps({
+            'action': 'monitor_history',
+            'status': 'success',
+            **event['history'],
+        }))
+        for alert in event['alerts']:
+            await self.monitor_alert({'group': event['group'], 'alert': alert})
+        if event['sample'] is not None:
+            await self.monitor_sample({'group': event['group'], 'sample': event['sample']})
+
+    async def monitor_error(self, event):
+        for key, group in list(self.monitors.items()):
+            if group == event['group']:
+                del self.monitors[key]
+                registry.forget(key, self.channel_name)
+                self.encoders.pop(group, None)
+                self.rates.pop(group, None)
+                await self.channel_layer.group_discard(group, self.channel_name)
+        await self.send(text_data=json.dumps({'status': 'error', 'message': event['message']}), error=True)
+
+
+class FleetConsumer(CompressionMixin, InstrumentedMixin, AsyncWebsocketConsumer):
+    route = 'fleet'
+
+    async def connect(self):
+        self.sampler = None
+        await self.accept()
+        logger.info('Fleet WebSocket connected')
+
+    async def disconnect(self, close_code):
+        await self.stop_fleet()
+        self.log_compression()
+        logger.info('Fleet WebSocket disconnected')
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+
+            if action == 'start':
+                await self.start_fleet(data)
+            elif action == 'stop':
+                await self.stop_fleet()
+            elif action == 'compression':
+                await self.configure_compression(data)
+            elif action == 'compression_stats':
+                await self.send_compression_stats()
         except Exception as e:
-            print(f"SSH error: {e}")
-            await self.send(text_data=json.dumps({'status': 'error', 'message': f"SSH error: {str(e)}"}))
+            logger.warning('Fleet receive error: %s', e)
+            ws_errors.inc(action='fleet')
+            await self.send(text_data=json.dumps({'status': 'error', 'message': str(e)}))
+
+    async def start_fleet(self, data):
+        hosts = data.get('hosts') or []
+        limit = min(getattr(settings, 'FLEET_MAX_HOSTS', pool.max_connections), pool.max_connections)
+        if len(hosts) > limit:
+            raise ValueError(f'Too many hosts: {len(hosts)} (limit {limit}, the smaller of FLEET_MAX_HOSTS '
+                             f'and SSH_POOL_MAX_CONNECTIONS)')
+        await self.stop_fleet()
+        self.sampler = FleetSampler(
+            hosts,
+            self.fleet_update,
+            interval=min(max(1.0, float(data.get('interval', DEFAULT_INTERVAL))), 300.0),
+            concurrency=min(max(1, int(data.get('concurrency', DEFAULT_CONCURRENCY))), 256),
+            timeout=min(max(1.0, float(data.get('timeout', DEFAULT_TIMEOUT))), 60.0),
+        )
+        self.sampler.start()
+        await self.send(text_data=json.dumps({
+            'action': 'fleet_hosts',
+            'status': 'success',
+            'hosts': list(self.sampler.hosts),
+        }))
+
+    async def stop_fleet(self):
+        if self.sampler is not None:
+            sampler, self.sampler = self.sampler, None
+            await sampler.stop()
+
+    async def fleet_update(self, rows):
+        await self.send(text_data=json.dumps({'action': 'fleet_update', 'status': 'success', 'rows': rows}))
+
+
+class TerminalConsumer(InstrumentedMixin, AsyncWebsocketConsumer):
+    route = 'terminal'
+
+    async def connect(self):
+        self.conn = None
+        self.terminal = None
+        await self.accept()
+        logger.info('Terminal WebSocket connected')
+
+    async def disconnect(self, close_code):
+        await self.stop_terminal()
+        logger.info('Terminal WebSocket disconnected')
+
+    async def receive(self, text_data=None, bytes_data=None):
+        #keystrokes arrive as raw binary frames; control messages are JSON
+        if bytes_data is not None:
+            if self.terminal is not None:
+                self.terminal.write(bytes_data)
+            return
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+
+            if action == 'start':
+                await self.start_terminal(data)
+            elif action == 'resize' and self.terminal is not None:
+                self.terminal.resize(data.get('cols'), data.get('rows'))
+            elif action == 'ack' and self.terminal is not None:
+                self.terminal.ack(int(data.get('received', 0)))
+        except Exception as e:
+            logger.warning('Terminal receive error: %s', e)
+            ws_errors.inc(action='terminal')
+            await self.send(text_data=json.dumps({'action': 'terminal_error', 'status': 'error', 'message': str(e)}))
+
+    async def start_terminal(self, data):
+        if self.terminal is not None:
+            raise ValueError('Terminal already started')
+        if self.conn is None:
+            ssh_data = await vault.resolve(data.get('ssh_data'), session_owner(self.scope))
+            self.conn = await pool.acquire(ssh_data)
+        terminal = Terminal(self.send, data.get('cols'), data.get('rows'), data.get('window'))
+        await terminal.open(self.conn)
+        self.terminal = terminal
+        terminal.task = asyncio.create_task(self.run_terminal(terminal))
+
+    async def run_terminal(self, terminal):
+        await terminal.run()
+        #the shell exited; closing the socket tells the browser the session is over
+        await self.close()
+
+    async def stop_terminal(self):
+        if self.terminal is not None:
+            terminal, self.terminal = self.terminal, None
+            terminal.close()
+            if terminal.task is not None:
+                terminal.task.cancel()
+                await asyncio.gather(terminal.task, return_exceptions=True)
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            await pool.release(conn)
@@ -0,0 +1,79 @@
+import posixpath
+import time
+from collections import OrderedDict
+
+from .remotefs import remote_path
+
+DEFAULT_TTL = 30
+DEFAULT_MAX_ENTRIES = 64
+#listings can hold 100k entries each, so the cache is bounded by what it holds as well as by count
+DEFAULT_MAX_ITEMS = 200000
+
+
+def dir_key(path, home='.'):
+    #'~', '~/' and '.' all name the login directory; with `home` known, relative paths become absolute
+    return posixpath.normpath(posixpath.join(home, remote_path(path)))
+
+
+def parent_key(path, home='.'):
+    return posixpath.dirname(dir_key(path, home)) or '.'
+
+
+class DirCache:
+    #per-connection listing cache keyed by (host key, directory), least recently used evicted first
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_items=DEFAULT_MAX_ITEMS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self.items = 0
+        self._entries = OrderedDict()
+        #host key -> login directory, so 'a' and '/home/u/a' share an entry
+        self.homes = {}
+
+    def set_home(self, host, home):
+        self.homes[host] = home
+
+    def key(self, host, path):
+        return (host, dir_key(path, self.homes.get(host, '.')))
+
+    def get(self, host, path):
+        key = self.key(host, path)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, items = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return items
+
+    def put(self, host, path, items):
+        key = self.key(host, path)
+        self._remove(key)
+        now = time.monotonic()
+        for other, (expires, _) in list(self._entries.items()):
+            if expires < now:
+                self._remove(other)
+        if len(items) > self.max_items:
+            return
+        self._entries[key] = (now + self.ttl, items)
+        self.items += len(items)
+        while len(self._entries) > self.max_entries or self.items > self.max_items:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.items -= len(entry[1])
+
+    def invalidate(self, host, path, recursive=False):
+        path = self.key(host, path)[1]
+        prefix = path.rstrip('/') + '/'
+        for key in list(self._entries):
+            if key[0] == host and (key[1] == path or (recursive and key[1].startswith(prefix))):
+                self._remove(key)
+
+    def invalidate_parent(self, host, path):
+        #a created, deleted or renamed entry changes the listing it lives in
+        self.invalidate(host, parent_key(path, self.homes.get(host, '.')))
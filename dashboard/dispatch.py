@@ -0,0 +1,96 @@
+import asyncio
+import contextvars
+import json
+import time
+
+#actions one socket may have running at once; further ones queue
+MAX_CONCURRENT_ACTIONS = 8
+
+#the request being handled by the current task, inherited by anything it spawns
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+class Request:
+    def __init__(self, request_id, action, supersede=None):
+        self.request_id = request_id
+        self.action = action
+        #a newer request with the same key makes this one stale
+        self.supersede = supersede
+        self.stale = False
+        self.task = None
+        self.started = time.perf_counter()
+        self.replied = False
+
+
+def tag(text_data, request):
+    #replies are JSON objects built by the handlers; the id is spliced in rather than re-encoding them
+    if request is None or request.request_id is None or not text_data.startswith('{'):
+        return text_data
+    body = text_data[1:].lstrip()
+    separator = '' if body.startswith('}') else ', '
+    return '{"request_id": ' + json.dumps(request.request_id) + separator + body
+
+
+class Dispatcher:
+    def __init__(self, send, limit=MAX_CONCURRENT_ACTIONS):
+        self.send = send
+        self.requests = {}
+        self.tasks = set()
+        self.latest = {}
+        self.slots = asyncio.Semaphore(limit)
+        #mutations run one at a time in arrival order so a delete never overtakes the create before it
+        self.serial = asyncio.Lock()
+        self.closed = False
+
+    def submit(self, request, handler, serial=False):
+        if request.request_id is not None:
+            if request.request_id in self.requests:
+                raise ValueError(f'Duplicate request_id: {request.request_id}')
+            self.requests[request.request_id] = request
+        if request.supersede is not None:
+            previous = self.latest.get(request.supersede)
+            if previous is not None:
+                previous.stale = True
+                previous.task.cancel()
+            self.latest[request.supersede] = request
+        request.task = asyncio.create_task(self._run(request, handler, serial))
+        self.tasks.add(request.task)
+        return request
+
+    async def _run(self, request, handler, serial):
+        current_request.set(request)
+        try:
+            async with self.slots:
+                if serial:
+                    async with self.serial:
+                        await handler()
+                else:
+                    await handler()
+        except asyncio.CancelledError:
+            if not request.stale and not self.closed and request.request_id is not None:
+                await self.send(text_data=json.dumps({
+                    'action': 'cancelled',
+                    'status': 'cancelled',
+                    'cancelled_action': request.action,
+                }))
+            raise
+        finally:
+            self.tasks.discard(request.task)
+            if self.requests.get(request.request_id) is request:
+                del self.requests[request.request_id]
+            if request.supersede is not None and self.latest.get(request.supersede) is request:
+                del self.latest[request.supersede]
+
+    def cancel(self, request_id):
+        request = self.requests.get(request_id)
+        if request is None:
+            return False
+        request.task.cancel()
+        return True
+
+    async def close(self):
+        self.closed = True
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
@@ -0,0 +1,69 @@
+import json
+
+from .transfer import KIND_MONITOR
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+#every Nth frame is sent in full so a client that missed a delta resynchronises
+FULL_EVERY = 60
+
+
+def _round(value):
+    if isinstance(value, float):
+        return round(value, 1)
+    if isinstance(value, list):
+        return [_round(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _round(v) for k, v in value.items()}
+    return value
+
+
+def flatten(sample):
+    flat = {}
+    for key, value in sample.items():
+        if isinstance(value, dict):
+            for sub, v in value.items():
+                flat[f'{key}.{sub}'] = _round(v)
+        elif key == 'fs':
+            flat[key] = [[fs['mount'], fs['total'], fs['used'], fs['avail']] for fs in value]
+        else:
+            flat[key] = _round(value)
+    return flat
+
+
+class SampleEncoder:
+    def __init__(self, encoding='json', delta=False):
+        if encoding not in ('json', 'msgpack', 'cbor'):
+            raise ValueError(f'Unknown encoding: {encoding}')
+        if (encoding == 'msgpack' and msgpack is None) or (encoding == 'cbor' and cbor2 is None):
+            raise ValueError(f'Encoding not available on this server: {encoding}')
+        self.encoding = encoding
+        self.delta = delta
+        self.last = None
+        self.frames = 0
+
+    def encode(self, sample):
+        flat = flatten(sample)
+        full = not self.delta or self.last is None or self.frames % FULL_EVERY == 0
+        if full:
+            body = flat
+        else:
+            body = {k: v for k, v in flat.items() if self.last.get(k) != v}
+            body['t'] = flat['t']
+        self.last = flat
+        self.frames += 1
+
+        message = {'action': 'monitor_sample', 'status': 'success', 'full': full, 'sample': body}
+        if self.encoding == 'json':
+            return json.dumps(message, separators=(',', ':'))
+        if self.encoding == 'msgpack':
+            return bytes([KIND_MONITOR]) + msgpack.packb(message)
+        return bytes([KIND_MONITOR]) + cbor2.dumps(message)
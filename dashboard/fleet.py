@@ -0,0 +1,131 @@
+import asyncio
+import random
+import time
+
+from .agent import MetricsParser, agent_command
+from .monitors import sample_values
+from .pool import pool, pool_key
+
+DEFAULT_INTERVAL = 5
+DEFAULT_CONCURRENCY = 32
+DEFAULT_TIMEOUT = 10
+#failing hosts back off up to this many seconds so they do not hog sampler slots
+MAX_BACKOFF = 60
+FLUSH_INTERVAL = 1.0
+
+#latency is reported but not compared, otherwise every row would change every round
+CHANGE_FIELDS = ('status', 'cpu', 'mem', 'disk', 'load', 'error')
+
+
+def host_id(key):
+    host, port, user = key
+    return f'{user}@{host}' if port == 22 else f'{user}@{host}:{port}'
+
+
+class FleetHost:
+    def __init__(self, ssh_data):
+        self.ssh_data = ssh_data
+        self.id = host_id(pool_key(ssh_data))
+        #counters from the previous round turn the one-shot snapshots into rates
+        self.parser = MetricsParser()
+        self.failures = 0
+        self.row = {'id': self.id, 'status': 'pending'}
+
+    async def sample(self):
+        async with pool.connection(self.ssh_data) as conn:
+            process = await conn.create_process(agent_command(count=1), encoding=None)
+            try:
+                output = await process.stdout.read()
+                samples = self.parser.feed(output)
+                if not samples:
+                    error = (await process.stderr.read()).decode(errors='replace').strip()
+                    raise RuntimeError(f"Metrics agent exited: {error or process.exit_status}")
+                return samples[-1]
+            finally:
+                process.close()
+
+
+def sample_row(host, sample, latency):
+    cpu, mem, disk = sample_values(sample)
+    return {
+        'id': host.id,
+        'status': 'ok',
+        'cpu': round(cpu),
+        'mem': round(mem),
+        'disk': round(disk),
+        'load': sample['load'][0],
+        'latency': round(latency * 1000),
+        'error': None,
+    }
+
+
+def error_row(host, status, message, latency):
+    return {
+        'id': host.id,
+        'status': status,
+        'cpu': None,
+        'mem': None,
+        'disk': None,
+        'load': None,
+        'latency': round(latency * 1000),
+        'error': message,
+    }
+
+
+class FleetSampler:
+    def __init__(self, hosts, send, interval=DEFAULT_INTERVAL, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        self.hosts = {}
+        for ssh_data in hosts:
+            host = FleetHost(ssh_data)
+            self.hosts.setdefault(host.id, host)
+        self.send = send
+        self.interval = interval
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.dirty = {}
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.poll(host)) for host in self.hosts.values()]
+        self.tasks.append(asyncio.create_task(self.flush()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def poll(self, host):
+        #spread the first round over one interval so hosts do not queue up in lockstep
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            started = time.monotonic()
+            async with self.semaphore:
+                #the timeout only covers this host's own work, not the wait for a slot
+                begun = time.monotonic()
+                try:
+                    sample = await asyncio.wait_for(host.sample(), self.timeout)
+                    row = sample_row(host, sample, time.monotonic() - begun)
+                    host.failures = 0
+                except asyncio.TimeoutError:
+                    row = error_row(host, 'timeout', f'No response within {self.timeout}s', time.monotonic() - begun)
+                    host.failures += 1
+                except Exception as e:
+                    row = error_row(host, 'error', str(e), time.monotonic() - begun)
+                    host.failures += 1
+            self.update(host, row)
+            delay = min(self.interval * 2 ** host.failures, max(self.interval, MAX_BACKOFF))
+            await asyncio.sleep(max(0.0, delay - (time.monotonic() - started)))
+
+    def update(self, host, row):
+        if any(row[k] != host.row.get(k) for k in CHANGE_FIELDS):
+            self.dirty[host.id] = row
+        host.row = row
+
+    async def flush(self):
+        #changed rows are batched so the browser gets at most one update per FLUSH_INTERVAL
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            if self.dirty:
+                rows, self.dirty = list(self.dirty.values()), {}
+                await self.send(rows)
@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+
+from django.conf import settings
+
+from .cluster import is_local
+from .metrics import Counter, Histogram
+from .timeseries import FIELDS, Bucket
+
+logger = logging.getLogger(__name__)
+
+#raw rows are the sampled values; rollup rows carry a sample count so averages can be re-weighted
+RAW = struct.Struct('<d' + 'f' * len(FIELDS))
+ROLLUP = struct.Struct('<dI' + 'f' * (3 * len(FIELDS)))
+#(name, resolution, segment span, retention) in seconds; every span is a whole number of raw
+#segments, so one closed raw segment rolls up into exactly one segment of each tier
+RAW_TIER = ('raw', 1, 3600, 2 * 86400)
+TIERS = (
+    ('1m', 60, 86400, 30 * 86400),
+    ('5m', 300, 7 * 86400, 180 * 86400),
+    ('1h', 3600, 90 * 86400, 3 * 365 * 86400),
+)
+FLUSH_INTERVAL = 10
+COMPACT_INTERVAL = 60
+#a raw segment is rolled up once it has been closed this long, leaving room for the last batch
+GRACE = 2 * FLUSH_INTERVAL
+#rows kept per host while the disk is not keeping up; the oldest go first
+MAX_PENDING = 50000
+DEFAULT_WINDOW = 3600
+MAX_POINTS = 5000
+
+history_write_seconds = Histogram('history_write_seconds', 'Time to append one batch of samples to disk')
+history_dropped = Counter('history_dropped_rows_total', 'Samples dropped because the writer fell behind')
+
+
+def host_dir(key):
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+
+
+def segment_start(t, span):
+    return int(t - t % span)
+
+
+def parse_range(params, now):
+    #shared by the websocket action and the http endpoint; http hands over strings
+    end = float(params.get('end') or now)
+    start = params.get('start')
+    start = float(start) if start else end - float(params.get('window') or DEFAULT_WINDOW)
+    if not start < end:
+        raise ValueError('start must be before end')
+    step = max(float(params.get('step') or 0), (end - start) / MAX_POINTS)
+    fields = params.get('fields') or FIELDS
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    return {'start': start, 'end': end, 'step': step, 'fields': [f for f in FIELDS if f in fields]}
+
+
+class Slots:
+    #folds rows of either tier into chart points of `step` seconds, the same shape HostSeries.backfill returns
+    def __init__(self, start, step):
+        self.start = start
+        self.step = step
+        self.points = {}
+
+    def add(self, t, count, low, avg, high):
+        slot = int((t - self.start) // self.step)
+        point = self.points.get(slot)
+        if point is None:
+            self.points[slot] = [count, list(low), [a * count for a in avg], list(high)]
+            return
+        point[0] += count
+        for i in range(len(avg)):
+            if low[i] < point[1][i]:
+                point[1][i] = low[i]
+            if high[i] > point[3][i]:
+                point[3][i] = high[i]
+            point[2][i] += avg[i] * count
+
+    def result(self, fields, resolution):
+        times = []
+        series = {name: {'min': [], 'avg': [], 'max': []} for name in fields}
+        columns = [FIELDS.index(name) for name in fields]
+        for slot in sorted(self.points):
+            count, low, total, high = self.points[slot]
+            times.append(round(self.start + slot * self.step, 3))
+            for name, i in zip(fields, columns):
+                series[name]['min'].append(round(low[i], 2))
+                series[name]['avg'].append(round(total[i] / count, 2))
+                series[name]['max'].append(round(high[i], 2))
+        return {'step': self.step, 'resolution': resolution, 't': times, 'series': series}
+
+
+class HistoryStore:
+    #append-only segment files per host and tier, written in batches from a worker thread:
+    #  <root>/<host>/raw/<start>.seg   one row per sample, an hour per file
+    #  <root>/<host>/<tier>/<start>.seg  min/avg/max rollups built from closed raw segments
+    def __init__(self, root):
+        self.root = str(root) if root else None
+        self.pending = {}
+        self.task = None
+        self.last_compact = 0.0
+
+    def record(self, key, t, values):
+        if not self.root:
+            return
+        rows = self.pending.setdefault(key, [])
+        rows.append((t, values))
+        if len(rows) > MAX_PENDING:
+            del rows[0]
+            history_dropped.inc()
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time.monotonic() - self.last_compact >= COMPACT_INTERVAL:
+                    self.last_compact = time.monotonic()
+                    await asyncio.to_thread(self.compact, time.time())
+            except Exception:
+                logger.exception('History write failed')
+
+    async def flush(self):
+        batch, self.pending = self.pending, {}
+        if batch:
+            with history_write_seconds.time():
+                await asyncio.to_thread(self.write, batch)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    def path(self, key, tier, start=None):
+        path = os.path.join(self.root, host_dir(key), tier)
+        return path if start is None else os.path.join(path, f'{start}.seg')
+
+    def write(self, batch):
+        for key, rows in batch.items():
+            base = os.path.join(self.root, host_dir(key))
+            if not os.path.isdir(base):
+                os.makedirs(os.path.join(base, RAW_TIER[0]))
+                with open(os.path.join(base, 'host.json'), 'w') as f:
+                    json.dump(key, f)
+            segments = {}
+            for t, values in rows:
+                segments.setdefault(segment_start(t, RAW_TIER[2]), []).append(RAW.pack(t, *values))
+            for start, packed in segments.items():
+                with open(self.path(key, RAW_TIER[0], start), 'ab') as f:
+                    f.write(b''.join(packed))
+
+    def keys(self):
+        if not self.root or not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            try:
+                with open(os.path.join(self.root, name, 'host.json')) as f:
+                    yield tuple(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    def segments(self, key, tier, span, start=None, end=None):
+        #segment start times on disk, oldest first, optionally only those overlapping [start, end)
+        try:
+            names = os.listdir(self.path(key, tier))
+        except FileNotFoundError:
+            return []
+        found = sorted(int(name[:-4]) for name in names if name.endswith('.seg'))
+        return [s for s in found if (start is None or s + span > start) and (end is None or s < end)]
+
+    def read(self, key, tier, start, layout):
+        try:
+            with open(self.path(key, tier, start), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        #a reader racing the writer may see half a row at the end
+        return list(layout.iter_unpack(data[:len(data) - len(data) % layout.size]))
+
+    def compacted(self, key):
+        try:
+            with open(os.path.join(self.root, host_dir(key), 'compacted')) as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            return 0.0
+
+    def compact(self, now):
+        for key in list(self.keys()):
+            #every worker shares the directory, but only a host's owner writes to it
+            if not is_local(key):
+                continue
+            self.roll_up(key, now)
+            self.expire(key, now)
+
+    def roll_up(self, key, now):
+        name, _, span, _ = RAW_TIER
+        mark = self.compacted(key)
+        for start in self.segments(key, name, span):
+            if start < mark:
+                continue
+            if start + span > now - GRACE:
+                break
+            rows = self.read(key, name, start, RAW)
+            for tier, resolution, tier_span, _ in TIERS:
+                buckets = {}
+                for row in rows:
+                    bucket = buckets.get(segment_start(row[0], resolution))
+                    if bucket is None:
+                        bucket = buckets[segment_start(row[0], resolution)] = Bucket(len(FIELDS))
+                    bucket.add(row[1:])
+                packed = b''.join(ROLLUP.pack(t, bucket.count, *bucket.row()) for t, bucket in sorted(buckets.items()))
+                self.append_rollup(key, tier, segment_start(start, tier_span), start, packed)
+            mark = start + span
+            path = os.path.join(self.root, host_dir(key), 'compacted')
+            with open(path + '.tmp', 'w') as f:
+                f.write(str(mark))
+            os.replace(path + '.tmp', path)
+
+    def append_rollup(self, key, tier, segment, since, packed):
+        #rows from an earlier attempt that died before moving the mark are cut off first
+        os.makedirs(self.path(key, tier), exist_ok=True)
+        with open(self.path(key, tier, segment), 'ab+') as f:
+            f.seek(0)
+            data = f.read()
+            keep = len(data) - len(data) % ROLLUP.size
+            for i, row in enumerate(ROLLUP.iter_unpack(data[:keep])):
+                if row[0] >= since:
+                    keep = i * ROLLUP.size
+                    break
+            if keep != len(data):
+                f.truncate(keep)
+            f.write(packed)
+
+    def expire(self, key, now):
+        mark = self.compacted(key)
+        for tier, _, span, retention in (RAW_TIER,) + TIERS:
+            for start in self.segments(key, tier, span, end=now - retention - span):
+                #raw data is never dropped before it has been rolled up
+                if tier == RAW_TIER[0] and start + span > mark:
+                    continue
+                os.remove(self.path(key, tier, start))
+
+    def choose_tier(self, step):
+        #the coarsest tier that is still at least as fine as one chart point
+        chosen = RAW_TIER
+        for tier in TIERS:
+            if tier[1] <= step:
+                chosen = tier
+        return chosen
+
+    def query_sync(self, key, start, end, step, fields):
+        #points sit on multiples of the step, so whole rollup buckets land in whole points
+        slots = Slots(start - start % step, step)
+        name, resolution, span, _ = self.choose_tier(step)
+        mark = self.compacted(key)
+        raw_from = start
+        if name != RAW_TIER[0]:
+            #rolled-up history up to the mark, then the raw tail that is not rolled up yet
+            for segment in self.segments(key, name, span, start, min(end, mark)):
+                for row in self.read(key, name, segment, ROLLUP):
+                    if start <= row[0] < end and row[0] < mark:
+                        values = row[2:]
+                        slots.add(row[0], row[1], values[0::3], values[1::3], values[2::3])
+            raw_from = max(start, mark)
+            if raw_from >= end:
+                return slots.result(fields, resolution)
+        for segment in self.segments(key, RAW_TIER[0], RAW_TIER[2], raw_from, end):
+            for row in self.read(key, RAW_TIER[0], segment, RAW):
+                if raw_from <= row[0] < end:
+                    slots.add(row[0], 1, row[1:], row[1:], row[1:])
+        return slots.result(fields, resolution)
+
+    async def query(self, key, start, end, step, fields=FIELDS):
+        if not self.root:
+            raise RuntimeError('History is disabled on this server')
+        return await asyncio.to_thread(self.query_sync, key, start, end, step, list(fields))
+
+
+history = HistoryStore(getattr(settings, 'HISTORY_DIR', None))
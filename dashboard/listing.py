@@ -0,0 +1,67 @@
+import fnmatch
+from collections import OrderedDict
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 5000
+#sorted snapshots one socket keeps for paging; older ones expire first
+MAX_LISTINGS = 4
+SORT_KEYS = {
+    'name': lambda item: item['name'].lower(),
+    'size': lambda item: item['size'] or 0,
+    'mtime': lambda item: item['mtime'] or 0,
+}
+
+
+def filter_items(items, pattern):
+    #globs match the whole name, anything else is a case-insensitive substring
+    if not pattern:
+        return list(items)
+    pattern = pattern.lower()
+    if any(c in pattern for c in '*?['):
+        return [item for item in items if fnmatch.fnmatchcase(item['name'].lower(), pattern)]
+    return [item for item in items if pattern in item['name'].lower()]
+
+
+def sort_items(items, sort='name', order='asc'):
+    if sort not in SORT_KEYS:
+        raise ValueError(f'Unknown sort key: {sort}')
+    key = SORT_KEYS[sort]
+    items = sorted(items, key=key, reverse=order == 'desc')
+    #directories stay on top whichever way the rest is ordered
+    items.sort(key=lambda item: item['type'] != 'directory')
+    return items
+
+
+class Listing:
+    def __init__(self, listing_id, host, path, items):
+        self.id = listing_id
+        self.host = host
+        self.path = path
+        self.items = items
+
+    def page(self, offset, limit):
+        items = self.items[offset:offset + limit]
+        end = offset + len(items)
+        return items, end if end < len(self.items) else None
+
+
+class Listings:
+    def __init__(self, max_listings=MAX_LISTINGS):
+        self.max_listings = max_listings
+        self._listings = OrderedDict()
+        self._next_id = 1
+
+    def add(self, host, path, items):
+        listing = Listing(self._next_id, host, path, items)
+        self._next_id += 1
+        self._listings[listing.id] = listing
+        while len(self._listings) > self.max_listings:
+            self._listings.popitem(last=False)
+        return listing
+
+    def get(self, listing_id):
+        listing = self._listings.get(listing_id)
+        if listing is None:
+            raise ValueError('Listing expired, reload the directory')
+        self._listings.move_to_end(listing_id)
+        return listing
@@ -0,0 +1,29 @@
+import json
+import logging
+import time
+
+from .dispatch import current_request
+
+#attributes every LogRecord has; anything else was passed in extra= and is logged as a field
+RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    #one object per line, tagged with the websocket request being handled when there is one
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request = current_request.get()
+        if request is not None:
+            entry['request_id'] = request.request_id
+            entry['action'] = request.action
+        for name, value in vars(record).items():
+            if name not in RESERVED and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand
+
+from dashboard.benchmark import run
+
+
+class Command(BaseCommand):
+    help = 'Load-test the websocket app against a local SSH stand-in and report latency, throughput and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='simulated dashboards')
+        parser.add_argument('--hosts', type=int, default=5, help='distinct SSH logins the clients are spread over')
+        parser.add_argument('--duration', type=float, default=10.0, help='seconds of file actions after every client is sampling')
+        parser.add_argument('--interval', type=float, default=1.0, help='monitor sample interval')
+        parser.add_argument('--think', type=float, default=0.05, help='mean pause between a client\'s actions')
+        parser.add_argument('--dirs', type=int, default=10)
+        parser.add_argument('--files', type=int, default=200, help='files per directory')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', dest='json_path', help='write the results here')
+        parser.add_argument('--compare', help='results of an earlier run to diff against')
+
+    def handle(self, *args, **options):
+        results = asyncio.run(run(
+            clients=options['clients'], hosts=options['hosts'], duration=options['duration'],
+            interval=options['interval'], think=options['think'], dirs=options['dirs'],
+            files=options['files'], seed=options['seed'], log=self.stdout.write,
+        ))
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            if baseline.get('config') != results['config']:
+                self.stderr.write('Warning: the runs used different settings, deltas are not like for like')
+        self.report(results, baseline)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def report(self, results, baseline):
+        def delta(value, old):
+            if old is None or not old:
+                return ''
+            return f' ({100 * (value - old) / old:+.0f}%)'
+
+        old_actions = (baseline or {}).get('actions', {})
+        self.stdout.write(f"{'action':<16}{'count':>8}{'errors':>8}{'p50 ms':>18}{'p99 ms':>18}{'per s':>10}")
+        for action, row in results['actions'].items():
+            old = old_actions.get(action, {})
+            p50 = f"{row['p50_ms']}{delta(row['p50_ms'], old.get('p50_ms'))}"
+            p99 = f"{row['p99_ms']}{delta(row['p99_ms'], old.get('p99_ms'))}"
+            self.stdout.write(f"{action:<16}{row['count']:>8}{row['errors']:>8}{p50:>18}{p99:>18}{row['per_second']:>10}")
+        for section in ('throughput', 'memory', 'ssh'):
+            old_section = (baseline or {}).get(section, {})
+            fields = ', '.join(f'{k}={v}{delta(v, old_section.get(k))}' for k, v in results[section].items())
+            self.stdout.write(f'{section}: {fields}')
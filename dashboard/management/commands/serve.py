@@ -0,0 +1,102 @@
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+#a worker that keeps dying is restarted after a growing pause, up to this long
+MAX_BACKOFF = 30
+
+
+class Command(BaseCommand):
+    help = 'Run several daphne workers on one listening socket; each host\'s samplers run on one of them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--workers', type=int, help='defaults to WORKERS, or one per cpu')
+        parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+        parser.add_argument('--fd', type=int, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.child(options['fd'])
+        workers = options['workers'] or (settings.WORKERS if settings.WORKERS > 1 else os.cpu_count() or 1)
+        if workers > 1 and not settings.REDIS_URL:
+            raise CommandError('More than one worker needs REDIS_URL so the workers share a channel layer')
+        listener = self.listen(options['bind'].strip('[]'), options['port'])
+        listener.set_inheritable(True)
+        host, port = listener.getsockname()[:2]
+        self.stdout.write(f"Serving on {f'[{host}]' if ':' in host else host}:{port} with {workers} workers")
+        self.supervise(listener.fileno(), workers)
+
+    def listen(self, host, port):
+        #the family follows the address, so '::', an ipv6 literal or a name resolving to one all work
+        try:
+            family, kind, proto, _, address = socket.getaddrinfo(
+                host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+        except socket.gaierror as e:
+            raise CommandError(f'Cannot bind to {host}: {e}')
+        listener = socket.socket(family, kind, proto)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if family == socket.AF_INET6 and host in ('::', ''):
+            #'::' also takes ipv4 clients, like daphne's own default endpoint
+            listener.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        listener.bind(address)
+        listener.listen(1024)
+        return listener
+
+    def spawn(self, fd, workers, index):
+        env = dict(os.environ, WORKERS=str(workers), WORKER_INDEX=str(index))
+        command = [sys.executable, sys.argv[0], 'serve', '--child', '--fd', str(fd)]
+        return subprocess.Popen(command, env=env, pass_fds=(fd,))
+
+    def supervise(self, fd, workers):
+        children = {index: self.spawn(fd, workers, index) for index in range(workers)}
+        started = dict.fromkeys(children, time.monotonic())
+        backoff = dict.fromkeys(children, 1)
+        stopping = []
+
+        def stop(signum, frame):
+            stopping.append(signum)
+            for child in children.values():
+                if child.poll() is None:
+                    child.send_signal(signum)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        while not stopping:
+            time.sleep(1)
+            for index, child in list(children.items()):
+                if stopping or child.poll() is None:
+                    continue
+                #the hosts this worker owned have no samplers until it is back
+                backoff[index] = min(backoff[index] * 2, MAX_BACKOFF) if time.monotonic() - started[index] < 60 else 1
+                self.stderr.write(f'Worker {index} exited with {child.returncode}, restarting in {backoff[index]}s')
+                time.sleep(backoff[index])
+                if not stopping:
+                    children[index] = self.spawn(fd, workers, index)
+                    started[index] = time.monotonic()
+        for child in children.values():
+            child.wait()
+
+    def child(self, fd):
+        #daphne installs the asyncio twisted reactor on import, before anything else imports twisted
+        from daphne.server import Server
+        from twisted.internet import reactor
+        from channels.routing import get_default_application
+
+        from dashboard.cluster import cluster
+
+        Server(
+            application=get_default_application(),
+            endpoints=[f'fd:fileno={fd}'],
+            #callLater runs inside the asyncio loop, callWhenRunning runs before it is started
+            ready_callable=lambda: reactor.callLater(0, cluster.start),
+        ).run()
+
@@ -0,0 +1,147 @@
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+
+#seconds; ssh round trips on a LAN sit at the low end, slow links and big reads at the top
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        #a function metric is read at scrape time instead of being updated in the hot path
+        self.function = function
+        self.values = {}
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, (), self.function()
+            return
+        for key, value in sorted(self.values.items()):
+            yield self.name, key, value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, key, value in self.samples():
+            lines.append(f'{name}{_labels(self.label_names, key)} {_number(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        state = self.values.get(key)
+        if state is None:
+            #per-bucket counts, made cumulative only when scraped
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += 1
+        state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, (counts, count, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, [le])} {cumulative}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+        return lines
+
+
+def timed(histogram, **labels):
+    #decorator for coroutines; failures are timed too, they are often the slow ones
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+ssh_connect_seconds = Histogram('ssh_connect_seconds', 'Time to open and authenticate an SSH connection')
+ssh_operation_seconds = Histogram('ssh_operation_seconds', 'Latency of SFTP requests and remote commands',
+                                  labels=('kind', 'op'))
+ws_action_seconds = Histogram('ws_action_seconds', 'Time from receiving an action to its first reply',
+                              labels=('action',))
+ws_send_queue_depth = Histogram('ws_send_queue_depth', 'Sends already in flight on a socket when another starts',
+                                labels=('route',), buckets=DEPTH_BUCKETS)
+ws_consumers = Gauge('ws_consumers', 'Open websocket consumers', labels=('route',))
+ws_errors = Counter('ws_errors_total', 'Error replies by action', labels=('action',))
+ws_bytes = Counter('ws_bytes_total', 'Websocket payload bytes', labels=('route', 'direction'))
@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from channels.layers import get_channel_layer
+
+from .agent import MetricsParser, set_agent_interval, start_agent
+from .alerts import HostAlerts, rules
+from .cluster import cluster, is_local, unseal
+from .history import history
+from .pool import pool, pool_key
+from .timeseries import MIN_INTERVAL, HostSeries
+
+logger = logging.getLogger(__name__)
+
+MAX_INTERVAL = 30.0
+DEFAULT_INTERVAL = 1.0
+#visible but unfocused windows still refresh, just slower; hidden tabs drop to the floor rate
+UNFOCUSED_INTERVAL = 5.0
+HIDDEN_INTERVAL = MAX_INTERVAL
+MAX_BACKOFF = 16
+#load average per core and sample lag (as a multiple of the interval) that trigger backoff,
+#and the calmer levels needed before speeding up again
+LOAD_HIGH, LOAD_LOW = 2.0, 1.0
+LAG_HIGH, LAG_LOW = 1.5, 1.2
+
+
+def clamp_interval(value):
+    return min(max(MIN_INTERVAL, float(value)), MAX_INTERVAL)
+
+
+def requested_interval(data):
+    #what a viewer asks for, given its resolution and whether anyone is looking
+    interval = clamp_interval(data.get('interval', DEFAULT_INTERVAL))
+    if data.get('visible', True) is False:
+        return HIDDEN_INTERVAL
+    if data.get('focused', True) is False:
+        return max(interval, UNFOCUSED_INTERVAL)
+    return interval
+
+
+def root_fs(sample):
+    for fs in sample['fs']:
+        if fs['mount'] == '/':
+            return fs
+    return sample['fs'][0] if sample['fs'] else {'total': 0, 'used': 0}
+
+
+def sample_values(sample):
+    mem = sample['mem']
+    disk = root_fs(sample)
+    return (
+        sample['cpu']['total'],
+        100.0 * mem['used'] / mem['total'] if mem['total'] else 0.0,
+        100.0 * disk['used'] / disk['total'] if disk['total'] else 0.0,
+    )
+
+
+def group_name(key):
+    #channel layer group names must be short ascii
+    return 'monitor.' + hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+
+
+class HostMonitor:
+    local = True
+
+    def __init__(self, registry, key, ssh_data, series, alerts):
+        self.registry = registry
+        self.key = key
+        self.ssh_data = ssh_data
+        self.series = series
+        self.alerts = alerts
+        self.group = group_name(key)
+        #channel name -> requested interval
+        self.subscribers = {}
+        self.latest = None
+        self.task = None
+        self.process = None
+        self.interval = DEFAULT_INTERVAL
+        self.backoff = 1
+        self.last_arrival = None
+
+    def target_interval(self):
+        requested = min(self.subscribers.values(), default=DEFAULT_INTERVAL)
+        return clamp_interval(requested * self.backoff)
+
+    def retune(self):
+        interval = self.target_interval()
+        if interval == self.interval:
+            return
+        self.interval = interval
+        if self.process is not None:
+            set_agent_interval(self.process, interval)
+
+    def adapt(self, sample):
+        #back off while the host is overloaded or samples arrive late, recover once both calm down
+        now = time.monotonic()
+        lag = (now - self.last_arrival) / self.interval if self.last_arrival is not None else 1.0
+        self.last_arrival = now
+        load = sample['load'][0] / max(1, len(sample['cpu']['cores']))
+        if load > LOAD_HIGH or lag > LAG_HIGH:
+            self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+        elif load < LOAD_LOW and lag < LAG_LOW and self.backoff > 1:
+            self.backoff //= 2
+        self.retune()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        layer = get_channel_layer()
+        try:
+            async with pool.connection(self.ssh_data) as conn:
+                self.interval = self.target_interval()
+                process = self.process = await start_agent(conn, self.interval)
+                parser = MetricsParser()
+                try:
+                    while True:
+                        chunk = await process.stdout.read(65536)
+                        if not chunk:
+                            error = (await process.stderr.read()).decode(errors='replace').strip()
+                            raise RuntimeError(f"Metrics agent exited: {error or process.exit_status}")
+
+                        for sample in parser.feed(chunk):
+                            self.latest = sample
+                            self.adapt(sample)
+                            values = sample_values(sample)
+                            self.series.add(sample['t'], values)
+                            history.record(self.key, sample['t'], values)
+                            for alert in self.alerts.update(sample['t'], values):
+                                await self.announce(layer, alert)
+                            await layer.group_send(self.group, {
+                                'type': 'monitor.sample',
+                                'group': self.group,
+                                'sample': sample,
+                            })
+                finally:
+                    self.process = None
+                    process.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning('Monitor error for %s: %s', self.key, e)
+            await layer.group_send(self.group, {
+                'type': 'monitor.error',
+                'group': self.group,
+                'message': f"SSH error: {str(e)}",
+            })
+        finally:
+            self.registry.discard(self)
+
+    async def announce(self, layer, alert):
+        host, port, user = self.key
+        alert['host'] = f'{user}@{host}:{port}'
+        logger.warning('Alert %s %s on %s: %s', alert['rule'], alert['status'], alert['host'], alert['message'])
+        await layer.group_send(self.group, {
+            'type': 'monitor.alert',
+            'group': self.group,
+            'alert': alert,
+        })
+
+
+class RemoteMonitor:
+    #stands in for the sampler running on the worker that owns the host
+    local = False
+
+    def __init__(self, key, interval):
+        self.key = key
+        self.group = group_name(key)
+        self.interval = interval
+
+
+class MonitorRegistry:
+    def __init__(self):
+        self.monitors = {}
+        #history outlives the sampler so a returning viewer still gets a backfill
+        self.series = {}
+        #and so does alert state, or a restarted sampler would announce a firing alert twice
+        self.alerts = {}
+        #channel name -> last renewal, for viewers connected to other workers
+        self.remote = {}
+
+    async def subscribe(self, ssh_data, channel_name, interval=DEFAULT_INTERVAL, backfill=None):
+        key = pool_key(ssh_data)
+        if not is_local(key):
+            #samples still arrive through the group; the owner answers with monitor.joined
+            await cluster.join('monitor', key, group_name(key), channel_name, ssh_data,
+                               interval=interval, backfill=backfill)
+            return RemoteMonitor(key, interval)
+        monitor = self.monitors.get(key)
+        if monitor is None:
+            series = self.series.setdefault(key, HostSeries())
+            alerts = self.alerts.setdefault(key, HostAlerts(rules))
+            monitor = self.monitors[key] = HostMonitor(self, key, ssh_data, series, alerts)
+            monitor.start()
+        joining = channel_name not in monitor.subscribers
+        monitor.subscribers[channel_name] = interval
+        monitor.retune()
+        if joining:
+            added = False
+            try:
+                await get_channel_layer().group_add(monitor.group, channel_name)
+                added = True
+            finally:
+                #cancelled mid-add: the viewer never learns of this subscription, so undo it here
+                if not added:
+                    await self.unsubscribe(key, channel_name)
+        return monitor
+
+    async def joined(self, monitor, points, window):
+        #what a new viewer gets before the live samples: history, alerts already firing, the latest sample
+        now = time.time()
+        if monitor.series.covers(now - window) or not history.root:
+            backfill = monitor.series.backfill(points, window, now)
+        else:
+            #this process has not been sampling long enough; the rest comes from disk
+            backfill = await history.query(monitor.key, now - window, now, max(1.0, window / points))
+        return {
+            'type': 'monitor.joined',
+            'group': monitor.group,
+            'history': backfill,
+            'alerts': monitor.alerts.active(),
+            'sample': monitor.latest,
+        }
+
+    async def configure(self, key, channel_name, interval):
+        #the shared sampler runs at the fastest rate any of its viewers asked for
+        if not is_local(key):
+            if not await cluster.update('monitor', key, channel_name, interval=interval):
+                return None
+            return RemoteMonitor(key, interval)
+        monitor = self.monitors.get(key)
+        if monitor is None or channel_name not in monitor.subscribers:
+            return None
+        monitor.subscribers[channel_name] = interval
+        monitor.retune()
+        return monitor
+
+    async def unsubscribe(self, key, channel_name):
+        if not is_local(key):
+            await get_channel_layer().group_discard(group_name(key), channel_name)
+            await cluster.unsubscribe('monitor', key, channel_name)
+            return
+        monitor = self.monitors.get(key)
+        if monitor is None or channel_name not in monitor.subscribers:
+            return
+        del monitor.subscribers[channel_name]
+        await get_channel_layer().group_discard(monitor.group, channel_name)
+        if not monitor.subscribers:
+            #last viewer gone, stop the remote sampler
+            self.discard(monitor)
+            monitor.task.cancel()
+        else:
+            monitor.retune()
+
+    def discard(self, monitor):
+        if self.monitors.get(monitor.key) is monitor:
+            del self.monitors[monitor.key]
+
+    def forget(self, key, channel_name):
+        cluster.forget('monitor', key, channel_name)
+
+    async def remote_subscribe(self, message):
+        ssh_data = unseal(message['ssh'])
+        channel_name = message['channel']
+        self.remote[channel_name] = time.monotonic()
+        monitor = self.monitors.get(pool_key(ssh_data))
+        joining = monitor is None or channel_name not in monitor.subscribers
+        monitor = await self.subscribe(ssh_data, channel_name, message['interval'])
+        #also after this worker restarted, so the viewer's charts catch up with the new sampler
+        if joining and message.get('backfill'):
+            await get_channel_layer().send(channel_name, await self.joined(monitor, **message['backfill']))
+
+    async def remote_unsubscribe(self, message):
+        await self.unsubscribe(tuple(message['key']), message['channel'])
+
+    async def sweep(self, cutoff):
+        for channel_name, seen in list(self.remote.items()):
+            if seen >= cutoff:
+                continue
+            del self.remote[channel_name]
+            for key in [key for key, monitor in self.monitors.items() if channel_name in monitor.subscribers]:
+                await self.unsubscribe(key, channel_name)
+
+
+registry = MonitorRegistry()
+cluster.on('monitor.subscribe', registry.remote_subscribe)
+cluster.on('monitor.unsubscribe', registry.remote_unsubscribe)
+cluster.sweeper(registry.sweep)
@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import time
+from contextlib import asynccontextmanager
+
+import asyncssh
+from django.conf import settings
+
+from .metrics import Gauge, ssh_connect_seconds
+
+
+def pool_key(ssh_data):
+    return (ssh_data.get('host'), int(ssh_data.get('port', 22)), ssh_data.get('user'))
+
+
+def _fingerprint(ssh_data):
+    secret = (ssh_data.get('password') or '') + '\0' + (ssh_data.get('private_key') or '')
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class _Entry:
+    def __init__(self, key, conn, fingerprint):
+        self.key = key
+        self.conn = conn
+        self.fingerprint = fingerprint
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.detached = False
+        self.sftp = None
+        self.sftp_lock = asyncio.Lock()
+
+    def healthy(self):
+        return not self.conn.is_closed()
+
+
+class SSHPool:
+    def __init__(self, max_connections=64, idle_timeout=300, connect_timeout=10, wait_timeout=30, compression=False):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.wait_timeout = wait_timeout
+        #zlib on the ssh transport helps slow links and costs cpu on both ends; asyncssh prefers none
+        self.compression_algs = ['zlib@openssh.com', 'zlib', 'none'] if compression else ()
+        self._entries = {}
+        self._by_conn = {}
+        self._connecting = set()
+        self._cond = None
+        self._reaper = None
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def __len__(self):
+        return len(self._by_conn)
+
+    async def acquire(self, ssh_data):
+        key = pool_key(ssh_data)
+        fingerprint = _fingerprint(ssh_data)
+        cond = self._condition()
+        self._start_reaper()
+
+        async with cond:
+            while True:
+                entry = self._entries.get(key)
+                if entry is not None and not entry.healthy():
+                    self._discard(entry)
+                    entry = None
+                # a credential change re-authenticates and replaces the pooled connection
+                if entry is not None and entry.fingerprint == fingerprint:
+                    entry.refs += 1
+                    entry.last_used = time.monotonic()
+                    return entry.conn
+                if key in self._connecting:
+                    await self._wait(cond)
+                    continue
+                if entry is not None and entry.refs <= 0:
+                    #about to be replaced; an idle one gives up its slot first
+                    self._discard(entry)
+                    entry = None
+                #a replacement for a leased connection is a new connection too, so it counts against the cap
+                if len(self._by_conn) + len(self._connecting) >= self.max_connections:
+                    if not self._evict_idle():
+                        await self._wait(cond)
+                        continue
+                break
+            self._connecting.add(key)
+
+        try:
+            conn = await self._connect(ssh_data)
+        except BaseException:
+            async with cond:
+                self._connecting.discard(key)
+                cond.notify_all()
+            raise
+
+        async with cond:
+            self._connecting.discard(key)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                old.detached = True
+                if old.refs <= 0:
+                    self._discard(old)
+            entry = _Entry(key, conn, fingerprint)
+            entry.refs = 1
+            self._entries[key] = entry
+            self._by_conn[conn] = entry
+            cond.notify_all()
+        return conn
+
+    async def release(self, conn):
+        cond = self._condition()
+        async with cond:
+            entry = self._by_conn.get(conn)
+            if entry is None:
+                return
+            entry.refs -= 1
+            entry.last_used = time.monotonic()
+            if entry.refs <= 0 and (entry.detached or not entry.healthy()):
+                self._discard(entry)
+            cond.notify_all()
+
+    async def sftp(self, conn):
+        #one sftp channel per pooled connection, shared by every lease holder
+        entry = self._by_conn.get(conn)
+        if entry is None:
+            raise asyncssh.DisconnectError(asyncssh.DISC_CONNECTION_LOST, 'Connection is no longer pooled')
+        async with entry.sftp_lock:
+            if entry.sftp is None:
+                entry.sftp = await conn.start_sftp_client()
+            return entry.sftp
+
+    @asynccontextmanager
+    async def connection(self, ssh_data):
+        conn = await self.acquire(ssh_data)
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def _wait(self, cond):
+        try:
+            await asyncio.wait_for(cond.wait(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise PoolExhausted(f'No SSH connection available (limit {self.max_connections})')
+
+    async def _connect(self, ssh_data):
+        #a supplied key is tried first (publickey precedes password in asyncssh), the password
+        #doubles as its passphrase; never the server's own keys or agent, which would log a browser
+        #user in as whatever identity trusts this host whatever password they typed
+        client_keys = None
+        if ssh_data.get('private_key'):
+            client_keys = [asyncssh.import_private_key(ssh_data['private_key'], ssh_data.get('password') or None)]
+        with ssh_connect_seconds.time():
+            return await asyncssh.connect(
+                ssh_data.get('host'),
+                port=int(ssh_data.get('port', 22)),
+                username=ssh_data.get('user'),
+                password=ssh_data.get('password'),
+                client_keys=client_keys,
+                agent_path=None,
+                known_hosts=None,
+                connect_timeout=self.connect_timeout,
+                keepalive_interval=30,
+                keepalive_count_max=3,
+                compression_algs=self.compression_algs,
+            )
+
+    async def close(self):
+        #drops every pooled connection, leased or not; for shutdown and benchmarks
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self._condition():
+            entries = list(self._by_conn.values())
+            for entry in entries:
+                self._discard(entry)
+        for entry in entries:
+            await entry.conn.wait_closed()
+
+    def _discard(self, entry):
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        self._by_conn.pop(entry.conn, None)
+        entry.conn.close()
+
+    def _evict_idle(self):
+        idle = [e for e in self._by_conn.values() if e.refs <= 0]
+        if not idle:
+            return False
+        self._discard(min(idle, key=lambda e: e.last_used))
+        return True
+
+    def _start_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def _reap(self):
+        interval = max(1, min(self.idle_timeout / 4, 30))
+        while True:
+            await asyncio.sleep(interval)
+            async with self._condition():
+                now = time.monotonic()
+                for entry in list(self._by_conn.values()):
+                    if not entry.healthy():
+                        self._discard(entry)
+                    elif entry.refs <= 0 and now - entry.last_used > self.idle_timeout:
+                        self._discard(entry)
+                if not self._by_conn and not self._connecting:
+                    self._reaper = None
+                    return
+
+
+pool = SSHPool(
+    max_connections=getattr(settings, 'SSH_POOL_MAX_CONNECTIONS', 64),
+    idle_timeout=getattr(settings, 'SSH_POOL_IDLE_TIMEOUT', 300),
+    compression=getattr(settings, 'SSH_COMPRESSION', False),
+)
+
+Gauge('ssh_connections', 'Pooled SSH connections in this process', function=lambda: len(pool))
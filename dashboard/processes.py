@@ -0,0 +1,234 @@
+import asyncio
+import json
+import logging
+import time
+
+from channels.layers import get_channel_layer
+
+from .agent import set_agent_interval, set_agent_rows, start_process_agent
+from .cluster import cluster, is_local, unseal
+from .monitors import group_name
+from .pool import pool, pool_key
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('pid', 'name', 'state', 'threads', 'cpu', 'rss', 'io')
+#scanning every pid is far heavier than the host totals, so the table refreshes more slowly
+MIN_INTERVAL = 2.0
+MAX_INTERVAL = 30.0
+DEFAULT_INTERVAL = 3.0
+DEFAULT_ROWS = 20
+MAX_ROWS = 200
+
+
+def process_group(key):
+    return group_name(('processes',) + tuple(key))
+
+
+def clamp_rows(value):
+    return min(max(1, int(value)), MAX_ROWS)
+
+
+def clamp_interval(value):
+    return min(max(MIN_INTERVAL, float(value)), MAX_INTERVAL)
+
+
+class ProcessTable:
+    #the rows last broadcast, so every scan goes out as the rows that changed and the pids that left
+    def __init__(self):
+        self.rows = {}
+
+    def update(self, rows):
+        current = {row[0]: row for row in rows}
+        changed = [row for pid, row in current.items() if self.rows.get(pid) != row]
+        removed = [pid for pid in self.rows if pid not in current]
+        self.rows = current
+        return changed, removed
+
+    def snapshot(self):
+        return list(self.rows.values())
+
+
+class ProcessMonitor:
+    #one process agent per host, shared by every viewer of its table
+    local = True
+
+    def __init__(self, registry, key, ssh_data):
+        self.registry = registry
+        self.key = key
+        self.ssh_data = ssh_data
+        self.group = process_group(key)
+        #channel name -> (interval, rows)
+        self.subscribers = {}
+        self.table = ProcessTable()
+        self.latest = None
+        self.task = None
+        self.process = None
+        self.interval = DEFAULT_INTERVAL
+        self.rows = DEFAULT_ROWS
+
+    def targets(self):
+        #the fastest refresh and the longest table any viewer asked for
+        interval = min((i for i, _ in self.subscribers.values()), default=DEFAULT_INTERVAL)
+        rows = max((r for _, r in self.subscribers.values()), default=DEFAULT_ROWS)
+        return interval, rows
+
+    def retune(self):
+        interval, rows = self.targets()
+        if self.process is not None:
+            if interval != self.interval:
+                set_agent_interval(self.process, interval)
+            if rows != self.rows:
+                set_agent_rows(self.process, rows)
+        self.interval, self.rows = interval, rows
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def joined(self):
+        #the whole current table once; after that only changed rows arrive
+        return {
+            'type': 'processes.update',
+            'group': self.group,
+            'update': {
+                'full': True,
+                'columns': COLUMNS,
+                'upsert': self.table.snapshot(),
+                'remove': [],
+                **(self.latest or {}),
+            },
+        }
+
+    async def run(self):
+        layer = get_channel_layer()
+        try:
+            async with pool.connection(self.ssh_data) as conn:
+                self.interval, self.rows = self.targets()
+                process = self.process = await start_process_agent(conn, self.interval, self.rows)
+                buffer = b''
+                try:
+                    while True:
+                        chunk = await process.stdout.read(65536)
+                        if not chunk:
+                            error = (await process.stderr.read()).decode(errors='replace').strip()
+                            raise RuntimeError(f"Process agent exited: {error or process.exit_status}")
+                        *lines, buffer = (buffer + chunk).split(b'\n')
+                        for line in lines:
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                continue
+                            await self.publish(layer, record)
+                finally:
+                    self.process = None
+                    process.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning('Process view error for %s: %s', self.key, e)
+            await layer.group_send(self.group, {
+                'type': 'processes.error',
+                'group': self.group,
+                'message': str(e),
+            })
+        finally:
+            self.registry.discard(self)
+
+    async def publish(self, layer, record):
+        changed, removed = self.table.update(record['rows'])
+        self.latest = {k: record[k] for k in ('t', 'count', 'scan', 'interval') if k in record}
+        await layer.group_send(self.group, {
+            'type': 'processes.update',
+            'group': self.group,
+            'update': {**self.latest, 'upsert': changed, 'remove': removed},
+        })
+
+
+class RemoteProcesses:
+    #stands in for the agent running on the worker that owns the host
+    local = False
+
+    def __init__(self, key):
+        self.key = key
+        self.group = process_group(key)
+
+
+class ProcessRegistry:
+    def __init__(self):
+        self.monitors = {}
+        #channel name -> last renewal, for viewers connected to other workers
+        self.remote = {}
+
+    async def subscribe(self, ssh_data, channel_name, interval=DEFAULT_INTERVAL, rows=DEFAULT_ROWS):
+        key = pool_key(ssh_data)
+        if not is_local(key):
+            await cluster.join('processes', key, process_group(key), channel_name, ssh_data,
+                               interval=interval, rows=rows)
+            return RemoteProcesses(key)
+        monitor = self.monitors.get(key)
+        if monitor is None:
+            monitor = self.monitors[key] = ProcessMonitor(self, key, ssh_data)
+            monitor.subscribers[channel_name] = (interval, rows)
+            monitor.start()
+        else:
+            monitor.subscribers[channel_name] = (interval, rows)
+            monitor.retune()
+        added = False
+        try:
+            await get_channel_layer().group_add(monitor.group, channel_name)
+            added = True
+        finally:
+            #cancelled mid-add: the viewer never learns of this subscription, so undo it here
+            if not added:
+                await self.unsubscribe(key, channel_name)
+        return monitor
+
+    async def unsubscribe(self, key, channel_name):
+        if not is_local(key):
+            await get_channel_layer().group_discard(process_group(key), channel_name)
+            await cluster.unsubscribe('processes', key, channel_name)
+            return
+        monitor = self.monitors.get(key)
+        if monitor is None or channel_name not in monitor.subscribers:
+            return
+        del monitor.subscribers[channel_name]
+        await get_channel_layer().group_discard(monitor.group, channel_name)
+        if not monitor.subscribers:
+            self.discard(monitor)
+            monitor.task.cancel()
+        else:
+            monitor.retune()
+
+    def discard(self, monitor):
+        if self.monitors.get(monitor.key) is monitor:
+            del self.monitors[monitor.key]
+
+    def forget(self, key, channel_name):
+        cluster.forget('processes', key, channel_name)
+
+    async def remote_subscribe(self, message):
+        ssh_data = unseal(message['ssh'])
+        channel_name = message['channel']
+        self.remote[channel_name] = time.monotonic()
+        monitor = self.monitors.get(pool_key(ssh_data))
+        joining = monitor is None or channel_name not in monitor.subscribers
+        monitor = await self.subscribe(ssh_data, channel_name, message['interval'], message['rows'])
+        if joining:
+            await get_channel_layer().send(channel_name, monitor.joined())
+
+    async def remote_unsubscribe(self, message):
+        await self.unsubscribe(tuple(message['key']), message['channel'])
+
+    async def sweep(self, cutoff):
+        for channel_name, seen in list(self.remote.items()):
+            if seen >= cutoff:
+                continue
+            del self.remote[channel_name]
+            for key in [key for key, monitor in self.monitors.items() if channel_name in monitor.subscribers]:
+                await self.unsubscribe(key, channel_name)
+
+
+registry = ProcessRegistry()
+cluster.on('processes.subscribe', registry.remote_subscribe)
+cluster.on('processes.unsubscribe', registry.remote_unsubscribe)
+cluster.sweeper(registry.sweep)
@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import posixpath
+import secrets
+import shlex
+import stat
+
+import asyncssh
+
+from .metrics import ssh_operation_seconds, timed
+
+#unchanged ranges are moved in pieces this size when the server has no copy-data extension
+COPY_CHUNK = 256 * 1024
+#a version hashes the first and last block, so a same-size rewrite within mtime's one second still shows
+VERSION_BLOCK = 64 * 1024
+
+
+def remote_path(path):
+    #sftp paths are relative to the login directory, so ~ maps onto it
+    if not path or path == '~':
+        return '.'
+    if path.startswith('~/'):
+        return path[2:] or '.'
+    return path
+
+
+def entry_info(name, attrs):
+    mode = attrs.permissions or 0
+    return {
+        'name': name,
+        'type': 'directory' if stat.S_ISDIR(mode) else 'file',
+        'size': attrs.size,
+        'mode': mode,
+        'permissions': stat.filemode(mode),
+        'mtime': attrs.mtime,
+        'symlink': stat.S_ISLNK(mode),
+        'target': None,
+    }
+
+
+def sample_ranges(size):
+    return [(0, min(size, VERSION_BLOCK)), (max(0, size - VERSION_BLOCK), size)]
+
+
+def sample(data, size):
+    return b''.join(data[start:end] for start, end in sample_ranges(size))
+
+
+def version(attrs, sampled):
+    #what a save is checked against: the file as the editor read it
+    return {'size': attrs.size, 'mtime': attrs.mtime, 'hash': hashlib.sha256(sampled).hexdigest()[:32]}
+
+
+def expected(base):
+    try:
+        return {'size': int(base['size']), 'mtime': int(base['mtime']), 'hash': str(base['hash'])}
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('A save needs the size, mtime and hash of the version it was edited from')
+
+
+def check_hunks(hunks, size):
+    #[start, end, text] in byte offsets of the base file, in order and not overlapping
+    checked = []
+    position = 0
+    for hunk in hunks:
+        start, end, text = hunk
+        start, end = int(start), int(end)
+        if not position <= start <= end <= size:
+            raise ValueError(f'Bad patch hunk {start}-{end} for a {size} byte file')
+        checked.append((start, end, text if isinstance(text, bytes) else text.encode('utf-8')))
+        position = end
+    return checked
+
+
+class VersionConflict(Exception):
+    def __init__(self, current):
+        super().__init__('The file changed on the server since it was opened; reopen it before saving')
+        self.current = current
+
+
+class RemoteFS:
+    def __init__(self, sftp):
+        self.sftp = sftp
+        #cleared the first time the server turns down copy-data
+        self.copy_data = True
+
+    async def home(self):
+        #the login directory that relative paths resolve against
+        return await self.sftp.realpath('.')
+
+    @timed(ssh_operation_seconds, kind='sftp', op='stat')
+    async def stat(self, path, follow=True):
+        rpath = remote_path(path)
+        attrs = await (self.sftp.stat(rpath) if follow else self.sftp.lstat(rpath))
+        return entry_info(posixpath.basename(rpath), attrs)
+
+    @timed(ssh_operation_seconds, kind='sftp', op='listdir')
+    async def listdir(self, path, resolve_links=True):
+        names = await self.sftp.readdir(remote_path(path))
+        items = [entry_info(n.filename, n.attrs) for n in names if n.filename not in ('.', '..')]
+        if resolve_links:
+            await self.resolve_links(path, items)
+        return items
+
+    async def scandir(self, path):
+        #yields entries as the server sends them, without resolving symlinks
+        async for name in self.sftp.scandir(remote_path(path)):
+            if name.filename not in ('.', '..'):
+                yield entry_info(name.filename, name.attrs)
+
+    async def resolve_links(self, path, items):
+        #symlinks whose target is still unknown; paged listings only resolve what they send
+        links = [item for item in items if item['symlink'] and item['target'] is None]
+        if links:
+            await asyncio.gather(*(self._resolve_link(path, item) for item in links))
+
+    @timed(ssh_operation_seconds, kind='sftp', op='entry')
+    async def entry(self, path, name):
+        #one directory entry as listdir would report it
+        rpath = posixpath.join(remote_path(path), name)
+        item = entry_info(name, await self.sftp.lstat(rpath))
+        if item['symlink']:
+            await self._resolve_link(path, item)
+        return item
+
+    async def _resolve_link(self, path, item):
+        rpath = posixpath.join(remote_path(path), item['name'])
+        try:
+            item['target'] = await self.sftp.readlink(rpath)
+            attrs = await self.sftp.stat(rpath)
+        except asyncssh.SFTPError:
+            return  # dangling link, keep the lstat attributes
+        item['type'] = 'directory' if stat.S_ISDIR(attrs.permissions or 0) else 'file'
+        item['size'] = attrs.size
+
+    async def open(self, path, mode='rb'):
+        return await self.sftp.open(remote_path(path), mode)
+
+    @timed(ssh_operation_seconds, kind='sftp', op='read')
+    async def read(self, path):
+        async with self.sftp.open(remote_path(path), 'rb') as f:
+            return await f.read()
+
+    @timed(ssh_operation_seconds, kind='sftp', op='read')
+    async def read_versioned(self, path):
+        #stat through the open handle, so the version belongs to the bytes that were read
+        async with self.sftp.open(remote_path(path), 'rb') as f:
+            attrs = await f.stat()
+            data = await f.read()
+            return data, version(attrs, sample(data, attrs.size))
+
+    async def handle_version(self, f, attrs=None):
+        attrs = attrs or await f.stat()
+        blocks = [await f.read(end - start, start) for start, end in sample_ranges(attrs.size or 0)]
+        return version(attrs, b''.join(blocks))
+
+    async def current_version(self, rpath):
+        async with self.sftp.open(rpath, 'rb') as f:
+            return await self.handle_version(f)
+
+    @timed(ssh_operation_seconds, kind='sftp', op='write')
+    async def write(self, path, data):
+        async with self.sftp.open(remote_path(path), 'wb') as f:
+            await f.write(data)
+
+    async def target(self, path):
+        #a symlink is saved through to its target rather than replaced by a regular file
+        rpath = remote_path(path)
+        if stat.S_ISLNK((await self.sftp.lstat(rpath)).permissions or 0):
+            rpath = await self.sftp.realpath(rpath)
+        return rpath
+
+    def temp_path(self, rpath):
+        return posixpath.join(posixpath.dirname(rpath), f'.{posixpath.basename(rpath)}.{secrets.token_hex(4)}.tmp')
+
+    async def install(self, temp, rpath, base, mode):
+        #moves a finished temp file over the original, so readers see either version whole
+        try:
+            await self.sftp.chmod(temp, mode)
+            #last look before replacing it; a write landing after this is the only one that can be lost
+            current = await self.current_version(rpath)
+            if current != base:
+                raise VersionConflict(current)
+            await self.rename(temp, rpath)
+        except BaseException:
+            await self.discard(temp)
+            raise
+        return await self.current_version(rpath)
+
+    async def discard(self, temp):
+        try:
+            await self.sftp.remove(temp)
+        except Exception:
+            pass
+
+    @timed(ssh_operation_seconds, kind='sftp', op='patch')
+    async def patch(self, path, base, hunks):
+        #builds the new file beside the old one from the unchanged ranges and the hunks, so only the
+        #edit crosses the network
+        rpath = await self.target(path)
+        base = expected(base)
+        async with self.sftp.open(rpath, 'rb') as src:
+            attrs = await src.stat()
+            current = await self.handle_version(src, attrs)
+            if current != base:
+                raise VersionConflict(current)
+            hunks = check_hunks(hunks, attrs.size)
+            if not hunks:
+                return base
+            temp = self.temp_path(rpath)
+            try:
+                async with self.sftp.open(temp, 'wb') as dst:
+                    position = offset = 0
+                    for start, end, data in hunks:
+                        await self.copy_range(src, dst, position, start - position, offset)
+                        offset += start - position
+                        await dst.write(data, offset)
+                        offset += len(data)
+                        position = end
+                    await self.copy_range(src, dst, position, attrs.size - position, offset)
+            except BaseException:
+                await self.discard(temp)
+                raise
+        return await self.install(temp, rpath, base, stat.S_IMODE(attrs.permissions or 0o644))
+
+    async def replace(self, path, base, data):
+        #a whole new content, checked against the version it was edited from like a patch
+        return await self.patch(path, base, [(0, expected(base)['size'], data)])
+
+    async def copy_range(self, src, dst, offset, length, dst_offset):
+        if length <= 0:
+            return
+        if self.copy_data:
+            try:
+                #copied by the sftp server on the host
+                await self.sftp.remote_copy(src, dst, offset, length, dst_offset)
+                return
+            except asyncssh.SFTPOpUnsupported:
+                self.copy_data = False
+        end = offset + length
+        while offset < end:
+            data = await src.read(min(COPY_CHUNK, end - offset), offset)
+            if not data:
+                raise ValueError('File shrank while saving')
+            await dst.write(data, dst_offset)
+            offset += len(data)
+            dst_offset += len(data)
+
+    @timed(ssh_operation_seconds, kind='sftp', op='touch')
+    async def touch(self, path):
+        async with self.sftp.open(remote_path(path), 'ab'):
+            pass
+
+    @timed(ssh_operation_seconds, kind='sftp', op='mkdir')
+    async def mkdir(self, path):
+        await self.sftp.makedirs(remote_path(path), exist_ok=True)
+
+    @timed(ssh_operation_seconds, kind='sftp', op='remove')
+    async def remove(self, path):
+        rpath = remote_path(path)
+        attrs = await self.sftp.lstat(rpath)
+        if stat.S_ISDIR(attrs.permissions or 0):
+            await self.sftp.rmtree(rpath)
+        else:
+            await self.sftp.remove(rpath)
+
+    @timed(ssh_operation_seconds, kind='sftp', op='chmod')
+    async def chmod(self, path, mode):
+        await self.sftp.chmod(remote_path(path), mode)
+
+    @timed(ssh_operation_seconds, kind='sftp', op='rename')
+    async def rename(self, old_path, new_path):
+        try:
+            await self.sftp.posix_rename(remote_path(old_path), remote_path(new_path))
+        except asyncssh.SFTPOpUnsupported:
+            await self.sftp.rename(remote_path(old_path), remote_path(new_path))
+
+
+@timed(ssh_operation_seconds, kind='exec', op='command')
+async def remote_command(conn, command):
+    result = await conn.run(command)
+    if result.exit_status != 0:
+        error = (result.stderr or '').strip() or f'exit status {result.exit_status}'
+        raise RuntimeError(error)
+    return result.stdout
+
+
+async def remote_copy(conn, src, dst):
+    #copied on the host itself; nothing passes through this process
+    await remote_command(conn, f'cp -a -- {shlex.quote(remote_path(src))} {shlex.quote(remote_path(dst))}')
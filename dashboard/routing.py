@@ -3,4 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/cpu/$', consumers.Consumer.as_asgi()), #type: ignore
+    re_path(r'ws/fleet/$', consumers.FleetConsumer.as_asgi()), #type: ignore
+    re_path(r'ws/terminal/$', consumers.TerminalConsumer.as_asgi()), #type: ignore
 ]
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import shlex
+import time
+
+from django.conf import settings
+
+from .remotefs import remote_path
+from .transfer import clamp
+
+DEFAULT_MAX_RESULTS = 1000
+MAX_RESULTS = 10000
+DEFAULT_MAX_DEPTH = 10
+MAX_DEPTH = 64
+DEFAULT_TIMEOUT = 60
+MAX_TIMEOUT = 600
+#matches per file when grepping, so one huge log cannot eat the whole result budget
+MATCHES_PER_FILE = 20
+MAX_LINE = 500
+FLUSH_INTERVAL = 0.1
+FLUSH_SIZE = 200
+#pseudo filesystems that a search from / should never descend into
+PRUNE = ('/proc', '/sys', '/dev')
+
+#searches running at once across every socket in this process
+_slots = asyncio.Semaphore(getattr(settings, 'SEARCH_MAX_CONCURRENT', 8))
+
+
+def search_command(root, names=(), pattern=None, max_depth=DEFAULT_MAX_DEPTH, kind=None, ignore_case=False):
+    #runs at idle cpu and io priority on the remote host; find streams NUL separated paths,
+    #grep -Z prints 'path\0line:text\n' for content matches
+    name_test = '-iname' if ignore_case else '-name'
+    expr = ['find', shlex.quote(remote_path(root)), '-maxdepth', str(max_depth)]
+    expr += ['\\('] + ' -o '.join(f'-path {p}' for p in PRUNE).split() + ['\\)', '-prune', '-o']
+    if names:
+        tests = []
+        for name in names:
+            tests += ['-o', name_test, shlex.quote(name)]
+        expr += ['\\('] + tests[1:] + ['\\)']
+    if pattern:
+        kind = 'f'
+    if kind in ('f', 'd', 'l'):
+        expr += ['-type', kind]
+    expr.append('-print0')
+    command = ' '.join(expr) + ' 2>/dev/null'
+    if pattern:
+        grep = ['grep', '-I', '-n', '-H', '-Z', '-E', '-m', str(MATCHES_PER_FILE)]
+        if ignore_case:
+            grep.append('-i')
+        grep += ['-e', shlex.quote(pattern)]
+        command += ' | $LOW xargs -0 -r ' + ' '.join(grep) + ' 2>/dev/null'
+    return cancellable(
+        'LOW="nice -n 19"; command -v ionice >/dev/null 2>&1 && LOW="$LOW ionice -c3"; '
+        f'$LOW {command}'
+    )
+
+
+def cancellable(command):
+    #closing the channel only reaches the remote side as EOF on stdin, and a walk that prints
+    #nothing would never notice; a watcher on stdin kills the whole process group instead
+    return (
+        f'exec 3<&0; {{ {command}; }} 3<&- & pid=$!; '
+        '{ cat <&3 >/dev/null; kill 0; } >/dev/null 2>&1 & exec 3<&-; wait $pid'
+    )
+
+
+class Search:
+    def __init__(self, search_id, params, send):
+        self.search_id = search_id
+        self.send = send
+        self.root = params.get('path') or '~'
+        names = params.get('names') or []
+        self.names = [names] if isinstance(names, str) else list(names)
+        self.pattern = params.get('pattern') or None
+        self.kind = params.get('type')
+        self.ignore_case = bool(params.get('ignore_case', False))
+        self.max_depth = clamp(params.get('max_depth'), DEFAULT_MAX_DEPTH, MAX_DEPTH)
+        self.max_results = clamp(params.get('max_results'), DEFAULT_MAX_RESULTS, MAX_RESULTS)
+        self.timeout = clamp(params.get('timeout'), DEFAULT_TIMEOUT, MAX_TIMEOUT)
+        self.count = 0
+        self.truncated = False
+        self.task = None
+        self._batch = []
+        self._last_flush = 0
+
+    def command(self):
+        return search_command(self.root, self.names, self.pattern, self.max_depth, self.kind, self.ignore_case)
+
+    async def run(self, conn):
+        started = time.monotonic()
+        status, message = 'success', None
+        try:
+            async with _slots:
+                await asyncio.wait_for(self.stream(conn), self.timeout)
+        except asyncio.TimeoutError:
+            status, message = 'timeout', f'Search stopped after {self.timeout}s'
+            self.truncated = True
+        except asyncio.CancelledError:
+            await self.finish('cancelled', None, started)
+            raise
+        except Exception as e:
+            status, message = 'error', str(e)
+        await self.finish(status, message, started)
+
+    async def stream(self, conn):
+        process = await conn.create_process(self.command(), encoding=None)
+        buffer = b''
+        reading = None
+        try:
+            while self.count < self.max_results:
+                if reading is None:
+                    reading = asyncio.ensure_future(process.stdout.read(65536))
+                #a quiet stretch of the walk still delivers the matches found so far
+                done, _ = await asyncio.wait({reading}, timeout=FLUSH_INTERVAL)
+                if not done:
+                    await self.flush()
+                    continue
+                chunk, reading = reading.result(), None
+                if not chunk:
+                    break
+                buffer += chunk
+                buffer = await self.parse(buffer)
+        finally:
+            if reading is not None:
+                reading.cancel()
+            #killing the channel also stops the remote walk once the limit is hit
+            process.close()
+
+    async def parse(self, buffer):
+        while self.count < self.max_results:
+            end = buffer.find(b'\0')
+            if end < 0:
+                return buffer
+            path = buffer[:end].decode(errors='replace')
+            if self.pattern:
+                newline = buffer.find(b'\n', end)
+                if newline < 0:
+                    return buffer
+                line, _, text = buffer[end + 1:newline].partition(b':')
+                buffer = buffer[newline + 1:]
+                match = {'path': path, 'line': int(line or 0), 'text': text[:MAX_LINE].decode(errors='replace')}
+            else:
+                buffer = buffer[end + 1:]
+                match = {'path': path}
+            self.count += 1
+            await self.emit(match)
+        self.truncated = True
+        return b''
+
+    async def emit(self, match):
+        self._batch.append(match)
+        now = time.monotonic()
+        if len(self._batch) >= FLUSH_SIZE or now - self._last_flush >= FLUSH_INTERVAL:
+            await self.flush()
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._batch:
+            return
+        matches, self._batch = self._batch, []
+        await self.send(text_data=json.dumps({
+            'action': 'search_results',
+            'status': 'success',
+            'search_id': self.search_id,
+            'matches': matches,
+        }))
+
+    async def finish(self, status, message, started):
+        await self.flush()
+        await self.send(text_data=json.dumps({
+            'action': 'search_end',
+            'status': status,
+            'search_id': self.search_id,
+            'count': self.count,
+            'truncated': self.truncated,
+            'elapsed': round(time.monotonic() - started, 3),
+            'message': message,
+        }), error=status == 'error')
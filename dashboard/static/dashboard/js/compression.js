@@ -0,0 +1,52 @@
+//binary frame kind for deflate-compressed text, see dashboard/transfer.py
+const KIND_DEFLATE = 3;
+const COMPRESSION_THRESHOLD = 1024;
+
+async function inflateText(buffer) {
+    const stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return await new Response(stream).text();
+}
+
+//asks the server to compress large text frames and turns them back into ordinary text
+//messages, in arrival order, before any onmessage handler sees them. must be called
+//right after the socket is created so this listener runs ahead of onmessage
+function enableCompression(socket, threshold) {
+    if (typeof DecompressionStream === 'undefined') return;
+    socket.binaryType = 'arraybuffer';
+    const replayed = new WeakSet();
+    let chain = Promise.resolve();
+    let pending = 0;
+
+    socket.addEventListener('message', function(event) {
+        if (replayed.has(event)) return;
+        const compressed = event.data instanceof ArrayBuffer && event.data.byteLength > 0 &&
+            new Uint8Array(event.data, 0, 1)[0] === KIND_DEFLATE;
+        //while a frame is being inflated, later frames wait behind it so nothing overtakes
+        if (!compressed && pending === 0) return;
+        event.stopImmediatePropagation();
+        pending++;
+        const decoded = compressed ? inflateText(event.data.slice(1)) : Promise.resolve(event.data);
+        chain = chain
+            .then(() => decoded)
+            .then(data => {
+                const replay = new MessageEvent('message', { data: data });
+                replayed.add(replay);
+                socket.dispatchEvent(replay);
+            })
+            .catch(error => console.error('Failed to decompress frame:', error))
+            .finally(() => pending--);
+    });
+
+    function offer() {
+        socket.send(JSON.stringify({
+            action: 'compression',
+            algorithms: ['deflate'],
+            threshold: threshold || COMPRESSION_THRESHOLD
+        }));
+    }
+    if (socket.readyState === WebSocket.OPEN) {
+        offer();
+    } else {
+        socket.addEventListener('open', offer);
+    }
+}
@@ -1,3 +1,65 @@
+class Sparkline {
+    constructor(canvas) {
+        this.canvas = canvas;
+        this.ctx = canvas.getContext('2d');
+        this.capacity = canvas.width;
+        this.t = [];
+        this.avg = [];
+        this.min = [];
+        this.max = [];
+    }
+
+    load(t, series) {
+        this.t = t.slice(-this.capacity);
+        this.avg = series.avg.slice(-this.capacity);
+        this.min = series.min.slice(-this.capacity);
+        this.max = series.max.slice(-this.capacity);
+        this.draw();
+    }
+
+    push(t, value) {
+        this.t.push(t);
+        this.avg.push(value);
+        this.min.push(value);
+        this.max.push(value);
+        if (this.t.length > this.capacity) {
+            this.t.shift();
+            this.avg.shift();
+            this.min.shift();
+            this.max.shift();
+        }
+        this.draw();
+    }
+
+    draw() {
+        const { width, height } = this.canvas;
+        const ctx = this.ctx;
+        const y = v => height - (Math.min(100, Math.max(0, v)) / 100) * height;
+        const x = i => width - (this.avg.length - i);
+        ctx.clearRect(0, 0, width, height);
+
+        ctx.fillStyle = 'rgba(250, 250, 250, 0.15)';
+        for (let i = 0; i < this.avg.length; i++) {
+            ctx.fillRect(x(i), y(this.max[i]), 1, Math.max(1, y(this.min[i]) - y(this.max[i])));
+        }
+
+        ctx.strokeStyle = '#fafafa';
+        ctx.beginPath();
+        this.avg.forEach((v, i) => i === 0 ? ctx.moveTo(x(i), y(v)) : ctx.lineTo(x(i), y(v)));
+        ctx.stroke();
+    }
+}
+
+function formatBytes(n) {
+    const units = ['B', 'K', 'M', 'G', 'T'];
+    let i = 0;
+    while (n >= 1024 && i < units.length - 1) {
+        n /= 1024;
+        i++;
+    }
+    return (i === 0 ? n : n.toFixed(1)) + units[i];
+}
+
 document.addEventListener('DOMContentLoaded', function() {    
     const cpuDisplay = document.getElementById('cpu');
     const ramDisplay = document.getElementById('ram');
@@ -22,12 +84,30 @@ document.addEventListener('DOMContentLoaded', function() {
     console.log('Attempting WebSocket connection to:', wsUrl);
     
     const socket = new WebSocket(wsUrl);
+    enableCompression(socket);
+    //seconds between samples while this tab is visible and focused; the server slows down otherwise
+    const resolution = 1;
+    const charts = {};
+    const sample = {};
+    //rule name -> firing alert; resolved ones are removed
+    const alerts = {};
+    const alertList = document.getElementById('alerts');
+    ['cpu', 'mem', 'disk'].forEach(name => {
+        const canvas = document.getElementById(name + '-chart');
+        if (canvas) charts[name] = new Sparkline(canvas);
+    });
 
     socket.onopen = function() {
         console.log('WebSocket connected');
         const msg = {
             action: 'start',
-            ssh_data: sshInfo
+            ssh_data: sshInfo,
+            points: charts.cpu ? charts.cpu.capacity : 300,
+            window: 3600,
+            delta: true,
+            interval: resolution,
+            visible: document.visibilityState === 'visible',
+            focused: document.hasFocus()
         };
 
         console.log('Sending:', msg);
@@ -38,25 +118,77 @@ document.addEventListener('DOMContentLoaded', function() {
             if (fileDisplay && window.FileBrowser) {
                 window.fileBrowser = new FileBrowser('file-display', socket, sshInfo);
             }
+            if (document.getElementById('process-panel') && window.ProcessView) {
+                window.processView = new ProcessView('process-panel', socket, sshInfo);
+            }
         }, 500);
     };
 
+    function reportVisibility() {
+        if (socket.readyState !== WebSocket.OPEN) return;
+        socket.send(JSON.stringify({
+            action: 'monitor_config',
+            ssh_data: sshInfo,
+            interval: resolution,
+            visible: document.visibilityState === 'visible',
+            focused: document.hasFocus()
+        }));
+    }
+
+    document.addEventListener('visibilitychange', reportVisibility);
+    window.addEventListener('focus', reportVisibility);
+    window.addEventListener('blur', reportVisibility);
+
     socket.onmessage = function(event) {
         const data = JSON.parse(event.data);
         console.log('Received:', data);
-        if (!data.action && data.status) {
-            if (data.status === 'error') {
-                cpuDisplay.textContent = 'Error - ' + data.message;
-                ramDisplay.textContent = 'Error - ' + data.message;
-                diskDisplay.textContent = 'Error - ' + data.message;
-            } else {
-                cpuDisplay.textContent = 'CPU: ' + data.cpu;
-                ramDisplay.textContent = 'RAM: ' + data.ram;
-                diskDisplay.textContent = 'DISK: ' + data.disk;
+        if (data.action === 'monitor_history' && data.status === 'success') {
+            Object.keys(charts).forEach(name => charts[name].load(data.t, data.series[name]));
+        } else if (data.action === 'monitor_sample') {
+            //delta frames only carry changed fields, full frames replace everything
+            if (data.full) {
+                Object.keys(sample).forEach(key => delete sample[key]);
             }
+            Object.assign(sample, data.sample);
+            renderSample();
+        } else if (data.action === 'alert') {
+            renderAlert(data);
+        } else if (!data.action && data.status === 'error') {
+            cpuDisplay.textContent = 'Error - ' + data.message;
+            ramDisplay.textContent = 'Error - ' + data.message;
+            diskDisplay.textContent = 'Error - ' + data.message;
         }
     };
 
+    function renderAlert(alert) {
+        if (alert.status === 'firing') {
+            alerts[alert.rule] = alert;
+        } else {
+            delete alerts[alert.rule];
+        }
+        if (!alertList) return;
+        alertList.replaceChildren(...Object.values(alerts).map(a => {
+            const row = document.createElement('div');
+            row.className = 'alert alert-' + a.severity;
+            row.textContent = a.rule + ': ' + a.message + ' since ' + new Date(a.since * 1000).toLocaleTimeString();
+            return row;
+        }));
+    }
+
+    function renderSample() {
+        const fs = sample.fs || [];
+        const root = fs.find(f => f[0] === '/') || fs[0];
+        const memPct = sample['mem.total'] ? 100 * sample['mem.used'] / sample['mem.total'] : 0;
+        const diskPct = root && root[1] ? 100 * root[2] / root[1] : 0;
+
+        cpuDisplay.textContent = 'CPU: ' + sample['cpu.total'].toFixed(1) + '%' + (sample.load ? ' (load ' + sample.load.join(' ') + ')' : '');
+        ramDisplay.textContent = 'RAM: ' + Math.round(sample['mem.used'] / 2 ** 20) + 'MB / ' + Math.round(sample['mem.total'] / 2 ** 20) + 'MB';
+        diskDisplay.textContent = root ? 'DISK: ' + root[0] + ' ' + formatBytes(root[2]) + ' / ' + formatBytes(root[1]) : 'DISK: N/A';
+
+        const values = { cpu: sample['cpu.total'], mem: memPct, disk: diskPct };
+        Object.keys(charts).forEach(name => charts[name].push(sample.t, values[name]));
+    }
+
     socket.onerror = function(error) {
         console.error('WebSocket error:', error);
         cpuDisplay.textContent = 'CPU: WebSocket error';
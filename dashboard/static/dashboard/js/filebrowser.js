@@ -1,13 +1,141 @@
 document.addEventListener('DOMContentLoaded', function() {   
     console.log('filebrowser.js loaded'); 
+    const CHUNK_SIZE = 256 * 1024;
+    const PAGE_SIZE = 1024 * 1024;
+    //text files up to this size open whole and editable; larger ones are paged read-only
+    const MAX_EDIT_SIZE = 32 * 1024 * 1024;
+    const WINDOW = 8;
+    //directory listings arrive in pages and only the rows in view are in the DOM
+    const LIST_PAGE = 200;
+    const ROW_HEIGHT = 28;
+    const OVERSCAN = 10;
+    //followed log lines kept on screen; older ones scroll away
+    const TAIL_ROWS = 5000;
+    //past this many changed lines a save sends the changed region as one hunk instead of diffing it
+    const MAX_EDITS = 1000;
+
+    function utf8Length(text) {
+        let length = 0;
+        for (let i = 0; i < text.length; i++) {
+            const code = text.charCodeAt(i);
+            if (code < 0x80) length += 1;
+            else if (code < 0x800) length += 2;
+            else if (code >= 0xd800 && code < 0xdc00) { length += 4; i++; }
+            else length += 3;
+        }
+        return length;
+    }
+
+    function splitLines(text) {
+        return text.match(/[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+$/g) || [];
+    }
+
+    //the textarea turns every line break into \n; new lines are saved with the file's own
+    function lineEnding(text) {
+        const match = text.match(/\r\n|\r|\n/);
+        return match ? match[0] : '\n';
+    }
+
+    function withLineEnding(text, eol) {
+        return eol === '\n' ? text : text.replace(/\n/g, eol);
+    }
+
+    //changed line ranges [aStart, aEnd, bStart, bEnd] between a and b (Myers), or null past maxEdits
+    function diffLines(a, b, maxEdits) {
+        const n = a.length, m = b.length, max = Math.min(n + m, maxEdits), off = max + 1;
+        const v = new Int32Array(2 * max + 3);
+        const trace = [];
+        for (let d = 0; d <= max; d++) {
+            trace.push(v.slice());
+            for (let k = -d; k <= d; k += 2) {
+                let x = (k === -d || (k !== d && v[off + k - 1] < v[off + k + 1])) ? v[off + k + 1] : v[off + k - 1] + 1;
+                let y = x - k;
+                while (x < n && y < m && a[x] === b[y]) { x++; y++; }
+                v[off + k] = x;
+                if (x >= n && y >= m) return backtrack(trace, n, m, off);
+            }
+        }
+        return null;
+    }
+
+    function backtrack(trace, x, y, off) {
+        const regions = [];
+        for (let d = trace.length - 1; d > 0; d--) {
+            const v = trace[d];
+            const k = x - y;
+            const prevK = (k === -d || (k !== d && v[off + k - 1] < v[off + k + 1])) ? k + 1 : k - 1;
+            const prevX = v[off + prevK], prevY = prevX - prevK;
+            while (x > prevX && y > prevY) { x--; y--; }
+            //one inserted or deleted line, merged into the region after it when they touch
+            const last = regions[regions.length - 1];
+            if (last && last[0] === x && last[2] === y) {
+                last[0] = prevX;
+                last[2] = prevY;
+            } else {
+                regions.push([prevX, x, prevY, y]);
+            }
+            x = prevX;
+            y = prevY;
+        }
+        return regions.reverse();
+    }
+
+    //[start, end, text] hunks in utf-8 byte offsets of the raw base that turn it into the edited text, or
+    //null; lines are compared as the textarea shows them, so untouched lines keep their own line breaks
+    function patchHunks(base, text) {
+        const raw = splitLines(base), eol = lineEnding(base);
+        const a = raw.map(line => line.replace(/\r\n?$/, '\n')), b = splitLines(text);
+        let head = 0;
+        while (head < a.length && head < b.length && a[head] === b[head]) head++;
+        let tail = 0;
+        while (tail < a.length - head && tail < b.length - head && a[a.length - 1 - tail] === b[b.length - 1 - tail]) tail++;
+        const regions = diffLines(a.slice(head, a.length - tail), b.slice(head, b.length - tail), MAX_EDITS) ||
+            [[0, a.length - head - tail, 0, b.length - head - tail]];
+        const offsets = new Array(a.length + 1);
+        offsets[0] = 0;
+        for (let i = 0; i < raw.length; i++) offsets[i + 1] = offsets[i] + utf8Length(raw[i]);
+        const hunks = regions.map(([aStart, aEnd, bStart, bEnd]) =>
+            [offsets[head + aStart], offsets[head + aEnd], withLineEnding(b.slice(head + bStart, head + bEnd).join(''), eol)]);
+        //in a file mixing line breaks a kept \r can meet a new \n and read back as one; such a file is saved whole
+        let result = '', line = 0;
+        regions.forEach(([aStart, aEnd], i) => {
+            result += raw.slice(line, head + aStart).join('') + hunks[i][2];
+            line = head + aEnd;
+        });
+        result += raw.slice(line).join('');
+        return result.replace(/\r\n?/g, '\n') === text ? hunks : null;
+    }
+
     class FileBrowser {
         constructor(containerId, socket, sshInfo) {
             this.container = document.getElementById(containerId);
             this.socket = socket;
             this.sshInfo = sshInfo;
             this.currentPath = '~';
+            this.watchedPath = null;
+            this.view = null;
+            this.sort = 'name';
+            this.order = 'asc';
+            this.filter = '';
             this.selectedItem = null;
+            //names picked with ctrl/shift click; the anchor is the row index shift ranges start from
+            this.selection = new Map();
+            this.anchor = null;
+            this.batch = null;
+            this.nextBatchId = 1;
+            this.search = null;
+            this.nextSearchId = 1;
+            this.tail = null;
+            this.nextTailId = 1;
+            this.nextRequestId = 1;
+            this.listRequest = null;
             this.currentEditFile = null;
+            //the text as opened and its size/mtime/hash on the host, so a save can send only the changes
+            this.editorBase = null;
+            this.editorVersion = null;
+            this.page = null;
+            this.transfers = {};
+            this.nextTransferId = 1;
             
             this.init();
         }
@@ -29,15 +157,19 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             
             this.originalOnMessage = this.socket.onmessage;
+            this.socket.binaryType = 'arraybuffer';
             const self = this;
             
             this.socket.onmessage = function(event) {
+                if (event.data instanceof ArrayBuffer) {
+                    self.handleFrame(event.data);
+                    return;
+                }
                 console.log('Socket message received:', event.data);
                 const data = JSON.parse(event.data);
                 
-                if (data.action) {
+                if (data.action && self.handleMessage(data) !== false) {
                     console.log('File browser action:', data.action);
-                    self.handleMessage(data);
                 } 
                 else if (self.originalOnMessage) {
                     self.originalOnMessage(event);
@@ -68,15 +200,52 @@ document.addEventListener('DOMContentLoaded', function() {
                         <button id="btn-refresh" class="btn-icon btn" title="Refresh"><i class="fa-solid fa-arrow-rotate-right"></i></button>
                         <div class='upload-section'>
                             <div class="path-display" id="path-display">~</div>
+                            <input id="file-filter" class="file-filter" type="search" placeholder="Filter (*.log)">
+                            <select id="file-sort" class="file-sort">
+                                <option value="name">Name</option>
+                                <option value="size">Size</option>
+                                <option value="mtime">Modified</option>
+                            </select>
+                            <button id="btn-sort-order" class="btn-icon btn" title="Sort order"><i class="fa-solid fa-arrow-down-a-z"></i></button>
                             <button id="btn-new-file" class="btn-primary btn"><i class="fa-solid fa-file-circle-plus"></i></button>
                             <button id="btn-new-folder" class="btn-primary btn"><i class="fa-solid fa-folder-plus"></i></button>
                         </div>
                     </div>
 
+
+                    <form id="search-form" class="search-form">
+                        <input id="search-names" type="search" placeholder="Name glob (*.conf)">
+                        <input id="search-pattern" type="search" placeholder="Content regex">
+                        <input id="search-depth" type="number" min="1" max="64" value="10" title="Max depth">
+                        <button id="btn-search" type="submit" class="btn" title="Search below this directory"><i class="fa-solid fa-magnifying-glass"></i></button>
+                        <button id="btn-search-cancel" type="button" class="btn" title="Stop search" style="display: none;"><i class="fa-solid fa-stop"></i></button>
+                    </form>
+                    <div id="search-panel" class="search-panel" style="display: none;">
+                        <div class="search-header">
+                            <span id="search-status"></span>
+                            <button id="btn-search-close" class="btn" title="Close results"><i class="fa-solid fa-xmark"></i></button>
+                        </div>
+                        <div id="search-results" class="search-results"></div>
+                    </div>
+                    
+                    <div id="tail-panel" class="search-panel" style="display: none;">
+                        <div class="search-header">
+                            <span id="tail-status"></span>
+                            <form id="tail-form" class="search-form">
+                                <input id="tail-include" type="search" placeholder="Include regex">
+                                <input id="tail-exclude" type="search" placeholder="Exclude regex">
+                                <button type="submit" class="btn" title="Apply filters"><i class="fa-solid fa-filter"></i></button>
+                            </form>
+                            <button id="btn-tail-close" class="btn" title="Stop following"><i class="fa-solid fa-xmark"></i></button>
+                        </div>
+                        <div id="tail-lines" class="search-results tail-lines"></div>
+                    </div>
                     
                     <div class="file-list-container">
                         <div id="file-list" class="file-list">
-                            <div class="loading">Loading files...</div>
+                            <div id="file-list-rows" class="file-list-rows">
+                                <div class="loading">Loading files...</div>
+                            </div>
                         </div>
                     </div>
                     
@@ -84,6 +253,12 @@ document.addEventListener('DOMContentLoaded', function() {
                         <div class="editor-header">
                             <span id="editor-filename" class="editor-filename">File</span>
                             <div class="editor-actions">
+                                <span id="editor-pager" style="display: none;">
+                                    <button id="btn-page-prev" class="btn-secondary">Prev</button>
+                                    <span id="editor-page-info"></span>
+                                    <button id="btn-page-next" class="btn-secondary">Next</button>
+                                    <button id="btn-page-tail" class="btn-secondary">Tail</button>
+                                </span>
                                 <button id="btn-save" class="btn-success">Save</button>
                                 <button id="btn-close-editor" class="btn-secondary">Close</button>
                             </div>
@@ -94,7 +269,11 @@ document.addEventListener('DOMContentLoaded', function() {
                     <div id="context-menu" class="context-menu" style="display: none;">
                         <div class="context-menu-item" data-action="open"><i class="fa-solid fa-folder-open"></i> Open</div>
                         <div class="context-menu-item" data-action="edit"><i class="fa-solid fa-pen-to-square"></i> Edit</div>
+                        <div class="context-menu-item" data-action="tail"><i class="fa-solid fa-scroll"></i> Follow</div>
                         <div class="context-menu-item" data-action="rename"><i class="fa-solid fa-font"></i> Rename</div>
+                        <div class="context-menu-item" data-action="copy"><i class="fa-solid fa-copy"></i> Copy to...</div>
+                        <div class="context-menu-item" data-action="move"><i class="fa-solid fa-right-to-bracket"></i> Move to...</div>
+                        <div class="context-menu-item" data-action="chmod"><i class="fa-solid fa-lock"></i> Permissions...</div>
                         <div class="context-menu-item" data-action="delete"><i class="fa-solid fa-trash-can"></i> Delete</div>
                     </div>
                 </div>
@@ -106,12 +285,60 @@ document.addEventListener('DOMContentLoaded', function() {
         attachEventListeners() {
             document.getElementById('btn-back').addEventListener('click', () => this.goBack());
             document.getElementById('btn-home').addEventListener('click', () => this.goHome());
-            document.getElementById('btn-refresh').addEventListener('click', () => this.loadDirectory(this.currentPath));
+            document.getElementById('btn-refresh').addEventListener('click', () => this.loadDirectory(this.currentPath, true));
             document.getElementById('btn-new-file').addEventListener('click', () => this.createNewFile());
             document.getElementById('btn-new-folder').addEventListener('click', () => this.createNewFolder());
+            document.getElementById('search-form').addEventListener('submit', (e) => {
+                e.preventDefault();
+                this.startSearch();
+            });
+            document.getElementById('btn-search-cancel').addEventListener('click', () => this.cancelSearch());
+            document.getElementById('tail-form').addEventListener('submit', (e) => {
+                e.preventDefault();
+                //filters run on the server, so changing them restarts the follow from the same point
+                if (this.tail) this.startTail(this.tail.filepath, this.tail.offset);
+            });
+            document.getElementById('btn-tail-close').addEventListener('click', () => {
+                this.stopTail();
+                document.getElementById('tail-panel').style.display = 'none';
+            });
+            document.getElementById('btn-search-close').addEventListener('click', () => {
+                this.cancelSearch();
+                document.getElementById('search-panel').style.display = 'none';
+            });
+
+            let scrollFrame = null;
+            document.getElementById('file-list').addEventListener('scroll', () => {
+                if (scrollFrame !== null) return;
+                scrollFrame = requestAnimationFrame(() => {
+                    scrollFrame = null;
+                    this.renderFileList();
+                });
+            });
+
+            let filterTimer = null;
+            document.getElementById('file-filter').addEventListener('input', (e) => {
+                clearTimeout(filterTimer);
+                filterTimer = setTimeout(() => {
+                    this.filter = e.target.value.trim();
+                    this.loadDirectory(this.currentPath);
+                }, 250);
+            });
+            document.getElementById('file-sort').addEventListener('change', (e) => {
+                this.sort = e.target.value;
+                this.loadDirectory(this.currentPath);
+            });
+            document.getElementById('btn-sort-order').addEventListener('click', (e) => {
+                this.order = this.order === 'asc' ? 'desc' : 'asc';
+                e.currentTarget.firstElementChild.className = this.order === 'asc' ? 'fa-solid fa-arrow-down-a-z' : 'fa-solid fa-arrow-up-z-a';
+                this.loadDirectory(this.currentPath);
+            });
             
             document.getElementById('btn-save').addEventListener('click', () => this.saveFile());
             document.getElementById('btn-close-editor').addEventListener('click', () => this.closeEditor());
+            document.getElementById('btn-page-prev').addEventListener('click', () => this.turnPage(-1));
+            document.getElementById('btn-page-next').addEventListener('click', () => this.turnPage(1));
+            document.getElementById('btn-page-tail').addEventListener('click', () => this.readRange(this.page.filepath, { tail: PAGE_SIZE }));
             
             const contextMenu = document.getElementById('context-menu');
             document.addEventListener('click', (e) => {
@@ -129,7 +356,7 @@ document.addEventListener('DOMContentLoaded', function() {
             });
         }
 
-        loadDirectory(path) {
+        loadDirectory(path, refresh = false) {
             console.log('Loading directory:', path);
             console.log('Socket ready state:', this.socket.readyState);
             console.log('SSH Info:', this.sshInfo);
@@ -140,10 +367,18 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             
+            //replies to an older navigation are dropped by the server, and ignored here if already in flight
+            this.listRequest = this.nextRequestId++;
             const message = {
                 action: 'list_directory',
+                request_id: this.listRequest,
                 ssh_data: this.sshInfo,
-                path: path
+                path: path,
+                refresh: refresh,
+                page_size: LIST_PAGE,
+                sort: this.sort,
+                order: this.order,
+                filter: this.filter
             };
             
             console.log('Sending message:', JSON.stringify(message));
@@ -155,18 +390,84 @@ document.addEventListener('DOMContentLoaded', function() {
             
             switch(data.action) {
                 case 'directory_list':
+                    if (data.request_id !== undefined && data.request_id !== this.listRequest) {
+                        break;
+                    }
                     if (data.status === 'success') {
+                        const list = document.getElementById('file-list');
+                        //a reload of the same directory keeps the scroll position
+                        if (data.path !== this.currentPath) {
+                            list.scrollTop = 0;
+                            this.clearSelection();
+                        }
                         this.currentPath = data.path;
-                        this.renderFileList(data.items);
-                        document.getElementById('path-display').textContent = data.path;
+                        this.view = { listing: data.listing, total: data.total, rows: new Map(), pending: new Set() };
+                        this.storePage(data);
+                        this.renderFileList();
+                        document.getElementById('path-display').textContent = data.partial ? data.path + ' (loading...)' : data.path;
+                        if (!data.partial) this.watchDirectory(data.path);
                     } else {
                         this.showError(data.message);
                     }
                     break;
+
+                case 'directory_page':
+                    if (this.view && data.listing === this.view.listing) {
+                        this.view.pending.delete(data.offset);
+                        if (data.status === 'success') {
+                            this.storePage(data);
+                            this.renderFileList();
+                        } else {
+                            this.loadDirectory(this.currentPath);
+                        }
+                    }
+                    break;
+
+                case 'dir_event':
+                    if (data.path === this.currentPath) {
+                        if (data.gone) {
+                            this.watchedPath = null;
+                            this.showError('Directory no longer exists');
+                        } else {
+                            //the server cache is already current, so this is a cheap re-slice
+                            this.loadDirectory(this.currentPath);
+                        }
+                    }
+                    break;
+
+                case 'search_results':
+                    if (this.search && data.search_id === this.search.id) {
+                        this.renderSearchResults(data.matches);
+                    }
+                    break;
+
+                case 'search_end':
+                    if (this.search && data.search_id === this.search.id) {
+                        this.finishSearch(data);
+                    }
+                    break;
+
+                case 'tail_lines':
+                    if (this.tail && data.tail_id === this.tail.id) {
+                        this.renderTailLines(data);
+                    }
+                    break;
+
+                case 'tail_end':
+                    if (this.tail && data.tail_id === this.tail.id) {
+                        this.finishTail(data);
+                    }
+                    break;
+
+                case 'watch_started':
+                    if (data.status !== 'success') {
+                        console.warn('Directory watch failed:', data.message);
+                    }
+                    break;
                     
                 case 'file_content':
                     if (data.status === 'success') {
-                        this.openEditor(data.filepath, data.content);
+                        this.openEditor(data.filepath, data.content, data.encoding, { size: data.size, mtime: data.mtime, hash: data.hash });
                     } else {
                         this.showError(data.message);
                     }
@@ -201,6 +502,28 @@ document.addEventListener('DOMContentLoaded', function() {
                     }
                     break;
                     
+                case 'transfer_start':
+                case 'transfer_progress':
+                case 'transfer_ack':
+                case 'transfer_end':
+                    this.handleTransfer(data);
+                    break;
+
+                case 'batch_item':
+                    if (this.batch && data.request_id === this.batch.id && data.status !== 'success') {
+                        this.batch.errors.push(data.paths[0].split('/').pop() + ': ' + data.message);
+                    }
+                    break;
+
+                case 'batch_end':
+                case 'cancelled':
+                    if (!this.batch || data.request_id !== this.batch.id) {
+                        if (data.action === 'batch_end') this.showError(data.message);
+                        break;
+                    }
+                    this.finishBatch(data);
+                    break;
+                    
                 case 'item_renamed':
                     if (data.status === 'success') {
                         this.showSuccess('Renamed successfully!');
@@ -209,61 +532,315 @@ document.addEventListener('DOMContentLoaded', function() {
                         this.showError(data.message);
                     }
                     break;
+
+                default:
+                    return false;
             }
         }
 
-        renderFileList(items) {
-            const fileList = document.getElementById('file-list');
-            fileList.innerHTML = '';
-            
-            if (items.length === 0) {
-                fileList.innerHTML = '<div class="empty-message">Empty directory</div>';
+        watchDirectory(path) {
+            //one live watch at a time: the directory on screen
+            if (path === this.watchedPath) return;
+            if (this.watchedPath !== null) {
+                this.socket.send(JSON.stringify({ action: 'unwatch_directory', ssh_data: this.sshInfo, path: this.watchedPath }));
+            }
+            this.watchedPath = path;
+            this.socket.send(JSON.stringify({ action: 'watch_directory', ssh_data: this.sshInfo, path: path }));
+        }
+
+        startSearch() {
+            const names = document.getElementById('search-names').value.trim();
+            const pattern = document.getElementById('search-pattern').value.trim();
+            if (!names && !pattern) return;
+            this.cancelSearch();
+
+            this.search = { id: this.nextSearchId++, count: 0 };
+            document.getElementById('search-results').innerHTML = '';
+            document.getElementById('search-status').textContent = 'Searching ' + this.currentPath + '...';
+            document.getElementById('search-panel').style.display = '';
+            document.getElementById('btn-search-cancel').style.display = '';
+            this.socket.send(JSON.stringify({
+                action: 'search',
+                ssh_data: this.sshInfo,
+                search_id: this.search.id,
+                path: this.currentPath,
+                names: names ? names.split(/\s+/) : [],
+                pattern: pattern,
+                max_depth: parseInt(document.getElementById('search-depth').value, 10) || 10
+            }));
+        }
+
+        cancelSearch() {
+            if (!this.search) return;
+            this.socket.send(JSON.stringify({ action: 'search_cancel', search_id: this.search.id }));
+        }
+
+        renderSearchResults(matches) {
+            const results = document.getElementById('search-results');
+            const fragment = document.createDocumentFragment();
+            matches.forEach(match => {
+                const row = document.createElement('div');
+                row.className = 'search-result';
+                row.textContent = match.line ? match.path + ':' + match.line + '  ' + match.text : match.path;
+                row.addEventListener('dblclick', () => this.openSearchResult(match));
+                fragment.appendChild(row);
+            });
+            results.appendChild(fragment);
+            this.search.count += matches.length;
+            document.getElementById('search-status').textContent = this.search.count + ' matches so far...';
+        }
+
+        finishSearch(data) {
+            const labels = { success: 'Done', cancelled: 'Stopped', timeout: 'Timed out', error: 'Failed' };
+            let text = (labels[data.status] || data.status) + ': ' + data.count + ' matches in ' + data.elapsed + 's';
+            if (data.truncated) text += ' (limit reached)';
+            if (data.message) text += ' - ' + data.message;
+            document.getElementById('search-status').textContent = text;
+            document.getElementById('btn-search-cancel').style.display = 'none';
+            this.search = null;
+        }
+
+        openSearchResult(match) {
+            //results are relative to the login directory unless the search started from an absolute path
+            const full = match.path.startsWith('/') ? match.path : '~/' + match.path.replace(/^\.\//, '');
+            const slash = full.lastIndexOf('/');
+            this.loadDirectory(full.slice(0, slash) || '/');
+            //content matches are always files; name matches may be directories, so only reveal them
+            if (match.line) {
+                this.readRange(full, { offset: 0, length: PAGE_SIZE, whole: MAX_EDIT_SIZE });
+            }
+        }
+
+        startTail(filepath, offset) {
+            this.stopTail();
+            const include = document.getElementById('tail-include').value.trim();
+            const exclude = document.getElementById('tail-exclude').value.trim();
+            this.tail = { id: this.nextTailId++, filepath: filepath, offset: offset, count: 0, dropped: 0 };
+            if (offset === undefined) document.getElementById('tail-lines').innerHTML = '';
+            document.getElementById('tail-status').textContent = 'Following ' + filepath;
+            document.getElementById('tail-panel').style.display = '';
+            const message = {
+                action: 'tail',
+                ssh_data: this.sshInfo,
+                tail_id: this.tail.id,
+                filepath: filepath,
+                include: include,
+                exclude: exclude
+            };
+            if (offset !== undefined && offset !== null) message.offset = offset;
+            this.socket.send(JSON.stringify(message));
+        }
+
+        stopTail() {
+            if (!this.tail) return;
+            this.socket.send(JSON.stringify({ action: 'tail_stop', tail_id: this.tail.id }));
+            this.tail = null;
+        }
+
+        renderTailLines(data) {
+            const box = document.getElementById('tail-lines');
+            //only stick to the bottom if the user has not scrolled up to read
+            const atBottom = box.scrollTop + box.clientHeight >= box.scrollHeight - 5;
+            const fragment = document.createDocumentFragment();
+            data.lines.forEach(line => {
+                const row = document.createElement('div');
+                row.className = 'search-result';
+                row.textContent = line;
+                fragment.appendChild(row);
+            });
+            if (data.dropped) {
+                const row = document.createElement('div');
+                row.className = 'tail-dropped';
+                row.textContent = '... ' + data.dropped + ' lines dropped (log too fast) ...';
+                fragment.appendChild(row);
+            }
+            box.appendChild(fragment);
+            while (box.childElementCount > TAIL_ROWS) box.firstElementChild.remove();
+            if (atBottom) box.scrollTop = box.scrollHeight;
+            this.tail.count += data.lines.length;
+            this.tail.dropped += data.dropped;
+            if (data.offset !== null) this.tail.offset = data.offset;
+            let text = 'Following ' + this.tail.filepath + ': ' + this.tail.count + ' lines';
+            if (this.tail.dropped) text += ', ' + this.tail.dropped + ' dropped';
+            document.getElementById('tail-status').textContent = text;
+        }
+
+        finishTail(data) {
+            if (data.status === 'error') {
+                document.getElementById('tail-status').textContent = 'Follow failed: ' + data.message;
+            } else {
+                document.getElementById('tail-status').textContent = 'Stopped following ' + this.tail.filepath;
+            }
+            this.tail = null;
+        }
+
+        storePage(data) {
+            data.items.forEach((item, i) => this.view.rows.set(data.offset + i, item));
+        }
+
+        requestPage(offset) {
+            if (this.view.pending.has(offset)) return;
+            this.view.pending.add(offset);
+            this.socket.send(JSON.stringify({
+                action: 'list_page',
+                ssh_data: this.sshInfo,
+                listing: this.view.listing,
+                offset: offset,
+                page_size: LIST_PAGE
+            }));
+        }
+
+        renderFileList() {
+            const list = document.getElementById('file-list');
+            const rows = document.getElementById('file-list-rows');
+            const view = this.view;
+            if (!view) return;
+
+            if (view.total === 0) {
+                rows.style.height = '';
+                rows.innerHTML = '<div class="empty-message">' + (this.filter ? 'No matches' : 'Empty directory') + '</div>';
                 return;
             }
+
+            rows.style.height = (view.total * ROW_HEIGHT) + 'px';
+            const first = Math.max(0, Math.floor(list.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const last = Math.min(view.total, Math.ceil((list.scrollTop + list.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+
+            rows.innerHTML = '';
+            for (let i = first; i < last; i++) {
+                const item = view.rows.get(i);
+                if (!item) {
+                    this.requestPage(i - i % LIST_PAGE);
+                    continue;
+                }
+                const itemDiv = this.createItemRow(item, i);
+                itemDiv.style.top = (i * ROW_HEIGHT) + 'px';
+                rows.appendChild(itemDiv);
+            }
+        }
+
+        createItemRow(item, index) {
+            const itemDiv = document.createElement('div');
+            itemDiv.className = 'file-item';
+            if (this.selection.has(item.name)) {
+                itemDiv.classList.add('selected');
+            }
+            itemDiv.dataset.name = item.name;
+            itemDiv.dataset.type = item.type;
             
-            items.forEach(item => {
-                const itemDiv = document.createElement('div');
-                itemDiv.className = 'file-item';
-                itemDiv.dataset.name = item.name;
-                itemDiv.dataset.type = item.type;
-                
-                const icon = this.getFileIcon(item);
-                const sizeDisplay = item.type === 'directory' ? '' : `<span class="file-size">${this.formatSize(item.size)}</span>`;
-                
-                itemDiv.innerHTML = ` 
-                    <div class="h-align">
-                        <div class="file-icon">${icon}</div>
-                        <div class="file-name">${this.escapeHtml(item.name)}</div>
-                        ${sizeDisplay}
-                    </div>
-                `; 
-                
-                itemDiv.addEventListener('dblclick', () => {
-                    if (item.type === 'directory') {
-                        this.openDirectory(item.name);
-                    } else {
-                        this.openFile(item.name);
-                    }
-                });
-                
-                itemDiv.addEventListener('click', () => {
-                    document.querySelectorAll('.file-item').forEach(el => el.classList.remove('selected'));
-                    itemDiv.classList.add('selected');
-                    this.selectedItem = item;
-                });
-                
-                itemDiv.addEventListener('contextmenu', (e) => {
-                    e.preventDefault();
-                    this.selectedItem = item;
-                    document.querySelectorAll('.file-item').forEach(el => el.classList.remove('selected'));
-                    itemDiv.classList.add('selected');
-                    this.showContextMenu(e.pageX, e.pageY);
-                });
-                
-                fileList.appendChild(itemDiv);
+            const icon = this.getFileIcon(item);
+            const sizeDisplay = item.type === 'directory' ? '' : `<span class="file-size">${this.formatSize(item.size)}</span>`;
+            
+            itemDiv.innerHTML = ` 
+                <div class="h-align">
+                    <div class="file-icon">${icon}</div>
+                    <div class="file-name">${this.escapeHtml(item.name)}</div>
+                    ${sizeDisplay}
+                </div>
+            `; 
+            
+            itemDiv.addEventListener('dblclick', () => {
+                if (item.type === 'directory') {
+                    this.openDirectory(item.name);
+                } else {
+                    this.openFile(item.name);
+                }
+            });
+            
+            itemDiv.addEventListener('click', (e) => {
+                this.selectItem(item, index, e);
+            });
+            
+            itemDiv.addEventListener('contextmenu', (e) => {
+                e.preventDefault();
+                //right-clicking outside the selection starts a new one, inside it keeps the group
+                if (!this.selection.has(item.name)) {
+                    this.selectItem(item, index, {});
+                }
+                this.selectedItem = item;
+                this.showContextMenu(e.pageX, e.pageY);
+            });
+            
+            return itemDiv;
+        }
+
+        selectItem(item, index, e) {
+            if (e.shiftKey && this.anchor !== null) {
+                //rows outside the loaded pages are not known here, so the range covers loaded ones only
+                if (!e.ctrlKey && !e.metaKey) this.selection.clear();
+                const from = Math.min(this.anchor, index);
+                const to = Math.max(this.anchor, index);
+                for (let i = from; i <= to; i++) {
+                    const row = this.view.rows.get(i);
+                    if (row) this.selection.set(row.name, row);
+                }
+            } else if (e.ctrlKey || e.metaKey) {
+                if (this.selection.has(item.name)) {
+                    this.selection.delete(item.name);
+                } else {
+                    this.selection.set(item.name, item);
+                }
+                this.anchor = index;
+            } else {
+                this.selection.clear();
+                this.selection.set(item.name, item);
+                this.anchor = index;
+            }
+            this.selectedItem = item;
+            document.querySelectorAll('.file-item').forEach(el => {
+                el.classList.toggle('selected', this.selection.has(el.dataset.name));
             });
         }
 
+        clearSelection() {
+            this.selection.clear();
+            this.anchor = null;
+            this.selectedItem = null;
+        }
+
+        selectedPaths() {
+            return Array.from(this.selection.keys()).map(name => this.currentPath + '/' + name);
+        }
+
+        sendBatch(operations, label) {
+            //one round trip for the whole selection; the server streams a result per item
+            if (this.batch) {
+                this.showError('Another operation is still running');
+                return;
+            }
+            this.batch = { id: 'batch-' + this.nextBatchId++, label: label, errors: [] };
+            this.socket.send(JSON.stringify({
+                action: 'batch',
+                request_id: this.batch.id,
+                ssh_data: this.sshInfo,
+                operations: operations
+            }));
+        }
+
+        finishBatch(data) {
+            const batch = this.batch;
+            this.batch = null;
+            if (data.action === 'cancelled') {
+                this.showError(batch.label + ' cancelled');
+            } else if (data.status === 'success') {
+                this.showSuccess(`${batch.label}: ${data.succeeded} item(s) done`);
+            } else if (data.total === undefined) {
+                this.showError(data.message);
+            } else {
+                const shown = batch.errors.slice(0, 5).join('; ');
+                const more = batch.errors.length > 5 ? ` (+${batch.errors.length - 5} more)` : '';
+                this.showError(`${batch.label}: ${data.failed} of ${data.total} failed - ${shown}${more}`);
+            }
+            this.clearSelection();
+            this.loadDirectory(this.currentPath);
+        }
+
+        targetDirectory(verb) {
+            const target = prompt(`${verb} ${this.selection.size} item(s) to directory:`, this.currentPath);
+            if (!target) return null;
+            return target.replace(/\/+$/, '') || '/';
+        }
+
         getFileIcon(item) {
             if (item.type === 'directory') {
                 return '<i class="fa-solid fa-folder"></i>';
@@ -291,35 +868,217 @@ document.addEventListener('DOMContentLoaded', function() {
         openFile(name) {
             const filepath = this.currentPath + '/' + name;
             console.log('Opening file:', filepath);
+            this.readRange(filepath, { offset: 0, length: PAGE_SIZE, whole: MAX_EDIT_SIZE });
+        }
+
+        readRange(filepath, range) {
+            const id = this.nextTransferId++;
+            this.transfers[id] = { direction: 'download', filepath: filepath, chunks: [], received: 0 };
             this.socket.send(JSON.stringify({
-                action: 'read_file',
+                action: 'transfer_read',
                 ssh_data: this.sshInfo,
-                filepath: filepath
+                transfer_id: id,
+                filepath: filepath,
+                chunk_size: CHUNK_SIZE,
+                window: WINDOW,
+                ...range
             }));
         }
 
-        openEditor(filepath, content) {
+        turnPage(direction) {
+            if (!this.page) return;
+            const offset = direction < 0 ? Math.max(0, this.page.start - PAGE_SIZE) : this.page.end;
+            if (offset >= this.page.size && direction > 0) return;
+            this.readRange(this.page.filepath, { offset: offset, length: PAGE_SIZE });
+        }
+
+        handleFrame(buffer) {
+            const view = new DataView(buffer);
+            const id = view.getUint32(1);
+            const offset = Number(view.getBigUint64(5));
+            const transfer = this.transfers[id];
+            if (view.getUint8(0) !== 1 || !transfer) return;
+
+            const chunk = new Uint8Array(buffer, 13);
+            transfer.chunks.push(chunk);
+            transfer.received += chunk.length;
+            this.socket.send(JSON.stringify({
+                action: 'transfer_ack',
+                transfer_id: id,
+                offset: offset + chunk.length
+            }));
+        }
+
+        handleTransfer(data) {
+            const transfer = this.transfers[data.transfer_id];
+            if (!transfer) return;
+
+            if (data.status === 'error') {
+                delete this.transfers[data.transfer_id];
+                this.showError(data.message);
+                return;
+            }
+
+            switch(data.action) {
+                case 'transfer_start':
+                    transfer.start = data.offset;
+                    transfer.end = data.end;
+                    transfer.size = data.size;
+                    transfer.mtime = data.mtime;
+                    transfer.hash = data.hash;
+                    if (transfer.direction === 'upload') {
+                        transfer.sent = transfer.acked = data.offset;
+                        this.pumpUpload(data.transfer_id);
+                    }
+                    break;
+
+                case 'transfer_progress':
+                    if (transfer.end) {
+                        const pct = Math.round(100 * (data.offset - transfer.start) / Math.max(1, transfer.end - transfer.start));
+                        document.getElementById('editor-filename').textContent = transfer.filepath + ' (' + pct + '%)';
+                    }
+                    break;
+
+                case 'transfer_ack':
+                    transfer.acked = data.offset;
+                    if (transfer.acked >= transfer.bytes.length) {
+                        this.socket.send(JSON.stringify({ action: 'transfer_finish', transfer_id: data.transfer_id }));
+                    } else {
+                        this.pumpUpload(data.transfer_id);
+                    }
+                    break;
+
+                case 'transfer_end':
+                    delete this.transfers[data.transfer_id];
+                    if (transfer.direction === 'upload') {
+                        this.handleMessage({ action: 'file_written', status: 'success', filepath: transfer.filepath });
+                    } else {
+                        this.finishDownload(transfer);
+                    }
+                    break;
+            }
+        }
+
+        finishDownload(transfer) {
+            const bytes = new Uint8Array(transfer.received);
+            let pos = 0;
+            transfer.chunks.forEach(chunk => {
+                bytes.set(chunk, pos);
+                pos += chunk.length;
+            });
+
+            const whole = transfer.start === 0 && transfer.end === transfer.size;
+            let content;
+            let binary = false;
+            try {
+                content = new TextDecoder('utf-8', { fatal: true }).decode(bytes);
+            } catch (e) {
+                content = new TextDecoder('utf-8').decode(bytes);
+                binary = true;
+            }
+
+            this.page = whole ? null : { filepath: transfer.filepath, start: transfer.start, end: transfer.end, size: transfer.size };
+            this.openEditor(transfer.filepath, content, binary ? 'binary' : 'utf-8',
+                whole ? { size: transfer.size, mtime: transfer.mtime, hash: transfer.hash } : null);
+        }
+
+        pumpUpload(id) {
+            const transfer = this.transfers[id];
+            const total = transfer.bytes.length;
+            while (transfer.sent < total && transfer.sent - transfer.acked < WINDOW * CHUNK_SIZE) {
+                const chunk = transfer.bytes.subarray(transfer.sent, transfer.sent + CHUNK_SIZE);
+                const frame = new ArrayBuffer(13 + chunk.length);
+                const view = new DataView(frame);
+                view.setUint8(0, 1);
+                view.setUint32(1, id);
+                view.setBigUint64(5, BigInt(transfer.sent));
+                new Uint8Array(frame, 13).set(chunk);
+                this.socket.send(frame);
+                transfer.sent += chunk.length;
+            }
+        }
+
+        openEditor(filepath, content, encoding, version) {
+            const editor = document.getElementById('editor-content');
+            const readOnly = encoding !== 'utf-8' || this.page !== null;
+            let title = filepath;
+            if (encoding !== 'utf-8') {
+                title += ' (binary, read-only)';
+            } else if (this.page) {
+                title += ' (read-only)';
+            }
             document.getElementById('file-editor').style.display = 'flex';
-            document.getElementById('editor-filename').textContent = filepath;
-            document.getElementById('editor-content').value = content;
+            document.getElementById('editor-filename').textContent = title;
+            editor.value = encoding === 'base64' ? atob(content) : content;
+            editor.readOnly = readOnly;
+            document.getElementById('btn-save').disabled = readOnly;
+
+            const pager = document.getElementById('editor-pager');
+            pager.style.display = this.page ? 'inline' : 'none';
+            if (this.page) {
+                document.getElementById('editor-page-info').textContent =
+                    this.formatSize(this.page.start) + ' - ' + this.formatSize(this.page.end) + ' of ' + this.formatSize(this.page.size);
+            }
             this.currentEditFile = filepath;
+            this.editorBase = readOnly || !version ? null : content;
+            this.editorVersion = version;
         }
 
         closeEditor() {
             document.getElementById('file-editor').style.display = 'none';
             this.currentEditFile = null;
+            this.editorBase = null;
+            this.editorVersion = null;
+            this.page = null;
         }
 
         saveFile() {
             if (!this.currentEditFile) return;
             
-            const content = document.getElementById('editor-content').value;
+            let content = document.getElementById('editor-content').value;
             console.log('Saving file:', this.currentEditFile);
+            //a full write is checked against the opened version too
+            let base;
+            if (this.editorBase !== null) {
+                //checked against the version that was opened and applied on the host; a rewrite too big
+                //for one message goes through the chunked upload below instead
+                const hunks = patchHunks(this.editorBase, content);
+                if (hunks && hunks.reduce((total, hunk) => total + utf8Length(hunk[2]), 0) <= CHUNK_SIZE) {
+                    this.socket.send(JSON.stringify({
+                        action: 'patch_file',
+                        ssh_data: this.sshInfo,
+                        filepath: this.currentEditFile,
+                        base: this.editorVersion,
+                        hunks: hunks
+                    }));
+                    return;
+                }
+                content = withLineEnding(content, lineEnding(this.editorBase));
+                base = this.editorVersion;
+            }
+            const bytes = new TextEncoder().encode(content);
+            if (bytes.length <= CHUNK_SIZE) {
+                this.socket.send(JSON.stringify({
+                    action: 'write_file',
+                    ssh_data: this.sshInfo,
+                    filepath: this.currentEditFile,
+                    content: content,
+                    base: base
+                }));
+                return;
+            }
+
+            const id = this.nextTransferId++;
+            this.transfers[id] = { direction: 'upload', filepath: this.currentEditFile, bytes: bytes };
             this.socket.send(JSON.stringify({
-                action: 'write_file',
+                action: 'transfer_write',
                 ssh_data: this.sshInfo,
+                transfer_id: id,
                 filepath: this.currentEditFile,
-                content: content
+                size: bytes.length,
+                base: base,
+                chunk_size: CHUNK_SIZE,
+                window: WINDOW
             }));
         }
 
@@ -386,6 +1145,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
         handleContextMenuAction(action) {
             if (!this.selectedItem) return;
+            if (this.selection.size > 1 || ['copy', 'move', 'chmod'].includes(action)) {
+                this.handleSelectionAction(action);
+                return;
+            }
             
             const itemPath = this.currentPath + '/' + this.selectedItem.name;
             
@@ -403,6 +1166,12 @@ document.addEventListener('DOMContentLoaded', function() {
                         this.openFile(this.selectedItem.name);
                     }
                     break;
+
+                case 'tail':
+                    if (this.selectedItem.type === 'file') {
+                        this.startTail(itemPath);
+                    }
+                    break;
                     
                 case 'rename':
                     const newName = prompt('Enter new name:', this.selectedItem.name);
@@ -430,6 +1199,53 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         }
 
+        handleSelectionAction(action) {
+            const names = Array.from(this.selection.keys());
+            const paths = this.selectedPaths();
+            let target;
+            switch(action) {
+                case 'open':
+                case 'edit':
+                case 'tail':
+                case 'rename':
+                    this.showError('Select a single item to ' + action);
+                    break;
+
+                case 'copy':
+                case 'move':
+                    target = this.targetDirectory(action === 'copy' ? 'Copy' : 'Move');
+                    if (target === null) break;
+                    this.sendBatch(paths.map((src, i) => ({
+                        op: action,
+                        src: src,
+                        dst: target + '/' + names[i]
+                    })), action === 'copy' ? 'Copy' : 'Move');
+                    break;
+
+                case 'chmod': {
+                    const mode = prompt(`Permissions for ${names.length} item(s) (octal, e.g. 644):`, '644');
+                    if (!mode) break;
+                    if (!/^[0-7]{3,4}$/.test(mode)) {
+                        this.showError('Permissions must be 3 or 4 octal digits');
+                        break;
+                    }
+                    const recursive = this.selectedDirectories() > 0 && confirm('Apply to folder contents as well?');
+                    this.sendBatch(paths.map(path => ({ op: 'chmod', path: path, mode: mode, recursive: recursive })), 'Permissions');
+                    break;
+                }
+
+                case 'delete':
+                    if (confirm(`Are you sure you want to delete ${names.length} items?\n` + names.slice(0, 10).join('\n') + (names.length > 10 ? '\n...' : ''))) {
+                        this.sendBatch(paths.map(path => ({ op: 'delete', path: path })), 'Delete');
+                    }
+                    break;
+            }
+        }
+
+        selectedDirectories() {
+            return Array.from(this.selection.values()).filter(item => item.type === 'directory').length;
+        }
+
         showError(message) {
             const fileList = document.getElementById('file-list');
             const errorDiv = document.createElement('div');
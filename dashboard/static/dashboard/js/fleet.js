@@ -0,0 +1,85 @@
+function parseHost(line, password) {
+    //user@host[:port]
+    const match = line.match(/^(?:([^@\s]+)@)?([^:\s]+)(?::(\d+))?$/);
+    if (!match) return null;
+    return {
+        user: match[1] || 'root',
+        host: match[2],
+        port: match[3] ? parseInt(match[3], 10) : 22,
+        password: password
+    };
+}
+
+function percent(value) {
+    return value === null || value === undefined ? '-' : value + '%';
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('fleet-form');
+    const tbody = document.querySelector('#fleet-table tbody');
+    const status = document.getElementById('fleet-status');
+    if (!form || !tbody) {
+        return;
+    }
+
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(protocol + '//' + window.location.host + '/ws/fleet/');
+    enableCompression(socket);
+    const rows = {};
+
+    function addRow(id) {
+        const tr = document.createElement('tr');
+        tr.innerHTML = '<td></td><td>pending</td><td>-</td><td>-</td><td>-</td><td>-</td><td>-</td>';
+        tr.cells[0].textContent = id;
+        tbody.appendChild(tr);
+        rows[id] = tr;
+    }
+
+    function updateRow(row) {
+        const tr = rows[row.id];
+        if (!tr) return;
+        tr.className = 'fleet-' + row.status;
+        tr.cells[1].textContent = row.status;
+        tr.cells[1].title = row.error || '';
+        tr.cells[2].textContent = percent(row.cpu);
+        tr.cells[3].textContent = percent(row.mem);
+        tr.cells[4].textContent = percent(row.disk);
+        tr.cells[5].textContent = row.load === null || row.load === undefined ? '-' : row.load;
+        tr.cells[6].textContent = row.latency + 'ms';
+    }
+
+    form.addEventListener('submit', function(event) {
+        event.preventDefault();
+        const password = document.getElementById('fleet-password').value;
+        const hosts = document.getElementById('fleet-hosts').value
+            .split('\n')
+            .map(line => line.trim())
+            .filter(line => line)
+            .map(line => parseHost(line, password))
+            .filter(host => host);
+        socket.send(JSON.stringify({
+            action: 'start',
+            hosts: hosts,
+            interval: parseFloat(document.getElementById('fleet-interval').value) || 5
+        }));
+    });
+
+    socket.onmessage = function(event) {
+        const data = JSON.parse(event.data);
+        if (data.action === 'fleet_hosts') {
+            tbody.textContent = '';
+            Object.keys(rows).forEach(id => delete rows[id]);
+            data.hosts.forEach(addRow);
+            status.textContent = 'Sampling ' + data.hosts.length + ' hosts';
+        } else if (data.action === 'fleet_update') {
+            //only changed rows arrive, batched once per flush
+            data.rows.forEach(updateRow);
+        } else if (data.status === 'error') {
+            status.textContent = 'Error - ' + data.message;
+        }
+    };
+
+    socket.onclose = function() {
+        status.textContent = 'Disconnected';
+    };
+});
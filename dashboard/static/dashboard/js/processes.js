@@ -0,0 +1,113 @@
+//column index in a process row: [pid, name, state, threads, cpu, rss, io]
+const PROCESS_SORTS = { cpu: 4, mem: 5, io: 6 };
+
+class ProcessView {
+    constructor(panelId, socket, sshInfo) {
+        this.panel = document.getElementById(panelId);
+        this.socket = socket;
+        this.sshInfo = sshInfo;
+        //pid -> row; the server sends the whole table once, then only changed rows and removed pids
+        this.rows = new Map();
+        this.sort = 'cpu';
+        this.limit = 20;
+        this.active = false;
+        this.build();
+        this.socket.addEventListener('message', event => {
+            if (typeof event.data !== 'string') return;
+            const data = JSON.parse(event.data);
+            if (data.action === 'processes') this.handle(data);
+        });
+    }
+
+    build() {
+        this.panel.innerHTML = `
+            <div class='process-controls'>
+                <select class='process-sort'>
+                    <option value='cpu'>CPU</option>
+                    <option value='mem'>Memory</option>
+                    <option value='io'>I/O</option>
+                </select>
+                <select class='process-limit'>
+                    <option>10</option><option selected>20</option><option>50</option><option>100</option>
+                </select>
+                <span class='process-status'></span>
+            </div>
+            <table class='process-table'>
+                <thead><tr><th>PID</th><th>Name</th><th>S</th><th>Thr</th><th>CPU%</th><th>Mem</th><th>I/O</th></tr></thead>
+                <tbody></tbody>
+            </table>`;
+        this.body = this.panel.querySelector('tbody');
+        this.status = this.panel.querySelector('.process-status');
+        this.panel.querySelector('.process-sort').addEventListener('change', e => {
+            this.sort = e.target.value;
+            this.render();
+        });
+        this.panel.querySelector('.process-limit').addEventListener('change', e => {
+            this.limit = parseInt(e.target.value, 10);
+            //the server keeps the top rows of every column, so a longer table needs more of them
+            this.start();
+        });
+    }
+
+    start() {
+        this.active = true;
+        this.socket.send(JSON.stringify({ action: 'processes', ssh_data: this.sshInfo, rows: this.limit }));
+    }
+
+    stop() {
+        this.active = false;
+        this.socket.send(JSON.stringify({ action: 'processes_stop', ssh_data: this.sshInfo }));
+    }
+
+    handle(data) {
+        if (data.status !== 'success') {
+            this.status.textContent = 'Error - ' + data.message;
+            return;
+        }
+        if (!this.active) return;
+        if (data.full) this.rows.clear();
+        (data.remove || []).forEach(pid => this.rows.delete(pid));
+        (data.upsert || []).forEach(row => this.rows.set(row[0], row));
+        if (data.count !== undefined) {
+            this.status.textContent = data.count + ' processes, scan ' + Math.round(data.scan * 1000) + 'ms, every ' +
+                data.interval.toFixed(1) + 's';
+        }
+        this.render();
+    }
+
+    render() {
+        const column = PROCESS_SORTS[this.sort];
+        const top = [...this.rows.values()].sort((a, b) => b[column] - a[column]).slice(0, this.limit);
+        this.body.replaceChildren(...top.map(row => {
+            const tr = document.createElement('tr');
+            const cells = [row[0], row[1], row[2], row[3], row[4].toFixed(1), formatBytes(row[5]), formatBytes(row[6]) + '/s'];
+            cells.forEach(value => {
+                const td = document.createElement('td');
+                td.textContent = value;
+                tr.appendChild(td);
+            });
+            return tr;
+        }));
+    }
+}
+
+window.ProcessView = ProcessView;
+
+document.addEventListener('DOMContentLoaded', function() {
+    const toggle = document.getElementById('btn-processes');
+    const panel = document.getElementById('process-panel');
+    if (!toggle || !panel) {
+        return;
+    }
+    toggle.addEventListener('click', function() {
+        const view = window.processView;
+        if (!view) return;
+        if (panel.style.display === 'none') {
+            panel.style.display = '';
+            view.start();
+        } else {
+            panel.style.display = 'none';
+            view.stop();
+        }
+    });
+});
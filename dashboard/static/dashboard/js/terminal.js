@@ -0,0 +1,111 @@
+//bytes of output written to the screen before the server is told it may send more
+const TERMINAL_ACK_EVERY = 32 * 1024;
+
+document.addEventListener('DOMContentLoaded', function() {
+    const panel = document.getElementById('terminal-panel');
+    const toggle = document.getElementById('btn-terminal');
+    const sshInfo = window.sshInfo;
+    if (!panel || !toggle || !sshInfo || !window.Terminal) {
+        return;
+    }
+
+    let term = null;
+    let fit = null;
+    let socket = null;
+
+    function open() {
+        term = new Terminal({ cursorBlink: true, fontSize: 13, scrollback: 5000 });
+        fit = new FitAddon.FitAddon();
+        term.loadAddon(fit);
+        term.open(document.getElementById('terminal'));
+        fit.fit();
+
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        socket = new WebSocket(protocol + '//' + window.location.host + '/ws/terminal/');
+        socket.binaryType = 'arraybuffer';
+        const encoder = new TextEncoder();
+        let received = 0;
+        let acked = 0;
+
+        socket.onopen = function() {
+            socket.send(JSON.stringify({
+                action: 'start',
+                ssh_data: sshInfo,
+                cols: term.cols,
+                rows: term.rows
+            }));
+        };
+
+        socket.onmessage = function(event) {
+            if (event.data instanceof ArrayBuffer) {
+                const data = new Uint8Array(event.data);
+                //acknowledged once xterm has actually rendered it, so a slow tab pauses the shell
+                term.write(data, () => {
+                    received += data.length;
+                    //anything below the threshold is far inside the server's window, so it never stalls
+                    if (received - acked >= TERMINAL_ACK_EVERY) {
+                        acked = received;
+                        if (socket && socket.readyState === WebSocket.OPEN) {
+                            socket.send(JSON.stringify({ action: 'ack', received: received }));
+                        }
+                    }
+                });
+                return;
+            }
+            const data = JSON.parse(event.data);
+            if (data.action === 'terminal_error') {
+                term.write('\r\n[error: ' + data.message + ']\r\n');
+            } else if (data.action === 'terminal_exit') {
+                term.write('\r\n[session ended' + (data.exit_status !== null ? ', exit status ' + data.exit_status : '') + ']\r\n');
+            }
+        };
+
+        socket.onclose = function() {
+            socket = null;
+        };
+
+        term.onData(text => {
+            if (socket && socket.readyState === WebSocket.OPEN) socket.send(encoder.encode(text));
+        });
+        term.onBinary(text => {
+            if (!socket || socket.readyState !== WebSocket.OPEN) return;
+            const bytes = new Uint8Array(text.length);
+            for (let i = 0; i < text.length; i++) bytes[i] = text.charCodeAt(i) & 0xff;
+            socket.send(bytes);
+        });
+        term.onResize(size => {
+            if (socket && socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify({ action: 'resize', cols: size.cols, rows: size.rows }));
+            }
+        });
+    }
+
+    function close() {
+        if (socket) socket.close();
+        socket = null;
+        if (term) term.dispose();
+        term = null;
+    }
+
+    toggle.addEventListener('click', function() {
+        if (panel.style.display === 'none') {
+            panel.style.display = '';
+            if (!term || !socket) {
+                close();
+                open();
+            }
+            fit.fit();
+            term.focus();
+        } else {
+            panel.style.display = 'none';
+        }
+    });
+
+    let resizeTimer = null;
+    window.addEventListener('resize', function() {
+        clearTimeout(resizeTimer);
+        resizeTimer = setTimeout(() => {
+            if (term && panel.style.display !== 'none') fit.fit();
+        }, 100);
+    });
+});
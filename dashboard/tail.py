@@ -0,0 +1,153 @@
+import asyncio
+import json
+import re
+import shlex
+import time
+
+from .remotefs import remote_path
+from .search import cancellable
+from .transfer import clamp
+
+DEFAULT_LINES = 100
+MAX_LINES = 10000
+MAX_LINE = 2000
+FLUSH_INTERVAL = 0.2
+#lines per message; a burst is split over several
+FLUSH_SIZE = 500
+#sustained lines per second passed on to the browser, with a burst allowance on top;
+#anything beyond is dropped and only counted
+RATE_LIMIT = 1000
+BURST = 5000
+#lines waiting to be sent; past this new ones are dropped as well
+MAX_PENDING = 5000
+READ_SIZE = 65536
+
+
+def tail_command(path, offset=None, lines=DEFAULT_LINES):
+    #-F keeps following across log rotation; the watcher from cancellable() stops a quiet tail on close
+    start = f'-c +{offset + 1}' if offset is not None else f'-n {lines}'
+    return cancellable(f'exec tail {start} -F -- {shlex.quote(remote_path(path))} 2>/dev/null')
+
+
+def compile_filter(pattern, ignore_case):
+    if not pattern:
+        return None
+    try:
+        return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    except re.error as e:
+        raise ValueError(f'Invalid filter {pattern!r}: {e}')
+
+
+class Tail:
+    def __init__(self, tail_id, params, send):
+        self.tail_id = tail_id
+        self.send = send
+        self.path = params.get('filepath')
+        if not self.path:
+            raise ValueError('No file to tail')
+        ignore_case = bool(params.get('ignore_case', False))
+        self.include = compile_filter(params.get('include'), ignore_case)
+        self.exclude = compile_filter(params.get('exclude'), ignore_case)
+        offset = params.get('offset')
+        self.start = None if offset is None else max(0, int(offset))
+        self.lines = clamp(params.get('lines'), DEFAULT_LINES, MAX_LINES)
+        #bytes of the file consumed so far, when started from a known offset
+        self.offset = self.start
+        self.count = 0
+        self.dropped = 0
+        self.task = None
+        self._pending = []
+        self._dropped = 0
+        self._tokens = BURST
+        self._refilled = time.monotonic()
+        self._last_flush = 0
+
+    def command(self):
+        return tail_command(self.path, self.start, self.lines)
+
+    async def run(self, conn):
+        status, message = 'success', None
+        try:
+            await self.stream(conn)
+        except asyncio.CancelledError:
+            await self.finish('cancelled', None)
+            raise
+        except Exception as e:
+            status, message = 'error', str(e)
+        await self.finish(status, message)
+
+    async def stream(self, conn):
+        process = await conn.create_process(self.command(), encoding=None)
+        buffer = b''
+        reading = None
+        try:
+            while True:
+                if reading is None:
+                    reading = asyncio.ensure_future(process.stdout.read(READ_SIZE))
+                done, _ = await asyncio.wait({reading}, timeout=FLUSH_INTERVAL)
+                if not done:
+                    await self.flush()
+                    continue
+                chunk, reading = reading.result(), None
+                if not chunk:
+                    break
+                *lines, buffer = (buffer + chunk).split(b'\n')
+                if self.offset is not None:
+                    self.offset += sum(len(line) + 1 for line in lines)
+                if len(buffer) > MAX_LINE * 4:
+                    #a runaway line without a newline is cut rather than buffered forever; it has no
+                    #newline to count, and the rest of it goes on from here
+                    if self.offset is not None:
+                        self.offset += len(buffer)
+                    lines.append(buffer)
+                    buffer = b''
+                for line in lines:
+                    self.add(line.decode(errors='replace').rstrip('\r'))
+                if len(self._pending) >= FLUSH_SIZE or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+                    await self.flush()
+        finally:
+            if reading is not None:
+                reading.cancel()
+            process.close()
+
+    def add(self, line):
+        if self.include is not None and not self.include.search(line):
+            return
+        if self.exclude is not None and self.exclude.search(line):
+            return
+        now = time.monotonic()
+        self._tokens = min(BURST, self._tokens + (now - self._refilled) * RATE_LIMIT)
+        self._refilled = now
+        if self._tokens < 1 or len(self._pending) >= MAX_PENDING:
+            self._dropped += 1
+            return
+        self._tokens -= 1
+        self._pending.append(line[:MAX_LINE])
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        while self._pending or self._dropped:
+            lines, self._pending = self._pending[:FLUSH_SIZE], self._pending[FLUSH_SIZE:]
+            dropped, self._dropped = self._dropped, 0
+            self.count += len(lines)
+            self.dropped += dropped
+            await self.send(text_data=json.dumps({
+                'action': 'tail_lines',
+                'status': 'success',
+                'tail_id': self.tail_id,
+                'lines': lines,
+                'dropped': dropped,
+                'offset': self.offset,
+            }))
+
+    async def finish(self, status, message):
+        await self.flush()
+        await self.send(text_data=json.dumps({
+            'action': 'tail_end',
+            'status': status,
+            'tail_id': self.tail_id,
+            'count': self.count,
+            'dropped': self.dropped,
+            'offset': self.offset,
+            'message': message,
+        }), error=status == 'error')
@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+import asyncssh
+
+from .transfer import clamp
+
+DEFAULT_COLS = 80
+DEFAULT_ROWS = 24
+MAX_COLS = 1000
+MAX_ROWS = 500
+TERM_TYPE = 'xterm-256color'
+READ_SIZE = 65536
+#output is held back this long after the first byte, or until this much is pending, and sent as one frame
+COALESCE_DELAY = 0.015
+COALESCE_BYTES = 64 * 1024
+#bytes the browser may have outstanding before the shell is paused; once reads stop, the
+#ssh channel window fills and the remote program blocks on write
+DEFAULT_WINDOW = 256 * 1024
+MAX_WINDOW = 4 * 1024 * 1024
+
+
+class Terminal:
+    def __init__(self, send, cols=None, rows=None, window=None):
+        self.send = send
+        self.cols = clamp(cols, DEFAULT_COLS, MAX_COLS)
+        self.rows = clamp(rows, DEFAULT_ROWS, MAX_ROWS)
+        self.window = clamp(window, DEFAULT_WINDOW, MAX_WINDOW)
+        self.process = None
+        self.task = None
+        self.sent = 0
+        self.acked = 0
+        self._acked = asyncio.Event()
+
+    async def open(self, conn):
+        #stderr shares the pty with stdout, exactly as in an ssh client
+        self.process = await conn.create_process(
+            term_type=TERM_TYPE, term_size=(self.cols, self.rows), encoding=None, stderr=asyncssh.STDOUT)
+        await self.send(text_data=json.dumps({
+            'action': 'terminal_start',
+            'status': 'success',
+            'cols': self.cols,
+            'rows': self.rows,
+            'window': self.window,
+        }))
+
+    def write(self, data):
+        self.process.stdin.write(bytes(data))
+
+    def resize(self, cols, rows):
+        self.cols = clamp(cols, self.cols, MAX_COLS)
+        self.rows = clamp(rows, self.rows, MAX_ROWS)
+        self.process.change_terminal_size(self.cols, self.rows)
+
+    def ack(self, received):
+        if received > self.acked:
+            self.acked = received
+            self._acked.set()
+
+    async def run(self):
+        try:
+            await self.pump()
+            await self.process.wait_closed()
+            status, exit_status = 'success', self.process.exit_status
+        except asyncssh.Error as e:
+            status, exit_status = 'error', None
+            await self.send(text_data=json.dumps({'action': 'terminal_error', 'status': 'error', 'message': str(e)}))
+        await self.send(text_data=json.dumps({
+            'action': 'terminal_exit',
+            'status': status,
+            'exit_status': exit_status,
+        }))
+
+    async def pump(self):
+        loop = asyncio.get_running_loop()
+        stdout = self.process.stdout
+        buffer = bytearray()
+        flush_at = 0
+        reading = None
+        try:
+            while True:
+                if reading is None:
+                    if self.sent + len(buffer) - self.acked >= self.window:
+                        #paused: show what is pending, then stop reading until the browser catches up
+                        await self.flush(buffer)
+                        while self.sent - self.acked >= self.window:
+                            self._acked.clear()
+                            await self._acked.wait()
+                    reading = asyncio.ensure_future(stdout.read(READ_SIZE))
+                timeout = max(0.0, flush_at - loop.time()) if buffer else None
+                done, _ = await asyncio.wait({reading}, timeout=timeout)
+                if done:
+                    chunk, reading = reading.result(), None
+                    if not chunk:
+                        break
+                    if not buffer:
+                        flush_at = loop.time() + COALESCE_DELAY
+                    buffer += chunk
+                    if len(buffer) < COALESCE_BYTES and loop.time() < flush_at:
+                        continue
+                await self.flush(buffer)
+            await self.flush(buffer)
+        finally:
+            if reading is not None:
+                reading.cancel()
+
+    async def flush(self, buffer):
+        if not buffer:
+            return
+        data = bytes(buffer)
+        buffer.clear()
+        self.sent += len(data)
+        await self.send(bytes_data=data)
+
+    def close(self):
+        if self.process is not None:
+            self.process.close()
@@ -1,3 +1,1371 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+from collections import Counter
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import asyncssh
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, override_settings
+
+from .agent import MetricsParser
+from .alerts import MAX_GAP, HostAlerts, Rule
+from .batch import Batch
+from .cluster import CHANNEL, Cluster, is_local, owner, seal
+from .consumers import SERIAL_ACTIONS, SUPERSEDES, Consumer, FleetConsumer
+from .dircache import DirCache
+from .encoding import FULL_EVERY, SampleEncoder, flatten
+from .fleet import FleetSampler
+from .history import GRACE, RAW_TIER, ROLLUP, TIERS, HistoryStore, segment_start
+from .management.commands import serve
+from .monitors import MonitorRegistry
+from .pool import PoolExhausted, SSHPool, pool as shared_pool, pool_key
+from .remotefs import RemoteFS, VersionConflict, check_hunks, sample, version
+from .tail import MAX_LINE, Tail
+from .timeseries import TIERS as RING_TIERS, HostSeries, Ring
+from .transfer import KIND_MONITOR, Download, Upload, unpack_frame
+from .vault import PREFIX, Vault, VaultError, vault
+from .watcher import DirWatcher
+
+KEY = ('u', 'example.com', 22)
+#an hour boundary that is also a 5 minute one, like every raw segment start
+T0 = 1_700_006_400
+
+
+class HistoryStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = HistoryStore(self.root)
+
+    def write_hour(self, start):
+        #one sample a second; cpu is the minute within the hour, disk alternates so min and max differ
+        self.store.write({KEY: [(start + i, (i // 60, 50, i % 2)) for i in range(3600)]})
+
+    def tier(self, name):
+        return next(tier for tier in TIERS if tier[0] == name)
+
+    def rows(self, name, start):
+        _, _, span, _ = self.tier(name)
+        return self.store.read(KEY, name, segment_start(start, span), ROLLUP)
+
+    def test_roll_up_writes_each_tier(self):
+        self.write_hour(T0)
+        self.store.roll_up(KEY, T0 + 3600 + GRACE)
+        self.assertEqual(self.store.compacted(KEY), T0 + 3600)
+
+        minutes = self.rows('1m', T0)
+        self.assertEqual(len(minutes), 60)
+        for i, row in enumerate(minutes):
+            #t, count, then min/avg/max per field
+            self.assertEqual(row[:2], (T0 + 60 * i, 60))
+            self.assertEqual(row[2:5], (i, i, i))
+            self.assertEqual(row[5:8], (50, 50, 50))
+            self.assertEqual(row[8:11], (0, 0.5, 1))
+
+        fives = self.rows('5m', T0)
+        self.assertEqual([row[:2] for row in fives], [(T0 + 300 * i, 300) for i in range(12)])
+        self.assertEqual(fives[1][2:5], (5, 7, 9))
+
+        hours = self.rows('1h', T0)
+        self.assertEqual(len(hours), 1)
+        self.assertEqual(hours[0][:5], (T0, 3600, 0, 29.5, 59))
+
+    def test_roll_up_waits_for_closed_segments_and_runs_once(self):
+        self.write_hour(T0)
+        self.store.write({KEY: [(T0 + 3600, (1, 1, 1))]})
+        #still inside the grace period after the hour closed
+        self.store.roll_up(KEY, T0 + 3600 + GRACE - 1)
+        self.assertEqual(self.store.compacted(KEY), 0.0)
+        self.assertEqual(self.rows('1m', T0), [])
+
+        self.store.roll_up(KEY, T0 + 3600 + GRACE)
+        self.store.roll_up(KEY, T0 + 3600 + GRACE + 60)
+        #the open hour is left alone and a second pass adds nothing
+        self.assertEqual(self.store.compacted(KEY), T0 + 3600)
+        self.assertEqual(len(self.rows('1m', T0)), 60)
+
+    def test_roll_up_replaces_rows_from_an_interrupted_run(self):
+        self.write_hour(T0)
+        self.store.roll_up(KEY, T0 + 3600 + GRACE)
+        #as if the mark had not been moved before the process died
+        os.remove(os.path.join(self.root, os.listdir(self.root)[0], 'compacted'))
+        self.store.roll_up(KEY, T0 + 3600 + GRACE)
+        self.assertEqual(len(self.rows('1m', T0)), 60)
+        self.assertEqual(len(self.rows('1h', T0)), 1)
+
+    def test_expire_drops_old_segments_only_once_rolled_up(self):
+        raw, _, span, retention = RAW_TIER
+        self.write_hour(T0)
+        recent = T0 + 3 * 86400
+        self.store.write({KEY: [(recent, (1, 1, 1))]})
+
+        self.store.expire(KEY, recent + 60)
+        self.assertEqual(self.store.segments(KEY, raw, span), [T0, recent])
+
+        self.store.roll_up(KEY, recent + 60)
+        self.store.expire(KEY, recent + 60)
+        self.assertEqual(self.store.segments(KEY, raw, span), [recent])
+        self.assertEqual(len(self.rows('1m', T0)), 60)
+
+        #a month and a bit later the minute tier is gone and the coarser ones are kept
+        later = T0 + 32 * 86400
+        self.store.expire(KEY, later)
+        self.assertEqual(self.rows('1m', T0), [])
+        self.assertEqual(len(self.rows('5m', T0)), 12)
+        self.assertEqual(len(self.rows('1h', T0)), 1)
+
+    def test_choose_tier(self):
+        cases = {0.5: 'raw', 1: 'raw', 59: 'raw', 60: '1m', 299: '1m', 300: '5m', 3599: '5m', 3600: '1h', 86400: '1h'}
+        for step, name in cases.items():
+            with self.subTest(step=step):
+                self.assertEqual(self.store.choose_tier(step)[0], name)
+
+    def test_query_uses_rollups_up_to_the_mark_then_raw(self):
+        self.write_hour(T0)
+        self.store.roll_up(KEY, T0 + 3600 + GRACE)
+        #not rolled up yet
+        self.store.write({KEY: [(T0 + 3600 + i, (100, 0, 0)) for i in range(60)]})
+
+        result = self.store.query_sync(KEY, T0, T0 + 3660, 300, ['cpu'])
+        self.assertEqual(result['resolution'], 300)
+        self.assertEqual(result['t'], [T0 + 300 * i for i in range(13)])
+        self.assertEqual(result['series']['cpu']['avg'][:2], [2, 7])
+        self.assertEqual(result['series']['cpu']['min'][1], 5)
+        self.assertEqual(result['series']['cpu']['max'][1], 9)
+        self.assertEqual(result['series']['cpu']['avg'][-1], 100)
+
+        result = self.store.query_sync(KEY, T0 + 3600, T0 + 3660, 1, ['cpu', 'disk'])
+        self.assertEqual(result['resolution'], 1)
+        self.assertEqual(len(result['t']), 60)
+        self.assertEqual(set(result['series']), {'cpu', 'disk'})
+
+    def test_query_folds_raw_rows_into_steps(self):
+        self.write_hour(T0)
+        result = self.store.query_sync(KEY, T0, T0 + 600, 30, ['disk'])
+        self.assertEqual(result['resolution'], 1)
+        self.assertEqual(len(result['t']), 20)
+        self.assertEqual(result['series']['disk'], {'min': [0] * 20, 'avg': [0.5] * 20, 'max': [1] * 20})
+
+
+def reading(cpu=0, mem=0, disk=0):
+    return (cpu, mem, disk)
+
+
+class HostAlertsTests(SimpleTestCase):
+    def test_threshold_fires_once_above_the_value(self):
+        alerts = HostAlerts([Rule('cpu-high', 'cpu', 90, clear=80)])
+        self.assertEqual(alerts.update(0, reading(cpu=90)), [])
+        events = alerts.update(1, reading(cpu=95))
+        self.assertEqual([(e['rule'], e['status'], e['value'], e['since']) for e in events],
+                         [('cpu-high', 'firing', 95, 1)])
+        self.assertEqual(alerts.update(2, reading(cpu=99)), [])
+        self.assertEqual(alerts.active(), events)
+
+    def test_threshold_waits_for_the_duration(self):
+        alerts = HostAlerts([Rule('cpu-sustained', 'cpu', 90, **{'for': 10})])
+        self.assertEqual(alerts.update(0, reading(cpu=95)), [])
+        self.assertEqual(alerts.update(5, reading(cpu=95)), [])
+        #a dip restarts the wait
+        self.assertEqual(alerts.update(6, reading(cpu=50)), [])
+        self.assertEqual(alerts.update(7, reading(cpu=95)), [])
+        self.assertEqual(alerts.update(16, reading(cpu=95)), [])
+        events = alerts.update(17, reading(cpu=95))
+        self.assertEqual([(e['status'], e['since']) for e in events], [('firing', 7)])
+
+    def test_stays_firing_until_below_the_clear_level(self):
+        alerts = HostAlerts([Rule('disk-full', 'disk', 90, clear=85)])
+        alerts.update(0, reading(disk=95))
+        #between clear and value: still firing, nothing announced
+        self.assertEqual(alerts.update(1, reading(disk=88)), [])
+        self.assertEqual(alerts.update(2, reading(disk=85.5)), [])
+        self.assertEqual([e['rule'] for e in alerts.active()], ['disk-full'])
+        events = alerts.update(3, reading(disk=85))
+        self.assertEqual([(e['status'], e['value'], e['since']) for e in events], [('resolved', 85, 0)])
+        self.assertEqual(alerts.active(), [])
+        self.assertEqual(alerts.update(4, reading(disk=89)), [])
+
+    def test_below_rules_clear_upwards(self):
+        alerts = HostAlerts([Rule('mem-low', 'mem', 10, op='<', clear=20)])
+        self.assertEqual(alerts.update(0, reading(mem=5))[0]['status'], 'firing')
+        self.assertEqual(alerts.update(1, reading(mem=15)), [])
+        self.assertEqual(alerts.update(2, reading(mem=20))[0]['status'], 'resolved')
+
+    def test_rate_rule_does_not_fire_on_the_first_sample(self):
+        rule = Rule('disk-filling', 'disk', 1, kind='rate', window=60, clear=0.2)
+        alerts = HostAlerts([rule])
+        self.assertEqual(alerts.update(0, reading(disk=99)), [])
+        #a jump within the first window is not trusted either
+        self.assertEqual(alerts.update(5, reading(disk=0)), [])
+        self.assertEqual(alerts.update(10, reading(disk=99)), [])
+
+    def test_rate_rule_fires_on_a_steady_climb_and_resolves_when_it_stops(self):
+        alerts = HostAlerts([Rule('disk-filling', 'disk', 1, kind='rate', window=60, clear=0.2)])
+        events = []
+        #10 percentage points a minute, sampled every 5s
+        for i in range(30):
+            events += alerts.update(5 * i, reading(disk=10 * i / 12))
+        self.assertEqual([e['status'] for e in events], ['firing'])
+        self.assertEqual(events[0]['t'], 60)
+        self.assertGreater(events[0]['value'], 1)
+        level = 10 * 29 / 12
+        for i in range(30, 120):
+            events += alerts.update(5 * i, reading(disk=level))
+        self.assertEqual([e['status'] for e in events], ['firing', 'resolved'])
+
+    def test_gap_restarts_the_rate_window(self):
+        alerts = HostAlerts([Rule('disk-filling', 'disk', 1, kind='rate', window=60, clear=0.2)])
+        for i in range(13):
+            alerts.update(5 * i, reading(disk=i))
+        self.assertEqual(len(alerts.active()), 1)
+        #nobody watched for a while; the first sample after the gap only restarts the smoother
+        after = 60 + MAX_GAP + 1
+        self.assertEqual(alerts.update(after, reading(disk=100)), [])
+        self.assertEqual(alerts.update(after + 5, reading(disk=100)), [])
+
+
+class SlowFS:
+    #records when each operation starts and ends, and how many ran at once
+    def __init__(self):
+        self.log = []
+        self.running = 0
+        self.peak = 0
+
+    async def apply(self, path):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        self.log.append(('start', path))
+        await asyncio.sleep(0.05)
+        self.log.append(('end', path))
+        self.running -= 1
+
+    async def mkdir(self, path):
+        await self.apply(path)
+
+    async def remove(self, path):
+        await self.apply(path)
+
+
+class BatchTests(SimpleTestCase):
+    def waits(self, operations, home='/home/u'):
+        done, waits = Batch(operations, None, None, None, home=home).dependencies()
+        return [sorted(done.index(event) for event in wait) for wait in waits]
+
+    def test_parent_and_child_keep_their_order(self):
+        self.assertEqual(self.waits([{'op': 'mkdir', 'path': '/a'}, {'op': 'mkdir', 'path': '/a/b'}]), [[], [0]])
+        self.assertEqual(self.waits([{'op': 'mkdir', 'path': '/a/b'}, {'op': 'delete', 'path': '/a'}]), [[], [0]])
+
+    def test_siblings_are_independent(self):
+        self.assertEqual(self.waits([
+            {'op': 'mkdir', 'path': '/a/x'},
+            {'op': 'mkdir', 'path': '/a/y'},
+            {'op': 'copy', 'src': '/a/x', 'dst': '/b/x'},
+            {'op': 'mkdir', 'path': '/ab'},
+        ]), [[], [], [0], []])
+
+    def test_home_relative_and_absolute_paths_match(self):
+        self.assertEqual(self.waits([
+            {'op': 'mkdir', 'path': '~/a'},
+            {'op': 'move', 'src': '/home/u/a', 'dst': 'b'},
+            {'op': 'chmod', 'path': '/home/u/b/c', 'mode': '644'},
+            {'op': 'chmod', 'path': '~', 'mode': '755', 'recursive': True},
+        ]), [[], [0], [1], [0, 1, 2]])
+        #before the login directory is known, '~' still contains everything relative
+        self.assertEqual(self.waits([{'op': 'mkdir', 'path': 'a/b'}, {'op': 'delete', 'path': '~'}], home='.'),
+                         [[], [0]])
+
+    def test_an_operation_on_the_root_waits_for_everything(self):
+        self.assertEqual(self.waits([
+            {'op': 'mkdir', 'path': '/a/b'},
+            {'op': 'copy', 'src': '/x', 'dst': '/y'},
+            {'op': 'chmod', 'path': '/', 'mode': '755', 'recursive': True},
+            {'op': 'mkdir', 'path': '/z'},
+        ]), [[], [], [0, 1], [2]])
+
+    async def test_siblings_run_in_parallel_before_their_parent(self):
+        fs = SlowFS()
+        sent = []
+
+        async def send(text_data=None, **kwargs):
+            sent.append(json.loads(text_data))
+
+        operations = [{'op': 'mkdir', 'path': '/a/x'}, {'op': 'mkdir', 'path': '/a/y'}, {'op': 'delete', 'path': '/a'}]
+        await Batch(operations, fs, None, send).run()
+        self.assertEqual(fs.peak, 2)
+        self.assertEqual(fs.log[-2:], [('start', '/a'), ('end', '/a')])
+        self.assertEqual(sent[-1]['status'], 'success')
+        self.assertEqual(sent[-1]['succeeded'], 3)
+
+
+LOGIN = {'host': 'example.com', 'port': 22, 'user': 'u', 'password': 'correct horse battery staple',
+         'private_key': ''}
+
+
+class VaultTests(SimpleTestCase):
+    def setUp(self):
+        self.vault = Vault(ttl=60)
+
+    async def test_only_the_owning_session_can_load(self):
+        handle = await self.vault.store(LOGIN, 's1')
+        self.assertEqual(await self.vault.load(handle, 's1'), LOGIN)
+        self.assertEqual(await self.vault.resolve({'handle': handle}, 's1'), LOGIN)
+        with self.assertRaisesMessage(VaultError, 'another session'):
+            await self.vault.load(handle, 's2')
+        with self.assertRaisesMessage(VaultError, 'another session'):
+            await self.vault.resolve({'handle': handle}, None)
+
+    async def test_only_ciphertext_is_cached(self):
+        handle = await self.vault.store(LOGIN, 's1')
+        self.assertNotIn(LOGIN['password'].encode(), await cache.aget(PREFIX + handle))
+
+    async def test_expired_handles_are_rejected(self):
+        handle = await self.vault.store(LOGIN, 's1')
+        #the token carries its own age, so an entry the cache kept too long is still refused
+        later = time.time() + 61
+        with mock.patch('cryptography.fernet.time', SimpleNamespace(time=lambda: later)):
+            with self.assertRaisesMessage(VaultError, 'expired'):
+                await self.vault.load(handle, 's1')
+        await self.vault.discard(handle)
+        for stale in (handle, 'made-up', None):
+            with self.assertRaisesMessage(VaultError, 'expired'):
+                await self.vault.load(stale, 's1')
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+class ViewTests(SimpleTestCase):
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_needs_the_token_when_one_is_set(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_is_open_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_history_needs_a_handle_from_this_session(self):
+        session = self.client.session
+        handle = async_to_sync(vault.store)(LOGIN, session.session_key)
+        query = mock.AsyncMock(return_value={'t': [], 'series': {}})
+        with mock.patch('dashboard.views.store', SimpleNamespace(query=query)):
+            for params in ({}, {'handle': 'made-up'}):
+                self.assertEqual(self.client.get('/history/', params).status_code, 403)
+            #the same handle from another browser
+            other = Client()
+            self.assertNotEqual(other.session.session_key, session.session_key)
+            response = other.get('/history/', {'handle': handle})
+            self.assertEqual(response.status_code, 403)
+            self.assertIn('another session', response.json()['message'])
+            query.assert_not_called()
+
+            response = self.client.get('/history/', {'handle': handle, 'window': 600, 'fields': 'cpu'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'success', 't': [], 'series': {}})
+        self.assertEqual(query.call_args.args, (pool_key(LOGIN),))
+        self.assertEqual(query.call_args.kwargs['fields'], ['cpu'])
+
+
+async def idle_sampler(monitor):
+    #a sampler that never connects anywhere, but leaves the registry like the real one
+    try:
+        await asyncio.Event().wait()
+    finally:
+        monitor.registry.discard(monitor)
+
+
+class ClusterTests(SimpleTestCase):
+    #two workers on one in-memory layer; INDEX is switched to 1 while acting as the host's owner
+    def setUp(self):
+        self.cluster = Cluster()
+        for target, value in (('dashboard.cluster.WORKERS', 2), ('dashboard.cluster.HEARTBEAT', 0.05),
+                              ('dashboard.monitors.cluster', self.cluster),
+                              ('dashboard.monitors.history', SimpleNamespace(root='')),
+                              ('dashboard.monitors.HostMonitor.run', idle_sampler)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.login = next(login for login in ({**LOGIN, 'host': f'10.0.0.{i}'} for i in range(256))
+                          if owner(pool_key(login)) == 1)
+        self.key = pool_key(self.login)
+        self.inbox = CHANNEL.format(1)
+
+    def as_owner(self):
+        return mock.patch('dashboard.cluster.INDEX', 1)
+
+    async def receive(self, channel, kind=None):
+        #skips heartbeat renewals when waiting for something else
+        while True:
+            message = await asyncio.wait_for(get_channel_layer().receive(channel), 2)
+            if kind is None or message.get('kind') == kind:
+                return message
+
+    async def nothing(self, channel):
+        try:
+            await asyncio.wait_for(get_channel_layer().receive(channel), 0.1)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    async def start(self):
+        #listening as worker 0 before anything below acts as the owner
+        self.cluster.start()
+        await asyncio.sleep(0)
+
+    async def stop(self):
+        if self.cluster.task is not None:
+            self.cluster.task.cancel()
+            await asyncio.gather(self.cluster.task, return_exceptions=True)
+
+    def test_owner_is_stable_and_spreads_hosts(self):
+        keys = [(f'10.0.0.{i}', 22, 'u') for i in range(256)]
+        for workers in (2, 3, 4):
+            with mock.patch('dashboard.cluster.WORKERS', workers):
+                owners = [owner(key) for key in keys]
+                #cluster messages carry the key as a json list
+                self.assertEqual(owners, [owner(list(key)) for key in keys])
+                counts = Counter(owners)
+                self.assertEqual(set(counts), set(range(workers)))
+                self.assertGreater(min(counts.values()), len(keys) / workers / 2)
+        with mock.patch('dashboard.cluster.WORKERS', 4):
+            #pinned: every worker process must agree, so this cannot depend on hash() seeding
+            pinned = [1, 3, 0, 2, 2, 2, 0, 0]
+            self.assertEqual([owner(key) for key in keys[:8]], pinned)
+            self.assertEqual([is_local(key) for key in keys[:8]], [index == 0 for index in pinned])
+        with mock.patch('dashboard.cluster.WORKERS', 1):
+            self.assertTrue(all(is_local(key) for key in keys))
+
+    async def test_viewer_on_another_worker(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        viewers, owners = MonitorRegistry(), MonitorRegistry()
+        await self.start()
+        try:
+            monitor = await viewers.subscribe(self.login, channel, 2.0, {'points': 10, 'window': 60})
+            self.assertFalse(monitor.local)
+            self.assertEqual(viewers.monitors, {})
+            message = await self.receive(self.inbox)
+            self.assertEqual((message['kind'], message['key'], message['channel']),
+                             ('monitor.subscribe', list(self.key), channel))
+            self.assertNotIn(LOGIN['password'], message['ssh'])
+            with self.as_owner():
+                await owners.remote_subscribe(message)
+            sampler = owners.monitors[self.key]
+            self.assertEqual(sampler.subscribers, {channel: 2.0})
+            self.assertEqual((await self.receive(channel))['type'], 'monitor.joined')
+
+            #the owner's samples reach the viewer through the host's group
+            await layer.group_send(sampler.group, {'type': 'monitor.sample', 'group': sampler.group, 'sample': {'t': 1}})
+            self.assertEqual((await self.receive(channel))['sample'], {'t': 1})
+
+            #a renewal keeps the subscription without sending the backfill again
+            renewal = await self.receive(self.inbox)
+            self.assertTrue(renewal['renewal'])
+            with self.as_owner():
+                await owners.remote_subscribe(renewal)
+            self.assertTrue(await self.nothing(channel))
+            self.assertIs(owners.monitors[self.key], sampler)
+
+            await viewers.unsubscribe(self.key, channel)
+            self.assertEqual(self.cluster.renewals, {})
+            with self.as_owner():
+                await owners.remote_unsubscribe(await self.receive(self.inbox, 'monitor.unsubscribe'))
+            self.assertNotIn(self.key, owners.monitors)
+            await asyncio.gather(sampler.task, return_exceptions=True)
+            self.assertTrue(sampler.task.cancelled())
+        finally:
+            await self.stop()
+
+    async def test_restarted_owner_picks_its_viewers_back_up(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        viewers, owners = MonitorRegistry(), MonitorRegistry()
+        await self.start()
+        try:
+            await viewers.subscribe(self.login, channel, 1.0, {'points': 10, 'window': 60})
+            with self.as_owner():
+                await owners.remote_subscribe(await self.receive(self.inbox))
+            await self.receive(channel)
+            #the owning worker dies; serve starts a fresh one under the same index
+            owners.monitors[self.key].task.cancel()
+            owners = MonitorRegistry()
+            with self.as_owner():
+                await owners.remote_subscribe(await self.receive(self.inbox))
+            self.assertEqual(owners.monitors[self.key].subscribers, {channel: 1.0})
+            #and the viewer's charts catch up with the new sampler
+            self.assertEqual((await self.receive(channel))['type'], 'monitor.joined')
+            await viewers.unsubscribe(self.key, channel)
+            with self.as_owner():
+                await owners.remote_unsubscribe(await self.receive(self.inbox, 'monitor.unsubscribe'))
+        finally:
+            await self.stop()
+
+    async def test_owner_drops_viewers_that_stop_renewing(self):
+        owners = MonitorRegistry()
+        self.cluster.sweeper(owners.sweep)
+        await self.start()
+        with self.as_owner():
+            for channel in ('viewer.a', 'viewer.b'):
+                await owners.remote_subscribe({'kind': 'monitor.subscribe', 'key': list(self.key), 'channel': channel,
+                                               'ssh': seal(self.login), 'interval': 1.0})
+            sampler = owners.monitors[self.key]
+            await owners.sweep(time.monotonic() - 1)
+            self.assertEqual(set(sampler.subscribers), {'viewer.a', 'viewer.b'})
+            #viewer.a's worker went away and stopped renewing
+            owners.remote['viewer.a'] -= 2
+            await owners.sweep(time.monotonic() - 1)
+            self.assertEqual(set(sampler.subscribers), {'viewer.b'})
+            #the heartbeat sweeps the rest once it is older than EXPIRY
+            with mock.patch('dashboard.cluster.EXPIRY', 0.1):
+                try:
+                    for _ in range(100):
+                        if self.key not in owners.monitors:
+                            break
+                        await asyncio.sleep(0.02)
+                finally:
+                    await self.stop()
+        self.assertEqual(owners.remote, {})
+        self.assertNotIn(self.key, owners.monitors)
+        await asyncio.gather(sampler.task, return_exceptions=True)
+        self.assertTrue(sampler.task.cancelled())
+
+
+class FakeWorker:
+    def __init__(self):
+        self.returncode = None
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, signum):
+        self.signals.append(signum)
+        self.returncode = -signum
+
+    def wait(self):
+        return self.returncode
+
+
+class ServeTests(SimpleTestCase):
+    def test_workers_know_their_index(self):
+        with mock.patch('dashboard.management.commands.serve.subprocess.Popen') as popen:
+            serve.Command().spawn(7, 3, 2)
+        self.assertEqual(popen.call_args.kwargs['pass_fds'], (7,))
+        self.assertEqual((popen.call_args.kwargs['env']['WORKERS'], popen.call_args.kwargs['env']['WORKER_INDEX']),
+                         ('3', '2'))
+
+    def test_a_worker_that_exits_comes_back_under_its_index(self):
+        #the hosts it owned hash to the same index, so they move back to the new process
+        stderr = StringIO()
+        command = serve.Command(stdout=StringIO(), stderr=stderr)
+        spawned = []
+        handlers = {}
+        sleeps = []
+
+        def spawn(fd, workers, index):
+            spawned.append((index, FakeWorker()))
+            return spawned[-1][1]
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 1:
+                spawned[1][1].returncode = 1
+            elif len(sleeps) == 4:
+                handlers[signal.SIGTERM](signal.SIGTERM, None)
+
+        with mock.patch.object(command, 'spawn', spawn), \
+                mock.patch.object(serve, 'time', SimpleNamespace(sleep=sleep, monotonic=time.monotonic)), \
+                mock.patch.object(serve, 'signal', SimpleNamespace(signal=handlers.__setitem__, SIGTERM=signal.SIGTERM,
+                                                                   SIGINT=signal.SIGINT)):
+            command.supervise(3, 2)
+        self.assertEqual([index for index, _ in spawned], [0, 1, 1])
+        #it died within a minute of starting, so the pause before the restart doubles
+        self.assertEqual(sleeps, [1, 2, 1, 1])
+        self.assertIn('Worker 1 exited with 1, restarting in 2s', stderr.getvalue())
+        self.assertEqual([worker.signals for _, worker in spawned], [[signal.SIGTERM], [], [signal.SIGTERM]])
+
+
+class OpenServer(asyncssh.SSHServer):
+    #any user with any password; credential changes are seen by the pool, not the server
+    def begin_auth(self, username):
+        return True
+
+    def password_auth_supported(self):
+        return True
+
+    def validate_password(self, username, password):
+        return True
+
+
+@contextlib.asynccontextmanager
+async def ssh_server(root=None, process=None):
+    #a real ssh server in-process, with sftp rooted at `root` and commands run by `process` when given
+    server = await asyncssh.listen(
+        '127.0.0.1', 0, server_host_keys=[asyncssh.generate_private_key('ssh-ed25519')], server_factory=OpenServer,
+        sftp_factory=(lambda chan: asyncssh.SFTPServer(chan, chroot=root.encode())) if root else None,
+        process_factory=process, encoding=None)
+    try:
+        yield server.sockets[0].getsockname()[1]
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+class CheckHunksTests(SimpleTestCase):
+    def test_encodes_in_order(self):
+        self.assertEqual(check_hunks([[0, 1, 'é'], (1, 1, b'\r\n'), [3, 10, '']], 10),
+                         [(0, 1, 'é'.encode()), (1, 1, b'\r\n'), (3, 10, b'')])
+
+    def test_rejects_overlap_and_out_of_range(self):
+        cases = {
+            'overlap': [(0, 5, 'a'), (3, 6, 'b')],
+            'out of order': [(6, 8, 'a'), (0, 2, 'b')],
+            'reversed': [(5, 2, 'a')],
+            'negative': [(-1, 2, 'a')],
+            'past the end': [(8, 11, 'a')],
+        }
+        for name, hunks in cases.items():
+            with self.subTest(name):
+                with self.assertRaises(ValueError):
+                    check_hunks(hunks, 10)
+
+
+class SSHPoolTests(SimpleTestCase):
+    @contextlib.asynccontextmanager
+    async def pool(self, **options):
+        pool = SSHPool(**options)
+        async with ssh_server() as port:
+            self.login = lambda user='u', password='pw': {'host': '127.0.0.1', 'port': port, 'user': user,
+                                                          'password': password}
+            try:
+                yield pool
+            finally:
+                await pool.close()
+
+    async def test_reuses_one_connection_per_host_port_and_user(self):
+        async with self.pool() as pool:
+            first = await pool.acquire(self.login())
+            second = await pool.acquire(self.login())
+            other = await pool.acquire(self.login(user='v'))
+            self.assertIs(first, second)
+            self.assertIsNot(first, other)
+            self.assertEqual(len(pool), 2)
+            for conn in (first, second, other):
+                await pool.release(conn)
+            #released connections stay pooled for the next lease
+            self.assertIs(await pool.acquire(self.login()), first)
+            self.assertFalse(first.is_closed())
+
+    async def test_changed_credentials_replace_the_connection(self):
+        async with self.pool() as pool:
+            idle = await pool.acquire(self.login(password='old'))
+            await pool.release(idle)
+            fresh = await pool.acquire(self.login(password='new'))
+            self.assertIsNot(fresh, idle)
+            await idle.wait_closed()
+            self.assertEqual(len(pool), 1)
+
+            #a leased connection is detached and only closed once its holder lets go
+            replacement = await pool.acquire(self.login(password='newer'))
+            self.assertFalse(fresh.is_closed())
+            self.assertEqual(len(pool), 2)
+            await pool.release(fresh)
+            await fresh.wait_closed()
+            self.assertEqual(len(pool), 1)
+            self.assertIs(await pool.acquire(self.login(password='newer')), replacement)
+
+    async def test_cap_evicts_the_least_recently_used_idle_connection(self):
+        async with self.pool(max_connections=2, wait_timeout=0.2) as pool:
+            a = await pool.acquire(self.login(user='a'))
+            b = await pool.acquire(self.login(user='b'))
+            with self.assertRaises(PoolExhausted):
+                await pool.acquire(self.login(user='c'))
+            await pool.release(a)
+            c = await pool.acquire(self.login(user='c'))
+            await a.wait_closed()
+            self.assertEqual(len(pool), 2)
+            self.assertFalse(b.is_closed() or c.is_closed())
+
+    async def test_cap_holds_when_credentials_change_under_a_lease(self):
+        async with self.pool(max_connections=2, wait_timeout=0.2) as pool:
+            a = await pool.acquire(self.login(user='a'))
+            b = await pool.acquire(self.login(user='b'))
+            #both are leased, so a replacement for a would be a third connection
+            with self.assertRaises(PoolExhausted):
+                await pool.acquire(self.login(user='a', password='changed'))
+            await pool.release(b)
+            await pool.acquire(self.login(user='a', password='changed'))
+            await b.wait_closed()
+            self.assertEqual(len(pool), 2)
+            self.assertFalse(a.is_closed())
+
+    async def test_reaper_closes_idle_connections(self):
+        async with self.pool(idle_timeout=0.2) as pool:
+            conn = await pool.acquire(self.login())
+            held = await pool.acquire(self.login(user='v'))
+            await pool.release(conn)
+            #the reaper wakes at most once a second
+            await asyncio.wait_for(conn.wait_closed(), 3)
+            self.assertEqual(len(pool), 1)
+            self.assertFalse(held.is_closed())
+
+    async def test_dropped_connection_is_discarded(self):
+        async with self.pool() as pool:
+            conn = await pool.acquire(self.login())
+            await pool.release(conn)
+            conn.close()
+            await conn.wait_closed()
+            fresh = await pool.acquire(self.login())
+            self.assertIsNot(fresh, conn)
+            self.assertEqual(len(pool), 1)
+
+            #dropping while leased: discarded on release, not handed out again
+            fresh.close()
+            await fresh.wait_closed()
+            await pool.release(fresh)
+            self.assertEqual(len(pool), 0)
+            with self.assertRaises(asyncssh.DisconnectError):
+                await pool.sftp(fresh)
+
+
+class TailTests(SimpleTestCase):
+    async def tail(self, output, **params):
+        #the host's tail is replaced by a process that prints `output` and exits
+        def process(proc):
+            proc.stdout.write(output)
+            proc.exit(0)
+
+        sent = []
+
+        async def send(text_data=None, error=False):
+            sent.append(json.loads(text_data))
+
+        async with ssh_server(process=process) as port:
+            async with asyncssh.connect('127.0.0.1', port, username='u', password='pw', known_hosts=None,
+                                        client_keys=None, agent_path=None) as conn:
+                await Tail(1, {'filepath': 'app.log', **params}, send).run(conn)
+        lines = [line for message in sent if message['action'] == 'tail_lines' for line in message['lines']]
+        return lines, sent[-1]
+
+    async def test_include_and_exclude_filters(self):
+        output = b'GET /a\r\npost /b\nGET /health\nget /c\n'
+        lines, end = await self.tail(output, include='^get', exclude='health', ignore_case=True)
+        self.assertEqual(lines, ['GET /a', 'get /c'])
+        self.assertEqual((end['action'], end['status'], end['count'], end['dropped']), ('tail_end', 'success', 2, 0))
+        lines, _ = await self.tail(output, include='^get')
+        self.assertEqual(lines, ['get /c'])
+        with self.assertRaises(ValueError):
+            Tail(1, {'filepath': 'app.log', 'include': '('}, None)
+
+    async def test_lines_past_the_rate_limit_are_counted_not_sent(self):
+        output = b''.join(b'line %d\n' % i for i in range(25))
+        with mock.patch('dashboard.tail.BURST', 10), mock.patch('dashboard.tail.RATE_LIMIT', 0):
+            lines, end = await self.tail(output)
+        self.assertEqual(lines, [f'line {i}' for i in range(10)])
+        self.assertEqual((end['count'], end['dropped']), (10, 15))
+
+    async def test_offset_counts_whole_lines_only(self):
+        #a partial last line is left for the resumed tail to read again
+        _, end = await self.tail(b'one\r\ntwo\npartial', offset=100)
+        self.assertEqual(end['offset'], 100 + len(b'one\r\ntwo\n'))
+        _, end = await self.tail(b'one\n')
+        self.assertIsNone(end['offset'])
+
+    async def test_offset_after_a_runaway_line(self):
+        runaway = b'y' * (MAX_LINE * 4 + 1)
+        lines, end = await self.tail(b'one\n' + runaway, offset=0)
+        self.assertEqual(lines, ['one', 'y' * MAX_LINE])
+        self.assertEqual(end['offset'], 4 + len(runaway))
+
+
+def agent_record(n):
+    #the agent's nth snapshot: every counter grows by the same step, two seconds apart
+    return {
+        't': 100 + 2 * n,
+        'cpu': [[30 * n, 0, 10 * n, 60 * n, 0, 0, 0, 0], [15 * n, 0, 5 * n, 30 * n, 0, 0, 0, 0]],
+        'mem': {'MemTotal': 1000, 'MemAvailable': 250, 'MemFree': 100},
+        'fs': [['/boot', 10, 9, 1], ['/', 100, 40, 60]],
+        'load': [0.5, 0.4, 0.3],
+        'net': [1000 * n, 500 * n],
+        'io': [4096 * n, 0],
+    }
+
+
+class FleetTests(SimpleTestCase):
+    def test_parser_turns_counters_into_rates(self):
+        parser = MetricsParser()
+        line = json.dumps(agent_record(1)).encode() + b'\n'
+        #a snapshot split across reads is only parsed once whole
+        self.assertEqual(parser.feed(line[:40]), [])
+        first, = parser.feed(line[40:])
+        self.assertEqual((first['net']['rx'], first['io']['read']), (0.0, 0.0))
+
+        second, = parser.feed(json.dumps(agent_record(2)).encode() + b'\n')
+        self.assertEqual((second['net']['rx'], second['net']['tx'], second['io']['read']), (500, 250, 2048))
+        self.assertEqual((second['net']['rx_total'], second['io']['read_total']), (2000, 8192))
+        self.assertEqual(second['cpu'], {'total': 40, 'cores': [40]})
+        self.assertEqual((second['mem']['total'], second['mem']['used']), (1000 * 1024, 750 * 1024))
+
+    async def test_rounds_send_only_changed_rows(self):
+        rounds = {}
+
+        def process(proc):
+            user = proc.get_extra_info('username')
+            if user == 'broken':
+                proc.stderr.write(b'no python3\n')
+                proc.exit(1)
+                return
+            rounds[user] = rounds.get(user, 0) + 1
+            proc.stdout.write(json.dumps(agent_record(rounds[user])).encode() + b'\n')
+            proc.exit(0)
+
+        sent = []
+
+        async def send(rows):
+            sent.append(rows)
+
+        async with ssh_server(process=process) as port:
+            login = lambda user: {'host': '127.0.0.1', 'port': port, 'user': user, 'password': 'pw'}
+            with mock.patch('dashboard.fleet.pool', SSHPool()) as pool, mock.patch('dashboard.fleet.FLUSH_INTERVAL', 0.05):
+                sampler = FleetSampler([login('a'), login('broken'), login('a')], send, interval=0.1, timeout=5)
+                self.assertEqual(list(sampler.hosts), [f'a@127.0.0.1:{port}', f'broken@127.0.0.1:{port}'])
+                sampler.start()
+                for _ in range(200):
+                    if rounds.get('a', 0) >= 4:
+                        break
+                    await asyncio.sleep(0.05)
+                await sampler.stop()
+                #one warm login per host, reused every round
+                self.assertEqual(len(pool), 2)
+                await pool.close()
+
+        rows = [row for batch in sent for row in batch]
+        good = [row for row in rows if row['id'].startswith('a@')]
+        broken = [row for row in rows if row['id'].startswith('broken@')]
+        self.assertGreaterEqual(rounds['a'], 4)
+        #the same readings every round: announced once
+        self.assertEqual(len(good), 1)
+        self.assertEqual({k: good[0][k] for k in ('status', 'cpu', 'mem', 'disk', 'load', 'error')},
+                         {'status': 'ok', 'cpu': 40, 'mem': 75, 'disk': 40, 'load': 0.5, 'error': None})
+        self.assertEqual([(row['status'], row['error']) for row in broken], [('error', 'Metrics agent exited: no python3')])
+        self.assertGreaterEqual(sampler.hosts[f'broken@127.0.0.1:{port}'].failures, 1)
+
+    @override_settings(FLEET_MAX_HOSTS=1000)
+    async def test_fleet_never_outgrows_the_pool(self):
+        hosts = [{'host': f'10.0.0.{i}', 'user': 'u'} for i in range(4)]
+        communicator = WebsocketCommunicator(FleetConsumer.as_asgi(), '/ws/fleet/')
+        await communicator.connect()
+        try:
+            with mock.patch.object(shared_pool, 'max_connections', 3):
+                await communicator.send_json_to({'action': 'start', 'hosts': hosts})
+                reply = await communicator.receive_json_from()
+        finally:
+            await communicator.disconnect()
+        self.assertEqual(reply['status'], 'error')
+        self.assertIn('limit 3', reply['message'])
+
+
+#the editor's page and whole-file limits, as in filebrowser.js
+class TimeSeriesTests(SimpleTestCase):
+    def test_since_across_the_wrap(self):
+        capacity = RING_TIERS[0][1]
+        ring = Ring(capacity, 3)
+        for i in range(capacity + 100):
+            ring.append(i, (i % 1000, 0, 1))
+        self.assertEqual((len(ring), ring.start, ring.first_time()), (capacity, 100, 100))
+        #the newest rows sit at the front of the buffer again, so this reads across its end
+        rows = list(ring.since(capacity - 2))
+        self.assertEqual([t for t, _ in rows], [capacity - 2 + k for k in range(102)])
+        self.assertEqual(list(rows[2][1]), [capacity % 1000, 0, 1])
+        self.assertEqual(len(list(ring.since(0))), capacity)
+        self.assertEqual(len(list(ring.since(50.5))), capacity)
+        self.assertEqual(list(ring.since(capacity + 100)), [])
+
+    def test_backfill_over_a_wrapped_ring(self):
+        series = HostSeries()
+        #five hours a second apart, more than the raw ring holds; cpu is constant within each minute
+        for i in range(5 * 3600):
+            series.add(T0 + i, ((i // 60) % 100, i % 60, 50))
+        now = T0 + 5 * 3600
+        self.assertEqual(series.raw.first_time(), now - RING_TIERS[0][1])
+
+        #two hours is still in the raw ring, and straddles the point where it wrapped
+        recent = series.backfill(120, 7200, now)
+        self.assertEqual((recent['step'], recent['resolution']), (60, 1))
+        self.assertEqual(len(recent['t']), 120)
+        self.assertEqual(recent['t'][0], now - 7200)
+        self.assertEqual(recent['series']['cpu']['avg'], [(180 + k) % 100 for k in range(120)])
+        self.assertEqual(set(recent['series']['mem']['min']), {0})
+        self.assertEqual(set(recent['series']['mem']['avg']), {29.5})
+        self.assertEqual(set(recent['series']['mem']['max']), {59})
+
+        #the full five hours only survives as minutes; the open minute is not in the ring yet
+        whole = series.backfill(300, 5 * 3600, now)
+        self.assertEqual((whole['step'], whole['resolution']), (60, 60))
+        self.assertEqual(len(whole['t']), 299)
+        self.assertEqual(whole['t'][0], T0)
+        self.assertEqual(whole['series']['cpu']['min'], [k % 100 for k in range(299)])
+        self.assertEqual(whole['series']['cpu']['max'], whole['series']['cpu']['min'])
+        self.assertEqual(set(whole['series']['mem']['avg']), {29.5})
+        self.assertEqual(set(whole['series']['disk']['max']), {50})
+
+
+def monitor_sample(i):
+    return {
+        't': T0 + i,
+        'cpu': {'total': float(i % 7), 'user': 1.0},
+        'mem': {'used': 1000 + i // 10, 'total': 4000},
+        'load': [0.5, float(i % 3), 1.25],
+        'fs': [{'mount': '/', 'total': 100, 'used': 40 + i // 30, 'avail': 60 - i // 30}],
+    }
+
+
+class SampleEncoderTests(SimpleTestCase):
+    def decode(self, encoding, frame):
+        if encoding == 'json':
+            return json.loads(frame)
+        import cbor2
+        import msgpack
+        self.assertEqual(frame[0], KIND_MONITOR)
+        return msgpack.unpackb(frame[1:]) if encoding == 'msgpack' else cbor2.loads(frame[1:])
+
+    def test_deltas_rebuild_every_sample(self):
+        frames = 2 * FULL_EVERY + 5
+        for encoding in ('json', 'msgpack', 'cbor'):
+            encoder = SampleEncoder(encoding, delta=True)
+            state = None
+            #a client that lost one delta is stale until the next full frame
+            lossy = None
+            fulls = []
+            for i in range(frames):
+                message = self.decode(encoding, encoder.encode(monitor_sample(i)))
+                body = message['sample']
+                if message['full']:
+                    fulls.append(i)
+                    state = dict(body)
+                    lossy = dict(body)
+                else:
+                    self.assertLess(len(body), len(flatten(monitor_sample(i))))
+                    state.update(body)
+                    if i != 30:
+                        lossy.update(body)
+                self.assertEqual(state, flatten(monitor_sample(i)), (encoding, i))
+                if i == 45:
+                    #the lost frame carried the only change to the filesystem row before the next full one
+                    self.assertNotEqual(lossy['fs'], state['fs'])
+            self.assertEqual(fulls, [0, FULL_EVERY, 2 * FULL_EVERY])
+            self.assertEqual(lossy, state)
+
+    def test_without_delta_every_frame_is_full(self):
+        encoder = SampleEncoder('json')
+        for i in range(3):
+            message = json.loads(encoder.encode(monitor_sample(i)))
+            self.assertTrue(message['full'])
+            self.assertEqual(message['sample'], flatten(monitor_sample(i)))
+
+
+def listing(*names):
+    return [{'name': name} for name in names]
+
+
+class DirCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('dashboard.dircache.time', SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_expire(self):
+        cache = DirCache(ttl=30)
+        cache.put('h', '/a', listing('x'))
+        self.now += 29
+        self.assertEqual(cache.get('h', '/a'), listing('x'))
+        self.now += 2
+        self.assertIsNone(cache.get('h', '/a'))
+        self.assertEqual(cache.items, 0)
+
+    def test_put_purges_expired_entries(self):
+        cache = DirCache(ttl=30)
+        cache.put('h', '/a', listing('x', 'y'))
+        self.now += 31
+        #never read again, but the next put still drops it
+        cache.put('h', '/b', listing('z'))
+        self.assertEqual(list(cache._entries), [('h', '/b')])
+        self.assertEqual(cache.items, 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = DirCache(max_entries=2)
+        cache.put('h', '/a', listing('x'))
+        cache.put('h', '/b', listing('x'))
+        cache.get('h', '/a')
+        cache.put('h', '/c', listing('x'))
+        self.assertIsNone(cache.get('h', '/b'))
+        self.assertIsNotNone(cache.get('h', '/a'))
+        self.assertIsNotNone(cache.get('h', '/c'))
+
+    def test_bounded_by_total_items(self):
+        cache = DirCache(max_items=5)
+        cache.put('h', '/a', listing('1', '2', '3'))
+        cache.put('h', '/b', listing('1', '2'))
+        cache.put('h', '/c', listing('1'))
+        self.assertIsNone(cache.get('h', '/a'))
+        self.assertEqual(cache.items, 3)
+        #a listing bigger than the whole cache is not kept, and does not flush the rest
+        cache.put('h', '/huge', listing(*'123456'))
+        self.assertIsNone(cache.get('h', '/huge'))
+        self.assertIsNotNone(cache.get('h', '/b'))
+        #replacing an entry counts only the new listing
+        cache.put('h', '/b', listing('1'))
+        self.assertEqual(cache.items, 2)
+
+    def test_invalidation(self):
+        cache = DirCache()
+        for path in ('/a', '/a/b', '/a/b/c', '/ab'):
+            cache.put('h', path, listing('x'))
+        cache.put('other', '/a/b', listing('x'))
+        cache.invalidate('h', '/a/b/')
+        self.assertIsNone(cache.get('h', '/a/b'))
+        self.assertIsNotNone(cache.get('h', '/a/b/c'))
+        cache.invalidate('h', '/a', recursive=True)
+        self.assertIsNone(cache.get('h', '/a/b/c'))
+        #a sibling sharing the prefix and another host's entry are left alone
+        self.assertIsNotNone(cache.get('h', '/ab'))
+        self.assertIsNotNone(cache.get('other', '/a/b'))
+        cache.invalidate_parent('h', '/ab/new.txt')
+        self.assertIsNone(cache.get('h', '/ab'))
+
+    def test_relative_and_absolute_paths_share_an_entry(self):
+        cache = DirCache()
+        cache.set_home('h', '/home/u')
+        cache.put('h', 'a', listing('x'))
+        for path in ('/home/u/a', '~/a', './a/', '/home/u/b/../a'):
+            self.assertEqual(cache.get('h', path), listing('x'))
+        cache.put('h', '/home/u', listing('a'))
+        self.assertEqual(cache.get('h', '~'), listing('a'))
+        cache.invalidate_parent('h', 'a/new.txt')
+        self.assertIsNone(cache.get('h', '/home/u/a'))
+        cache.invalidate('h', '/home/u', recursive=True)
+        self.assertIsNone(cache.get('h', '.'))
+
+    async def test_watcher_keeps_the_listing_current(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        os.mkdir(os.path.join(root, 'd'))
+        open(os.path.join(root, 'd', 'a'), 'w').close()
+        consumer = Consumer()
+        consumer.dir_cache = DirCache()
+        consumer.watchers = {}
+        sent = []
+
+        async def send(text_data=None, **kwargs):
+            sent.append(json.loads(text_data))
+
+        consumer.send = send
+
+        async def until(condition):
+            for _ in range(200):
+                if condition():
+                    return
+                await asyncio.sleep(0.025)
+            self.fail('the watcher never caught up')
+
+        #the test server runs no commands, so the watcher falls back to polling the directory
+        with mock.patch('dashboard.dircache.time', SimpleNamespace(monotonic=asyncio.get_running_loop().time)), \
+                mock.patch('dashboard.watcher.POLL_INTERVAL', 0.02):
+            async with ssh_server(root) as port:
+                async with asyncssh.connect('127.0.0.1', port, username='u', password='pw', known_hosts=None,
+                                            client_keys=None, agent_path=None) as conn:
+                    fs = RemoteFS(await conn.start_sftp_client())
+                    consumer.dir_cache.set_home('h', await fs.home())
+                    items = await fs.listdir('d')
+                    consumer.dir_cache.put('h', 'd', items)
+                    watcher = DirWatcher(conn, fs, 'h', 'd', consumer.directory_changed)
+                    consumer.watchers[consumer.dir_cache.key('h', 'd')] = watcher
+                    watcher.start(items)
+                    try:
+                        open(os.path.join(root, 'd', 'b'), 'w').close()
+                        #the chroot is the login directory, so the absolute form finds the refreshed entry
+                        await until(lambda: [item['name'] for item in consumer.dir_cache.get('h', '/d') or []]
+                                    == ['a', 'b'])
+                        self.assertEqual(watcher.mode, 'poll')
+                        self.assertIn({'event': 'add', 'name': 'b'},
+                                      [{k: e[k] for k in ('event', 'name')} for m in sent for e in m['events']])
+                        shutil.rmtree(os.path.join(root, 'd'))
+                        await until(lambda: not consumer.watchers)
+                        self.assertIsNone(consumer.dir_cache.get('h', 'd'))
+                        self.assertTrue(sent[-1]['gone'])
+                    finally:
+                        await watcher.stop()
+
+
+PAGE_SIZE = 1024 * 1024
+MAX_EDIT_SIZE = 32 * 1024 * 1024
+
+
+class RemoteFSTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        async with ssh_server(self.root) as port:
+            async with asyncssh.connect('127.0.0.1', port, username='u', password='pw',
+                                        known_hosts=None, client_keys=None, agent_path=None) as conn:
+                async with conn.start_sftp_client() as sftp:
+                    yield RemoteFS(sftp)
+
+    def put(self, name, data, mode=0o640):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.chmod(path, mode)
+        os.utime(path, (1000, 1000))
+        return self.version_of(data)
+
+    def version_of(self, data, mtime=1000):
+        return version(SimpleNamespace(size=len(data), mtime=mtime), sample(data, len(data)))
+
+    def get(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+    def leftovers(self):
+        return [name for name in os.listdir(self.root) if name.endswith('.tmp')]
+
+    async def test_patch_builds_a_temp_file_and_renames_it(self):
+        base = self.put('notes.txt', b'one\ntwo\nthree\n')
+        inode = os.stat(os.path.join(self.root, 'notes.txt')).st_ino
+        async with self.connect() as fs:
+            version = await fs.patch('notes.txt', base, [(4, 7, 'TWO'), (14, 14, 'four\n')])
+        self.assertEqual(self.get('notes.txt'), b'one\nTWO\nthree\nfour\n')
+        info = os.stat(os.path.join(self.root, 'notes.txt'))
+        #a new file took the old one's name, with its permissions
+        self.assertNotEqual(info.st_ino, inode)
+        self.assertEqual(info.st_mode & 0o777, 0o640)
+        self.assertEqual(version, self.version_of(self.get('notes.txt'), int(info.st_mtime)))
+        self.assertEqual(self.leftovers(), [])
+
+    async def test_patch_copies_without_copy_data(self):
+        body = bytes(range(256)) * 4096
+        base = self.put('blob', body)
+        async with self.connect() as fs:
+            fs.copy_data = False
+            await fs.patch('blob', base, [(10, 20, b'x'), (len(body) - 1, len(body), b'')])
+        self.assertEqual(self.get('blob'), body[:10] + b'x' + body[20:-1])
+
+    async def test_patch_rejects_a_stale_version(self):
+        base = self.put('notes.txt', b'one\n')
+        async with self.connect() as fs:
+            with self.assertRaises(VersionConflict) as caught:
+                await fs.patch('notes.txt', dict(base, mtime=999), [(0, 3, 'ONE')])
+            with self.assertRaises(ValueError):
+                await fs.patch('notes.txt', {'size': 4, 'mtime': 1000}, [(0, 3, 'ONE')])
+        self.assertEqual(caught.exception.current, base)
+        self.assertEqual(self.get('notes.txt'), b'one\n')
+        self.assertEqual(self.leftovers(), [])
+
+    async def test_patch_rejects_a_same_size_rewrite_in_the_same_second(self):
+        base = self.put('notes.txt', b'one\ntwo\n')
+        #size and mtime match; only the content hash tells the versions apart
+        self.put('notes.txt', b'ONE\ntwo\n')
+        async with self.connect() as fs:
+            with self.assertRaises(VersionConflict):
+                await fs.patch('notes.txt', base, [(4, 7, 'TWO')])
+        self.assertEqual(self.get('notes.txt'), b'ONE\ntwo\n')
+
+    async def test_patch_rejects_a_write_made_while_saving(self):
+        base = self.put('notes.txt', b'one\ntwo\n')
+        copy_range = RemoteFS.copy_range
+        raced = []
+
+        async def racing(fs, *args):
+            await copy_range(fs, *args)
+            if not raced:
+                raced.append(True)
+                with open(os.path.join(self.root, 'notes.txt'), 'ab') as f:
+                    f.write(b'three\n')
+
+        async with self.connect() as fs:
+            with mock.patch.object(RemoteFS, 'copy_range', racing):
+                with self.assertRaises(VersionConflict) as caught:
+                    await fs.patch('notes.txt', base, [(0, 3, 'ONE')])
+        self.assertEqual(caught.exception.current['size'], 14)
+        self.assertEqual(self.get('notes.txt'), b'one\ntwo\nthree\n')
+        self.assertEqual(self.leftovers(), [])
+
+    async def test_patch_saves_through_a_symlink(self):
+        base = self.put('real.txt', b'one\n')
+        os.symlink('real.txt', os.path.join(self.root, 'link.txt'))
+        async with self.connect() as fs:
+            await fs.patch('link.txt', base, [(0, 3, 'ONE')])
+        self.assertTrue(os.path.islink(os.path.join(self.root, 'link.txt')))
+        self.assertEqual(self.get('real.txt'), b'ONE\n')
+
+    async def test_crlf_round_trip(self):
+        self.put('dos.txt', b'line1\r\nline2\r\nline3\r\n')
+        async with self.connect() as fs:
+            data, version = await fs.read_versioned('dos.txt')
+            self.assertEqual(data, b'line1\r\nline2\r\nline3\r\n')
+            #the hunk the editor sends for retyping line 2: raw offsets, the file's own line break
+            start = data.index(b'line2')
+            version = await fs.patch('dos.txt', version, [(start, start + 7, 'LINE2\r\n')])
+            self.assertEqual(self.get('dos.txt'), b'line1\r\nLINE2\r\nline3\r\n')
+            await fs.replace('dos.txt', version, b'line1\r\n')
+        self.assertEqual(self.get('dos.txt'), b'line1\r\n')
+
+    async def test_replace_checks_the_version(self):
+        base = self.put('notes.txt', b'one\n')
+        async with self.connect() as fs:
+            with self.assertRaises(VersionConflict):
+                await fs.replace('notes.txt', dict(base, size=5), b'new\n')
+            await fs.replace('notes.txt', base, b'new contents\n')
+        self.assertEqual(self.get('notes.txt'), b'new contents\n')
+        self.assertEqual(self.leftovers(), [])
+
+    async def test_upload_over_a_version_replaces_the_file_at_the_end(self):
+        base = self.put('big.txt', b'old\n')
+        sent = []
+
+        async def send(text_data=None, error=False):
+            sent.append(json.loads(text_data))
+
+        async with self.connect() as fs:
+            upload = Upload(1, 'big.txt', send)
+            await upload.open(fs, size=7, base=base)
+            await upload.write(0, b'new\r\n')
+            #nothing touches the original before the upload finishes
+            self.assertEqual(self.get('big.txt'), b'old\n')
+            await upload.write(5, b'!\n')
+            await upload.finish()
+            finished = sent[-1]
+
+            stale = Upload(2, 'big.txt', send)
+            with self.assertRaises(VersionConflict):
+                await stale.open(fs, size=1, base=base)
+
+            cancelled = Upload(3, 'big.txt', send)
+            await cancelled.open(fs, size=4, base={key: finished[key] for key in ('size', 'mtime', 'hash')})
+            await cancelled.write(0, b'gone')
+            await cancelled.close()
+        self.assertEqual(self.get('big.txt'), b'new\r\n!\n')
+        self.assertEqual((finished['action'], finished['status'], finished['size']), ('transfer_end', 'success', 7))
+        self.assertEqual(self.leftovers(), [])
+
+    async def download(self, fs, name, **options):
+        #what the editor receives: the start event with the version, then the bytes
+        events, chunks = [], []
+
+        async def send(text_data=None, bytes_data=None, error=False):
+            if bytes_data is not None:
+                _, _, offset, payload = unpack_frame(bytes_data)
+                chunks.append(bytes(payload))
+                download.ack(offset + len(payload))
+            else:
+                events.append(json.loads(text_data))
+
+        download = Download(1, name, send)
+        await download.open(fs, **options)
+        await download.run()
+        return events[0], b''.join(chunks)
+
+    async def test_editing_a_file_larger_than_a_page(self):
+        body = b''.join(b'setting_%d = %d\n' % (i, i) for i in range(200000))
+        self.assertGreater(len(body), PAGE_SIZE)
+        self.put('big.conf', body)
+        async with self.connect() as fs:
+            #opened for editing it comes whole, with the version of exactly those bytes
+            start, data = await self.download(fs, 'big.conf', length=PAGE_SIZE, whole=MAX_EDIT_SIZE)
+            self.assertEqual((start['offset'], start['end']), (0, len(body)))
+            self.assertEqual(data, body)
+            base = {key: start[key] for key in ('size', 'mtime', 'hash')}
+            self.assertEqual(base, self.version_of(body))
+
+            line = b'setting_150000 = 150000\n'
+            at = data.index(line)
+            await fs.patch('big.conf', base, [(at, at + len(line), 'setting_150000 = 0\n')])
+
+            #past the cap it is only a page
+            start, data = await self.download(fs, 'big.conf', length=PAGE_SIZE, whole=PAGE_SIZE)
+            self.assertEqual((start['offset'], start['end']), (0, PAGE_SIZE))
+        self.assertEqual(self.get('big.conf'), body.replace(line, b'setting_150000 = 0\n'))
+
+
+class DispatchTests(SimpleTestCase):
+    #the consumer's own receive, dispatcher and cancel, with actions that only record what ran when
+    def setUp(self):
+        self.events = []
+        events = self.events
+        original = Consumer.handle
+
+        async def handle(consumer, action, data):
+            if action == 'cancel':
+                return await original(consumer, action, data)
+            events.append(('start', data['request_id']))
+            try:
+                await asyncio.sleep(data.get('delay', 0))
+            except asyncio.CancelledError:
+                events.append(('cancelled', data['request_id']))
+                raise
+            events.append(('end', data['request_id']))
+            await consumer.send(text_data=json.dumps({'action': action, 'status': 'success'}))
+
+        patcher = mock.patch.object(Consumer, 'handle', handle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        communicator = WebsocketCommunicator(Consumer.as_asgi(), '/ws/cpu/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        try:
+            yield communicator
+        finally:
+            await communicator.disconnect()
+
+    async def test_newer_listing_supersedes_the_older(self):
+        self.assertIn('list_directory', SUPERSEDES)
+        async with self.connect() as communicator:
+            await communicator.send_json_to({'action': 'list_directory', 'request_id': 1, 'path': '/a', 'delay': 5})
+            await communicator.send_json_to({'action': 'list_directory', 'request_id': 2, 'path': '/b'})
+            reply = await communicator.receive_json_from()
+            #the stale request is cancelled quietly; no 'cancelled' reply for it
+            self.assertTrue(await communicator.receive_nothing(0.2))
+        self.assertEqual(reply, {'request_id': 2, 'action': 'list_directory', 'status': 'success'})
+        self.assertIn(('cancelled', 1), self.events)
+        self.assertNotIn(('end', 1), self.events)
+
+    async def test_explicit_cancel_is_answered(self):
+        async with self.connect() as communicator:
+            await communicator.send_json_to({'action': 'read_file', 'request_id': 1, 'delay': 5})
+            await asyncio.sleep(0.05)
+            await communicator.send_json_to({'action': 'cancel', 'request_id': 1})
+            reply = await communicator.receive_json_from()
+        self.assertEqual(reply, {'request_id': 1, 'action': 'cancelled', 'status': 'cancelled',
+                                 'cancelled_action': 'read_file'})
+
+    async def test_serial_actions_run_one_at_a_time_in_order(self):
+        serial = ['write_file', 'delete_file', 'rename']
+        self.assertTrue(set(serial) <= SERIAL_ACTIONS)
+        self.assertNotIn('read_file', SERIAL_ACTIONS)
+        async with self.connect() as communicator:
+            #the first mutation is the slowest, so anything running alongside it would overtake it
+            for request_id, (action, delay) in enumerate(zip(serial, (0.2, 0.1, 0)), 1):
+                await communicator.send_json_to({'action': action, 'request_id': request_id, 'delay': delay})
+            await communicator.send_json_to({'action': 'read_file', 'request_id': 4})
+            replies = [await communicator.receive_json_from() for _ in range(4)]
+        self.assertEqual([reply['request_id'] for reply in replies], [4, 1, 2, 3])
+        mutations = [event for event in self.events if event[1] != 4]
+        self.assertEqual(mutations, [('start', 1), ('end', 1), ('start', 2), ('end', 2), ('start', 3), ('end', 3)])
+        #reads are not held behind the queue
+        self.assertLess(self.events.index(('end', 4)), self.events.index(('end', 1)))
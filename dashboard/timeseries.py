@@ -0,0 +1,154 @@
+from array import array
+from bisect import bisect_left
+
+FIELDS = ('cpu', 'mem', 'disk')
+
+#the fastest sample interval a monitor accepts; the raw ring is sized so it still holds an hour at
+#that rate (about 280KB per host), rather than an hour only at the default one second
+MIN_INTERVAL = 0.25
+RAW_WINDOW = 3600
+#(resolution seconds, capacity): 1h of raw samples, 24h of minutes, 7d of 10 minutes
+TIERS = ((1, int(RAW_WINDOW / MIN_INTERVAL)), (60, 1440), (600, 1008))
+
+
+class Ring:
+    #fixed-size columnar ring: one float64 timestamp column plus `width` float32 values per row
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('f', [0.0]) * (capacity * width)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, row):
+        if self.count < self.capacity:
+            slot = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            slot = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[slot] = t
+        base = slot * self.width
+        self.values[base:base + self.width] = array('f', row)
+
+    def time_at(self, i):
+        return self.times[(self.start + i) % self.capacity]
+
+    def row_at(self, i):
+        base = ((self.start + i) % self.capacity) * self.width
+        return self.values[base:base + self.width]
+
+    def first_time(self):
+        return self.time_at(0) if self.count else None
+
+    def since(self, t0):
+        lo = bisect_left(range(self.count), t0, key=self.time_at)
+        for i in range(lo, self.count):
+            yield self.time_at(i), self.row_at(i)
+
+
+class Bucket:
+    def __init__(self, width):
+        self.start = None
+        self.count = 0
+        self.low = [0.0] * width
+        self.high = [0.0] * width
+        self.total = [0.0] * width
+
+    def add(self, values):
+        if self.count == 0:
+            self.low = list(values)
+            self.high = list(values)
+            self.total = list(values)
+        else:
+            for i, v in enumerate(values):
+                if v < self.low[i]:
+                    self.low[i] = v
+                if v > self.high[i]:
+                    self.high[i] = v
+                self.total[i] += v
+        self.count += 1
+
+    def row(self):
+        #stored per field as min, avg, max
+        row = []
+        for low, total, high in zip(self.low, self.total, self.high):
+            row += (low, total / self.count, high)
+        return row
+
+
+class HostSeries:
+    def __init__(self):
+        width = len(FIELDS)
+        self.raw = Ring(TIERS[0][1], width)
+        self.tiers = [(resolution, Ring(capacity, width * 3), Bucket(width)) for resolution, capacity in TIERS[1:]]
+
+    def add(self, t, values):
+        self.raw.append(t, values)
+        for resolution, ring, bucket in self.tiers:
+            start = t - t % resolution
+            if bucket.start is not None and start != bucket.start and bucket.count:
+                ring.append(bucket.start, bucket.row())
+                bucket.count = 0
+            bucket.start = start
+            bucket.add(values)
+
+    def covers(self, since):
+        #whether any tier reaches back to `since`; a fresh process has only minutes of samples
+        return any(len(ring) and ring.first_time() <= since for ring in [self.raw] + [r for _, r, _ in self.tiers])
+
+    def backfill(self, points, window, now):
+        points = max(1, int(points))
+        since = now - window
+        step = max(1.0, window / points)
+        #finest tier that covers the window without being finer than one chart point needs
+        candidates = [(1, self.raw, False)] + [(r, ring, True) for r, ring, _ in self.tiers]
+        eligible = [c for c in candidates if c[0] <= step and len(c[1])] or [candidates[0]]
+        covering = [c for c in eligible if len(c[1]) and c[1].first_time() <= since]
+        if covering:
+            resolution, ring, aggregated = covering[0]
+        else:
+            resolution, ring, aggregated = min(eligible, key=lambda c: c[1].first_time() or now)
+
+        width = len(FIELDS)
+        stride = 3 if aggregated else 1
+        times = []
+        series = {name: {'min': [], 'avg': [], 'max': []} for name in FIELDS}
+        current = None
+        low = avg = high = None
+        count = 0
+        for t, row in ring.since(since):
+            slot = int((t - since) // step)
+            if slot != current:
+                if current is not None:
+                    self._emit(times, series, since + current * step, low, avg, high, count)
+                current = slot
+                low = list(row[0::stride])
+                avg = list(row[1::stride] if aggregated else low)
+                high = list(row[2::stride] if aggregated else low)
+                count = 1
+                continue
+            row_low = row[0::stride]
+            row_avg = row[1::stride] if aggregated else row_low
+            row_high = row[2::stride] if aggregated else row_low
+            for i in range(width):
+                if row_low[i] < low[i]:
+                    low[i] = row_low[i]
+                if row_high[i] > high[i]:
+                    high[i] = row_high[i]
+                avg[i] += row_avg[i]
+            count += 1
+        if current is not None:
+            self._emit(times, series, since + current * step, low, avg, high, count)
+        return {'step': step, 'resolution': resolution, 't': times, 'series': series}
+
+    def _emit(self, times, series, t, low, total, high, count):
+        times.append(round(t, 3))
+        for i, name in enumerate(FIELDS):
+            series[name]['min'].append(round(low[i], 2))
+            series[name]['avg'].append(round(total[i] / count, 2))
+            series[name]['max'].append(round(high[i], 2))
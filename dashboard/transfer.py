@@ -0,0 +1,199 @@
+import asyncio
+import json
+import stat
+import struct
+import time
+
+from .remotefs import VersionConflict, expected
+
+#binary websocket frames: kind, transfer id, byte offset, payload
+FRAME = struct.Struct('!BIQ')
+KIND_CHUNK = 1
+#encoded monitor samples are sent as a single kind byte followed by the payload
+KIND_MONITOR = 2
+#text frames above the negotiated threshold are sent compressed: kind byte, then the compressed utf-8
+KIND_DEFLATE = 3
+KIND_ZSTD = 4
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+DEFAULT_WINDOW = 8
+MAX_WINDOW = 64
+PROGRESS_INTERVAL = 0.25
+
+
+def pack_frame(kind, transfer_id, offset, payload):
+    return FRAME.pack(kind, transfer_id, offset) + payload
+
+
+def unpack_frame(frame):
+    kind, transfer_id, offset = FRAME.unpack_from(frame)
+    return kind, transfer_id, offset, memoryview(frame)[FRAME.size:]
+
+
+def clamp(value, default, upper):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(value, upper))
+
+
+class Transfer:
+    direction = None
+
+    def __init__(self, transfer_id, filepath, send, chunk_size=None, window=None):
+        self.transfer_id = transfer_id
+        self.filepath = filepath
+        self.send = send
+        self.chunk_size = clamp(chunk_size, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE)
+        self.window = clamp(window, DEFAULT_WINDOW, MAX_WINDOW)
+        self.file = None
+        self.task = None
+        #pool key of the host, set by the consumer
+        self.host = None
+        self.start = 0
+        self.end = None
+        self.offset = 0
+        self._last_progress = 0
+
+    async def send_event(self, action, **fields):
+        await self.send(text_data=json.dumps({
+            'action': action,
+            'transfer_id': self.transfer_id,
+            'direction': self.direction,
+            'filepath': self.filepath,
+            **fields,
+        }), error=fields.get('status') == 'error')
+
+    async def progress(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        await self.send_event('transfer_progress', offset=self.offset, start=self.start, end=self.end)
+
+    async def close(self):
+        if self.file is not None:
+            file, self.file = self.file, None
+            await file.close()
+
+
+class Download(Transfer):
+    direction = 'download'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acked = 0
+        self._acked = asyncio.Event()
+
+    async def open(self, fs, offset=0, length=None, tail=None, whole=None):
+        #the version comes from the open handle, so it belongs to the bytes that are sent
+        self.file = await fs.open(self.filepath, 'rb')
+        current = await fs.handle_version(self.file)
+        size = current['size'] or 0
+        if tail is not None:
+            offset = max(0, size - int(tail))
+        offset = min(max(0, int(offset or 0)), size)
+        end = size if length is None else min(size, offset + int(length))
+        if whole is not None and size <= int(whole):
+            #small enough to edit: the whole file instead of the requested page
+            offset, end = 0, size
+        self.start = self.offset = self.acked = offset
+        self.end = end
+        await self.send_event('transfer_start', status='success', **current,
+                              offset=offset, end=end, chunk_size=self.chunk_size, window=self.window)
+
+    def ack(self, offset):
+        if offset > self.acked:
+            self.acked = offset
+            self._acked.set()
+
+    async def run(self):
+        try:
+            while self.offset < self.end:
+                #backpressure: never more than `window` chunks ahead of the client
+                while self.offset - self.acked >= self.window * self.chunk_size:
+                    self._acked.clear()
+                    await self._acked.wait()
+                data = await self.file.read(min(self.chunk_size, self.end - self.offset), self.offset)
+                if not data:
+                    self.end = self.offset  # file shrank underneath us
+                    break
+                await self.send(bytes_data=pack_frame(KIND_CHUNK, self.transfer_id, self.offset, data))
+                self.offset += len(data)
+                await self.progress()
+            await self.send_event('transfer_end', status='success', offset=self.offset, end=self.end)
+        finally:
+            await self.close()
+
+
+class Upload(Transfer):
+    direction = 'upload'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        #set when saving over a known version: chunks go to a temp file that replaces the original at the end
+        self.fs = None
+        self.base = None
+        self.temp = None
+        self.target = None
+        self.mode = None
+
+    async def open(self, fs, offset=0, size=None, resume=False, base=None):
+        if base is not None:
+            await self.open_replacement(fs, expected(base), size)
+            return
+        if resume:
+            try:
+                offset = (await fs.stat(self.filepath))['size'] or 0
+            except Exception:
+                offset = 0
+        offset = max(0, int(offset or 0))
+        self.file = await fs.open(self.filepath, 'r+b' if offset else 'wb')
+        self.start = self.offset = offset
+        self.end = None if size is None else int(size)
+        await self.send_event('transfer_start', status='success', offset=offset, end=self.end,
+                              chunk_size=self.chunk_size, window=self.window)
+
+    async def open_replacement(self, fs, base, size):
+        self.target = await fs.target(self.filepath)
+        async with fs.sftp.open(self.target, 'rb') as f:
+            info = await f.stat()
+            current = await fs.handle_version(f, info)
+        if current != base:
+            raise VersionConflict(current)
+        self.fs, self.base, self.mode = fs, base, stat.S_IMODE(info.permissions or 0o644)
+        self.temp = fs.temp_path(self.target)
+        self.file = await fs.sftp.open(self.temp, 'wb')
+        self.start = self.offset = 0
+        self.end = None if size is None else int(size)
+        await self.send_event('transfer_start', status='success', offset=0, end=self.end,
+                              chunk_size=self.chunk_size, window=self.window)
+
+    async def write(self, offset, data):
+        if offset != self.offset:
+            raise ValueError(f'Expected chunk at offset {self.offset}, got {offset}')
+        await self.file.write(bytes(data), offset)
+        self.offset += len(data)
+        await self.send_event('transfer_ack', offset=self.offset)
+        await self.progress()
+
+    async def finish(self):
+        if self.end is not None and self.offset < self.end:
+            #leave the partial file in place so the client can resume
+            raise ValueError(f'Upload incomplete: {self.offset} of {self.end} bytes')
+        await self.file.truncate(self.offset)
+        temp, self.temp = self.temp, None
+        await self.close()
+        current = {}
+        if temp is not None:
+            current = await self.fs.install(temp, self.target, self.base, self.mode)
+        await self.send_event('transfer_end', status='success', offset=self.offset, end=self.offset, **current)
+
+    async def close(self):
+        await super().close()
+        #an unfinished replacement never touches the original
+        if self.temp is not None:
+            temp, self.temp = self.temp, None
+            await self.fs.discard(temp)
@@ -5,4 +5,7 @@ from . import views
 urlpatterns = [
     path('', views.ssh, name='ssh'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('fleet/', views.fleet, name='fleet'),
+    path('metrics', views.metrics, name='metrics'),
+    path('history/', views.history, name='history'),
 ]
@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import json
+import secrets
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.core.cache import cache
+
+PREFIX = 'ssh-vault:'
+
+
+class VaultError(Exception):
+    pass
+
+
+def _key():
+    #a dedicated VAULT_KEY can be rotated on its own; otherwise one is derived from SECRET_KEY
+    key = getattr(settings, 'VAULT_KEY', '')
+    if key:
+        return key
+    digest = hashlib.sha256(b'ssh-vault:' + settings.SECRET_KEY.encode()).digest()
+    return base64.urlsafe_b64encode(digest)
+
+
+class Vault:
+    #credentials live only encrypted in the cache; browsers hold an opaque handle bound to their session
+    def __init__(self, ttl=8 * 3600):
+        self.ttl = ttl
+        self._fernet = None
+
+    @property
+    def fernet(self):
+        if self._fernet is None:
+            self._fernet = Fernet(_key())
+        return self._fernet
+
+    async def store(self, credentials, owner):
+        handle = secrets.token_urlsafe(32)
+        record = {**credentials, 'owner': owner}
+        token = self.fernet.encrypt(json.dumps(record).encode())
+        await cache.aset(PREFIX + handle, token, self.ttl)
+        return handle
+
+    async def load(self, handle, owner):
+        token = await cache.aget(PREFIX + str(handle))
+        if token is None:
+            raise VaultError('Login expired, connect again')
+        try:
+            record = json.loads(self.fernet.decrypt(token, ttl=self.ttl))
+        except InvalidToken:
+            raise VaultError('Login expired, connect again')
+        #a handle copied out of one browser session is useless in another
+        if record.pop('owner') != owner:
+            raise VaultError('Login belongs to another session')
+        return record
+
+    async def discard(self, handle):
+        await cache.adelete(PREFIX + str(handle))
+
+    async def resolve(self, ssh_data, owner):
+        #fleet and scripted clients may still send full credentials; the dashboard sends a handle
+        if not ssh_data or 'handle' not in ssh_data:
+            return ssh_data or {}
+        return await self.load(ssh_data['handle'], owner)
+
+
+vault = Vault(ttl=getattr(settings, 'VAULT_TTL', 8 * 3600))
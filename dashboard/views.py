@@ -1,10 +1,18 @@
+import asyncio
+import secrets
+import time
+
+import asyncssh
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
+from . import metrics as prometheus
 from .forms import SSHForm
-import paramiko
-from paramiko.ssh_exception import SSHException, AuthenticationException
-import socket
+from .history import history as store, parse_range
+from .pool import pool, pool_key, PoolExhausted
+from .vault import vault, VaultError
 
-def ssh(request):
+async def ssh(request):
     ssh_info = None
     if request.method == 'POST':
         form = SSHForm(request.POST)
@@ -13,28 +21,36 @@ def ssh(request):
             username = form.cleaned_data['username']
             password = form.cleaned_data['password']
             port = form.cleaned_data.get('port') or 22
+            credentials = {
+                'host': hostname,
+                'port': port,
+                'user': username,
+                'password': password,
+                'private_key': form.cleaned_data['private_key'],
+            }
 
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             try:
-                client.connect(hostname, port=port, username=username, password=password, timeout=5)
+                #the verified login stays warm in the pool, so the dashboard socket reuses it
+                #instead of authenticating a second time
+                conn = await pool.acquire(credentials)
+                await pool.release(conn)
+            except asyncssh.PermissionDenied:
+                form.add_error(None, 'Authentication failed. Check username/password or key.')
+            except (asyncssh.Error, OSError, asyncio.TimeoutError, PoolExhausted) as e:
+                form.add_error(None, f'SSH connection failed: {e}')
+            else:
+                if not request.session.session_key:
+                    await request.session.acreate()
+                #only an opaque handle reaches the session and the page; the secrets stay in the vault
+                handle = await vault.store(credentials, request.session.session_key)
                 ssh_info = {
                     'hostname': hostname,
                     'username': username,
-                    'password': password,
                     'port': port,
+                    'handle': handle,
                 }
-                request.session['ssh_info'] = ssh_info #stores the ssh info for the dashboard 
+                await request.session.aset('ssh_info', ssh_info) #stores the ssh info for the dashboard
                 return redirect('dashboard')
-            except AuthenticationException:
-                form.add_error(None, 'Authentication failed. Check username/password.')
-            except (SSHException, socket.timeout, socket.error) as e:
-                form.add_error(None, f'SSH connection failed: {e}')
-            finally:
-                try:
-                    client.close()
-                except Exception:
-                    pass
     else:
         form = SSHForm()
 
@@ -47,3 +63,28 @@ def dashboard(request):
     }
     return render(request, 'dashboard.html', context)
 
+
+def fleet(request):
+    return render(request, 'fleet.html')
+
+
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    sent = request.headers.get('Authorization', '').encode()
+    if token and not secrets.compare_digest(sent, f'Bearer {token}'.encode()):
+        return HttpResponse(status=403)
+    return HttpResponse(prometheus.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def history(request):
+    #?handle=<vault handle>&start=&end=|window=&step=&fields=cpu,mem; times are unix seconds
+    try:
+        credentials = await vault.load(request.GET.get('handle'), request.session.session_key)
+    except VaultError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=403)
+    try:
+        query = parse_range(request.GET, time.time())
+        result = await store.query(pool_key(credentials), **query)
+    except (ValueError, RuntimeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'status': 'success', **result})
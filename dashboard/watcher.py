@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import shlex
+
+import asyncssh
+
+from .remotefs import remote_path
+
+logger = logging.getLogger(__name__)
+
+#inotifywait reports '<EVENTS>/<name>'; '/' cannot appear in a file name
+INOTIFY_COMMAND = (
+    'command -v inotifywait >/dev/null 2>&1 || exit 127; '
+    "exec inotifywait -m -q --format '%e/%f' "
+    '-e create,delete,moved_from,moved_to,close_write,attrib,delete_self,move_self {path}'
+)
+COALESCE_DELAY = 0.1
+POLL_INTERVAL = 2
+#the poller only relists when the directory mtime moves, which misses in-place edits of
+#existing files, so it also does a full relist every FULL_RESCAN_EVERY polls
+FULL_RESCAN_EVERY = 15
+COMPARED = ('type', 'size', 'mtime', 'mode', 'target')
+
+
+def changed(old, new):
+    return any(old[k] != new[k] for k in COMPARED)
+
+
+class DirWatcher:
+    def __init__(self, conn, fs, host, path, on_events):
+        self.conn = conn
+        self.fs = fs
+        self.host = host
+        self.path = path
+        self.on_events = on_events
+        self.items = {}
+        self.mode = None
+        self.task = None
+        self._pending = set()
+        self._changed = asyncio.Event()
+
+    def start(self, items):
+        self.items = {item['name']: item for item in items}
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        try:
+            await self.inotify()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info('inotify watch failed for %s: %s', self.path, e)
+        #no inotifywait on the host, watch limit reached or the directory went away
+        await self.poll()
+
+    async def inotify(self):
+        command = INOTIFY_COMMAND.format(path=shlex.quote(remote_path(self.path)))
+        process = await self.conn.create_process(command, encoding='utf-8', errors='replace')
+        self.mode = 'inotify'
+        flusher = asyncio.create_task(self.flush())
+        #anything that changed before the watch was in place is caught by one rescan
+        self.notify(None)
+        try:
+            async for line in process.stdout:
+                events, _, name = line.rstrip('\n').partition('/')
+                if 'DELETE_SELF' in events or 'MOVE_SELF' in events:
+                    return
+                self.notify(name)
+        finally:
+            flusher.cancel()
+            process.close()
+
+    def notify(self, name):
+        #None asks for a full rescan instead of a single entry
+        self._pending.add(name)
+        self._changed.set()
+
+    async def flush(self):
+        while True:
+            await self._changed.wait()
+            #coalesce bursts such as an untar into one batch of events
+            await asyncio.sleep(COALESCE_DELAY)
+            self._changed.clear()
+            names, self._pending = self._pending, set()
+            try:
+                events = await (self.rescan() if None in names else self.check(names))
+            except asyncssh.SFTPError as e:
+                logger.warning('Watch refresh error for %s: %s', self.path, e)
+                continue
+            if events:
+                await self.on_events(self, events)
+
+    async def poll(self):
+        self.mode = 'poll'
+        mtime = None
+        settling = False
+        polls = 0
+        while True:
+            try:
+                info = await self.fs.stat(self.path)
+                moved = info['mtime'] != mtime
+                #mtime has one second resolution, so a change right after a rescan may not move it;
+                #one more relist on the next poll catches those
+                if moved or settling or polls % FULL_RESCAN_EVERY == 0:
+                    settling = moved
+                    mtime = info['mtime']
+                    events = await self.rescan()
+                else:
+                    events = None
+            except asyncssh.SFTPError:
+                #also when the directory goes between the stat and the relist
+                await self.on_events(self, [], gone=True)
+                return
+            if events:
+                await self.on_events(self, events)
+            polls += 1
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def rescan(self):
+        items = {item['name']: item for item in await self.fs.listdir(self.path)}
+        events = [{'event': 'remove', 'name': name, 'item': None} for name in self.items if name not in items]
+        for name, item in items.items():
+            old = self.items.get(name)
+            if old is None:
+                events.append({'event': 'add', 'name': name, 'item': item})
+            elif changed(old, item):
+                events.append({'event': 'modify', 'name': name, 'item': item})
+        self.items = items
+        return events
+
+    async def check(self, names):
+        names = sorted(names)
+        results = await asyncio.gather(*(self.fs.entry(self.path, name) for name in names), return_exceptions=True)
+        events = []
+        for name, item in zip(names, results):
+            old = self.items.get(name)
+            if isinstance(item, asyncssh.SFTPNoSuchFile):
+                if old is not None:
+                    del self.items[name]
+                    events.append({'event': 'remove', 'name': name, 'item': None})
+            elif isinstance(item, Exception):
+                continue
+            elif old is None:
+                self.items[name] = item
+                events.append({'event': 'add', 'name': name, 'item': item})
+            elif changed(old, item):
+                self.items[name] = item
+                events.append({'event': 'modify', 'name': name, 'item': item})
+        return events
@@ -1,4 +1,7 @@
 #!/bin/bash
 python manage.py migrate
 python manage.py collectstatic --noinput --clear
-daphne -b 0.0.0.0 console.asgi:application
\ No newline at end of file
+if [ "${WORKERS:-1}" -gt 1 ]; then
+    exec python manage.py serve --workers "$WORKERS"
+fi
+daphne -b 0.0.0.0 console.asgi:application